@@ -1,23 +1,55 @@
+import argparse
 import json
 import os
-from PIL import Image
+from coco_store import CocoStore, is_store, write_subset
+from image_size import default_cache_path, probe_sizes
+from mapping_index import MappingIndex
+from profiling import RunReport, add_report_args
 
-def add_hw_to_coco(coco_path, img_dir, out_path):
-    with open(coco_path, 'r', encoding='utf-8') as f:
-        coco = json.load(f)
+def svg_hints_for(img_dir, paths):
+    """{chemin image: chemin SVG} d'après l'index de mapping du dossier (SVG à côté des images)."""
+    by_image = MappingIndex(img_dir).svgs_by_image()
+    return {path: os.path.join(img_dir, sorted(by_image[os.path.basename(path)])[0])
+            for path in paths if os.path.basename(path) in by_image}
+
+def add_hw_to_coco(coco_path, img_dir, out_path, workers=8, cache_path=None, trust_svg=False):
+    # Un store .cocobin n'est lu que pour sa table d'images
+    if is_store(coco_path):
+        source = CocoStore(coco_path)
+        images = source.images
+    else:
+        with open(coco_path, 'r', encoding='utf-8') as f:
+            source = json.load(f)
+        images = source['images']
+    # Lecture des seuls en-têtes, en parallèle, avec cache disque (mtime, taille)
+    paths = [os.path.join(img_dir, img['file_name']) for img in images]
+    # La taille déclarée dans le SVG source sert de contrôle croisé (ou remplace la lecture si trust_svg)
+    sizes, errors, _ = probe_sizes(paths, workers=workers,
+                                   cache_path=cache_path or default_cache_path(img_dir),
+                                   svg_hints=svg_hints_for(img_dir, paths), trust_svg=trust_svg)
     missing = []
-    for img in coco['images']:
-        fn = img['file_name']
-        img_path = os.path.join(img_dir, fn)
-        try:
-            with Image.open(img_path) as im:
-                img['width'], img['height'] = im.size
-        except Exception as e:
-            missing.append((fn, str(e)))
-    with open(out_path, 'w', encoding='utf-8') as f:
-        json.dump(coco, f, ensure_ascii=False, indent=2)
-    print(f"Missing: {missing}, Total: {len(coco['images'])} images")
+    for img, img_path in zip(images, paths):
+        if img_path in sizes:
+            img['width'], img['height'] = sizes[img_path]
+        else:
+            missing.append((img['file_name'], errors[img_path]))
+    write_subset(source, out_path, images, ensure_ascii=False, indent=2)
+    print(f"Missing: {missing}, Total: {len(images)} images")
+
+def main():
+    parser = argparse.ArgumentParser(description="Ajoute width/height aux images des splits COCO")
+    parser.add_argument('--trust-svg', action='store_true',
+                        help='Prend la taille <width>/<height> des SVG sans lire les images (voie rapide)')
+    add_report_args(parser)
+    args = parser.parse_args()
+    report = RunReport('add_hw_to_coco', args.report, profile=args.profile)
+    with report.stage('train'):
+        add_hw_to_coco('annotations_train.json', 'dataset', 'annotations_train_with_hw.json',
+                       trust_svg=args.trust_svg)
+    with report.stage('val'):
+        add_hw_to_coco('annotations_val.json', 'dataset', 'annotations_val_with_hw.json',
+                       trust_svg=args.trust_svg)
+    report.close()
 
 if __name__ == "__main__":
-    add_hw_to_coco('annotations_train.json', 'dataset', 'annotations_train_with_hw.json')
-    add_hw_to_coco('annotations_val.json', 'dataset', 'annotations_val_with_hw.json')
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import time
+from detectron2.data import DatasetCatalog, build_detection_train_loader
+from detectron2.data.datasets import register_coco_instances
+from coco_store import CocoStore, is_store, load_coco, register_coco_store
+from image_cache import DEFAULT_CACHE_DIR, CachedDatasetMapper, ImageCache
+from rle_cache import register_rle_instances
+from train_detectron2_maskrcnn import build_cfg
+
+
+def time_loader(cfg, n_batches, warmup, mapper=None):
+    """Images/s du dataloader d'entraînement (sans passe avant du modèle)."""
+    loader = iter(build_detection_train_loader(cfg, mapper=mapper))
+    for _ in range(warmup):
+        next(loader)
+    n_images = 0
+    start = time.perf_counter()
+    for _ in range(n_batches):
+        n_images += len(next(loader))
+    return n_images / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du dataloader : polygones vs cache RLE vs cache d'images")
+    parser.add_argument('--ann', type=str, default='annotations_train_with_hw.json', help='Fichier COCO d\'entraînement')
+    parser.add_argument('--img_dir', type=str, default='dataset', help='Dossier des images')
+    parser.add_argument('--batches', type=int, default=50, help='Nombre de batchs mesurés')
+    parser.add_argument('--warmup', type=int, default=5, help='Batchs ignorés au démarrage')
+    parser.add_argument('--num_workers', type=int, default=2, help='cfg.DATALOADER.NUM_WORKERS')
+    parser.add_argument('--batch_size', type=int, default=2, help='Images par batch')
+    parser.add_argument('--image-cache-dir', type=str, default=DEFAULT_CACHE_DIR, help='Dossier du cache d\'images')
+    args = parser.parse_args()
+
+    if is_store(args.ann):
+        num_classes = len(CocoStore(args.ann).categories)
+    else:
+        num_classes = len(load_coco(args.ann)['categories'])
+
+    results = {}
+    for mode in ('polygon', 'rle', 'image_cache'):
+        name = f"bench_{mode}"
+        if mode in ('rle', 'image_cache'):
+            register_rle_instances(name, args.ann, args.img_dir)
+        elif is_store(args.ann):
+            register_coco_store(name, args.ann, args.img_dir)
+        else:
+            register_coco_instances(name, {}, args.ann, args.img_dir)
+        cfg = build_cfg(num_classes, batch_size=args.batch_size)
+        cfg.DATASETS.TRAIN = (name,)
+        cfg.DATALOADER.NUM_WORKERS = args.num_workers
+        mapper = None
+        if mode in ('rle', 'image_cache'):
+            cfg.INPUT.MASK_FORMAT = "bitmask"
+        if mode == 'image_cache':
+            # Mesure à cache chaud : le warmup ne suffit pas à décoder toutes les images
+            cache = ImageCache(args.image_cache_dir, cfg.INPUT.MAX_SIZE_TRAIN, image_format=cfg.INPUT.FORMAT)
+            for record in DatasetCatalog.get(name):
+                cache.get(record['file_name'])
+            mapper = CachedDatasetMapper(cfg, True, cache)
+        results[mode] = time_loader(cfg, args.batches, args.warmup, mapper)
+        print(f"  {mode:11s}: {results[mode]:.2f} images/s")
+    print(f"Rapport RLE / polygones : x{results['rle'] / results['polygon']:.2f}")
+    print(f"Rapport cache d'images + RLE / RLE : x{results['image_cache'] / results['rle']:.2f}")
+
+
+if __name__ == '__main__':
+    main()
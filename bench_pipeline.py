@@ -0,0 +1,265 @@
+"""Benchmark reproductible du pipeline de données sur un corpus synthétique.
+
+Le corpus (synthetic_plans.py) est généré une fois par jeu de paramètres,
+puis chaque étape est chronométrée séparément : parsing SVG, conversion,
+construction COCO, écriture/lecture JSON et .cocobin, split train/val
+(script complet), lecture des tailles d'images (cache froid puis chaud) et
+rastérisation des masques RLE. Les résultats (durée, CPU, pic de RSS,
+débit) sont écrits en JSON ; --save-baseline les enregistre comme
+référence et --compare signale les étapes plus lentes que la référence.
+
+Chaque étape garde le meilleur de --repeat exécutions (durée et pic de
+RSS) et l'écart entre ses deux exécutions les plus rapides (spread_s, le
+bruit sur ce meilleur temps, insensible à une répétition isolée très lente) :
+une étape n'est signalée que si elle dépasse référence x seuil + ce bruit. Une charge fixe (calibration_s) est chronométrée à chaque
+répétition ; la référence est mise à l'échelle de la vitesse de la machine
+au moment de la comparaison.
+
+    python bench_pipeline.py --count 1000 --save-baseline
+    python bench_pipeline.py --count 1000 --compare
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+from coco_store import CocoStore, load_coco, save_coco
+from image_size import default_cache_path, probe_sizes
+from mapping_index import MappingIndex, default_index_path
+from profiling import RunReport
+from rle_cache import ensure_rles, segmentation_key
+from svg_parser import parse_svg_file
+from svg_to_coco import build_coco, find_svg_files, iter_converted
+from synthetic_plans import ensure_corpus
+
+BENCH_VERSION = 2
+
+
+def corpus_key(args):
+    return f"n{args.count}_d{args.density}_s{args.seed}"
+
+
+def machine_info():
+    return {
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def calibrate():
+    """Durée (s) d'une charge fixe (JSON + tri, comme le pipeline) : vitesse de la machine à cet instant."""
+    data = [{'id': i, 'bbox': [i % 97, i % 89, 10.5, 20.25], 'segmentation': [[float(j) for j in range(i % 16, 32)]]}
+            for i in range(20000)]
+    start = time.perf_counter()
+    decoded = json.loads(json.dumps(data))
+    sorted(decoded, key=lambda a: (a['bbox'][0], -a['id']))
+    return time.perf_counter() - start
+
+
+def run_stages(corpus_dir, work_dir, workers, report):
+    """Exécute toutes les étapes une fois ; retourne {étape: mesures}."""
+    results = {}
+
+    def measure(name, items, func):
+        # Sorties des fonctions du pipeline masquées (listes de classes, barres de progression)
+        with report.stage(name) as entry, contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            value = func()
+        entry['items'] = items
+        entry['items_per_s'] = round(items / entry['wall_s'], 1) if entry['wall_s'] else None
+        results[name] = {k: entry[k] for k in ('wall_s', 'cpu_s', 'peak_rss_mb', 'items', 'items_per_s')}
+        return value
+
+    svg_files = find_svg_files(corpus_dir)
+    measure('parse', len(svg_files), lambda: [parse_svg_file(p) for p in svg_files])
+    records = measure('convert', len(svg_files), lambda: list(iter_converted(svg_files, workers)))
+    coco = measure('build_coco', len(svg_files), lambda: build_coco(records))
+    n_ann = len(coco['annotations'])
+    del records
+
+    json_path = os.path.join(work_dir, 'annotations.json')
+    store_path = os.path.join(work_dir, 'annotations.cocobin')
+    measure('save_json', n_ann, lambda: save_coco(coco, json_path, indent=2))
+    measure('load_json', n_ann, lambda: load_coco(json_path))
+    measure('save_store', n_ann, lambda: save_coco(coco, store_path))
+    measure('load_store', n_ann, lambda: sum(1 for _ in CocoStore(store_path).iter_annotations()))
+
+    # Split complet (script), avec index de mapping et lecture des tailles à froid : son propre rapport donne le pic mémoire
+    for cache in (default_cache_path(corpus_dir), default_index_path(corpus_dir)):
+        if os.path.isfile(cache):
+            os.remove(cache)
+    split_report = os.path.join(work_dir, 'split_report.json')
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'split_coco_train_val.py'),
+           '--coco', json_path, '--img_dir', corpus_dir, '--workers', str(max(workers, 1) * 4),
+           '--out_train', os.path.join(work_dir, 'train.json'), '--out_val', os.path.join(work_dir, 'val.json'),
+           '--report', split_report]
+    measure('split', len(svg_files), lambda: subprocess.run(cmd, check=True, capture_output=True))
+    with open(split_report, 'r', encoding='utf-8') as f:
+        results['split']['peak_rss_mb'] = json.load(f)['split_coco_train_val']['peak_rss_mb']
+
+    index = MappingIndex(corpus_dir)
+    png_paths = [os.path.join(corpus_dir, index.image_for(img['file_name'])) for img in coco['images']]
+    probe_cache = os.path.join(work_dir, 'sizes.json')
+    sizes = measure('probe_cold', len(png_paths),
+                    lambda: probe_sizes(png_paths, workers=max(workers, 1) * 4, cache_path=probe_cache)[0])
+    measure('probe_warm', len(png_paths),
+            lambda: probe_sizes(png_paths, workers=max(workers, 1) * 4, cache_path=probe_cache))
+
+    hw = {img['id']: sizes[path][::-1] for img, path in zip(coco['images'], png_paths) if path in sizes}
+    items = []
+    for ann in coco['annotations']:
+        h, w = hw[ann['image_id']]
+        items.append((segmentation_key(ann['segmentation'], h, w), ann['segmentation'], h, w))
+    measure('rasterize', len(items),
+            lambda: ensure_rles(items, os.path.join(work_dir, 'masks.rle.sqlite'), workers=workers))
+    return results
+
+
+def compare(current, baseline, threshold, min_delta):
+    """Lignes du tableau de comparaison et nombre d'étapes en régression.
+
+    Une étape est lente si sa durée dépasse référence x threshold plus le bruit
+    mesuré (spread_s de la référence + spread_s de la mesure), et d'au moins min_delta secondes.
+    La référence est d'abord multipliée par le rapport des calibrations (machine plus ou moins chargée).
+    """
+    regressions = 0
+    rows = []
+    speed = current['calibration_s'] / baseline['calibration_s']
+    rows.append(f"  Calibration {current['calibration_s']:.3f} s, réf {baseline['calibration_s']:.3f} s : "
+                f"référence x{speed:.2f}")
+    for name, cur in current['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is None:
+            rows.append(f"  {name:12s} {cur['wall_s']:9.3f} s  (pas de référence)")
+            continue
+        expected = base['wall_s'] * speed
+        ratio = cur['wall_s'] / expected if expected else float('inf')
+        mem_ratio = cur['peak_rss_mb'] / base['peak_rss_mb'] if base['peak_rss_mb'] else 1.0
+        noise = base.get('spread_s', 0.0) + cur.get('spread_s', 0.0)
+        flags = []
+        # Seuil absolu : les étapes très courtes sont trop bruitées pour un ratio seul
+        if cur['wall_s'] > expected * threshold + noise and cur['wall_s'] - expected > min_delta:
+            flags.append('[LENT]')
+        if mem_ratio > threshold:
+            flags.append('[MÉMOIRE]')
+        regressions += bool(flags)
+        rows.append(f"  {name:12s} {cur['wall_s']:9.3f} s  réf {expected:9.3f} s  x{ratio:5.2f}  "
+                    f"bruit {noise:6.3f} s  "
+                    f"RSS {cur['peak_rss_mb']:7.0f} / {base['peak_rss_mb']:7.0f} Mo  {' '.join(flags)}")
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du pipeline de données sur corpus synthétique")
+    parser.add_argument('--count', type=int, default=1000, help='Nombre de plans (ex. 1000, 10000, 100000)')
+    parser.add_argument('--density', type=int, default=80, help='Nombre moyen de polygones par plan')
+    parser.add_argument('--seed', type=int, default=0, help='Graine du corpus')
+    parser.add_argument('--workers', type=int, default=1, help='Processus pour la génération, la conversion et la rastérisation')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Répétitions (on garde la plus rapide par étape, l\'écart mesure le bruit)')
+    parser.add_argument('--corpus-root', type=str, default='bench_corpus', help='Dossier des corpus générés')
+    parser.add_argument('--baseline-dir', type=str, default='benchmarks', help='Dossier des références')
+    parser.add_argument('--save-baseline', action='store_true', help='Enregistre les résultats comme référence')
+    parser.add_argument('--compare', action='store_true', help='Compare à la référence (code de sortie 1 si régression)')
+    parser.add_argument('--threshold', type=float, default=1.25, help='Ratio à partir duquel une étape est signalée')
+    parser.add_argument('--min-delta', type=float, default=0.05, help='Écart minimal (s) pour signaler une lenteur')
+    parser.add_argument('--output', type=str, default=None, help='Fichier JSON des résultats (optionnel)')
+    args = parser.parse_args()
+
+    key = corpus_key(args)
+    corpus_dir = os.path.join(args.corpus_root, key)
+    ensure_corpus(corpus_dir, args.count, args.density, args.seed, workers=args.workers)
+    work_dir = os.path.join(args.corpus_root, f"_work_{key}")
+
+    if args.repeat < 2 and (args.compare or args.save_baseline):
+        print("[WARN] --repeat 1 : bruit de mesure inconnu, la comparaison ne repose que sur le seuil")
+    best = {}
+    walls = {}
+    peaks = {}
+    calibration = float('inf')
+    for run in range(args.repeat):
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        calibration = min(calibration, calibrate())
+        report = RunReport('bench_pipeline', os.path.join(work_dir, 'run_report.json'))
+        stages = run_stages(corpus_dir, work_dir, args.workers, report)
+        with contextlib.redirect_stdout(io.StringIO()):
+            report.close()
+        for name, entry in stages.items():
+            walls.setdefault(name, []).append(entry['wall_s'])
+            peaks.setdefault(name, []).append(entry['peak_rss_mb'])
+            if name not in best or entry['wall_s'] < best[name]['wall_s']:
+                best[name] = entry
+    shutil.rmtree(work_dir, ignore_errors=True)
+    for name, entry in best.items():
+        fastest = sorted(walls[name])[:2]
+        entry['spread_s'] = round(fastest[-1] - fastest[0], 3)
+        # Pic mémoire le plus bas : celui des répétitions suivantes inclut ce que les précédentes ont laissé
+        entry['peak_rss_mb'] = min(peaks[name])
+
+    results = {
+        'version': BENCH_VERSION,
+        'corpus': key,
+        'params': {'count': args.count, 'density': args.density, 'seed': args.seed,
+                   'workers': args.workers, 'repeat': args.repeat},
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'git_rev': git_revision(),
+        'machine': machine_info(),
+        'calibration_s': round(calibration, 4),
+        'stages': best,
+    }
+    print(f"Corpus {key} ({args.workers} workers, meilleur de {args.repeat}) :")
+    for name, entry in best.items():
+        print(f"  {name:12s} {entry['wall_s']:9.3f} s  écart {entry['spread_s']:6.3f} s  CPU {entry['cpu_s']:8.3f} s  "
+              f"RSS {entry['peak_rss_mb']:7.0f} Mo  {entry['items_per_s'] or 0:12.1f} /s")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    baseline_path = os.path.join(args.baseline_dir, f"baseline_{key}_w{args.workers}.json")
+    exit_code = 0
+    if args.compare:
+        if not os.path.isfile(baseline_path):
+            print(f"[ERREUR] Pas de référence {baseline_path} (lancer avec --save-baseline)")
+            sys.exit(2)
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('version') != BENCH_VERSION:
+            print(f"[ERREUR] Référence {baseline_path} au format v{baseline.get('version')} "
+                  f"(attendu v{BENCH_VERSION}) : la réenregistrer avec --save-baseline")
+            sys.exit(2)
+        if baseline.get('machine') != results['machine']:
+            print(f"[WARN] Référence mesurée sur une autre machine : {baseline.get('machine')}")
+        rows, regressions = compare(results, baseline, args.threshold, args.min_delta)
+        print(f"\nComparaison à {baseline_path} (réf. {baseline.get('git_rev')} du {baseline.get('date')}) :")
+        print('\n'.join(rows))
+        if regressions:
+            print(f"{regressions} étape(s) en régression (seuil x{args.threshold}).")
+            exit_code = 1
+        else:
+            print("Aucune régression.")
+    if args.save_baseline:
+        os.makedirs(args.baseline_dir, exist_ok=True)
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Référence enregistrée dans {baseline_path}")
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
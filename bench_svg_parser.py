@@ -0,0 +1,86 @@
+import argparse
+import glob
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+import numpy as np
+from svg_parser import parse_svg_file
+
+
+def legacy_parse_svg(svg_path):
+    """Ancien parseur de svg_to_coco (ElementTree complet + regex par paire de points)."""
+    tree = ET.parse(svg_path)
+    root = tree.getroot()
+    ns = {'svg': 'http://www.w3.org/2000/svg'}
+    classes = [c.text for c in root.findall('.//class')]
+    polygons = []
+    for poly in root.findall('.//svg:polygon', ns):
+        poly_class = poly.attrib.get('class', 'Unknown')
+        points_str = poly.attrib.get('points', '')
+        points = []
+        for pair in re.findall(r"[\d.]+[ ,][\d.]+", points_str):
+            nums = re.split(r"[ ,]", pair.strip())
+            if len(nums) == 2:
+                try:
+                    points.append((float(nums[0]), float(nums[1])))
+                except ValueError:
+                    continue
+        polygons.append({
+            'class': poly_class,
+            'points': points
+        })
+    return classes, polygons
+
+
+def time_parser(fn, files, repeat):
+    """Meilleur temps (s) sur `repeat` passes complètes du corpus."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in files:
+            fn(path)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def check_same_output(files):
+    """Vérifie que les deux parseurs extraient les mêmes polygones."""
+    for path in files:
+        _, old_polys = legacy_parse_svg(path)
+        new_polys = parse_svg_file(path)['polygons']
+        if len(old_polys) != len(new_polys):
+            return f"{path}: {len(old_polys)} != {len(new_polys)} polygones"
+        for old, new in zip(old_polys, new_polys):
+            old_pts = np.asarray(old['points'], dtype=np.float64).reshape(-1, 2)
+            if old['class'] != new['class'] or not np.array_equal(old_pts, new['points']):
+                return f"{path}: polygone différent ({old['class']})"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark : parseur SVG streaming vs ancien parseur")
+    parser.add_argument('--pattern', type=str, default='dataset/*.svg', help='Glob des SVG à parser')
+    parser.add_argument('--repeat', type=int, default=5, help='Nombre de passes (on garde la meilleure)')
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(args.pattern))
+    if not files:
+        print(f"Aucun fichier SVG trouvé pour {args.pattern}")
+        return
+    total_mb = sum(os.path.getsize(f) for f in files) / 1e6
+    print(f"{len(files)} fichiers SVG ({total_mb:.1f} Mo), {args.repeat} passes.")
+
+    diff = check_same_output(files)
+    if diff:
+        print(f"[WARN] Sorties différentes : {diff}")
+
+    t_old = time_parser(legacy_parse_svg, files, args.repeat)
+    t_new = time_parser(parse_svg_file, files, args.repeat)
+    print(f"  ancien parseur   : {t_old * 1000:8.1f} ms ({len(files) / t_old:8.1f} fichiers/s)")
+    print(f"  parseur streaming: {t_new * 1000:8.1f} ms ({len(files) / t_new:8.1f} fichiers/s)")
+    print(f"  accélération     : x{t_old / t_new:.2f}")
+
+
+if __name__ == '__main__':
+    main()
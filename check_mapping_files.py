@@ -1,24 +1,69 @@
-import os
-
-svg_dir = 'dataset'
-png_dir = 'dataset'
-missing_svg = []
-missing_png = []
-mapping = []
-
-with open('mapping_full.txt') as f:
-    lines = f.readlines()
-    mapping = [l for l in lines if l.startswith('[OK]')]
-
-for l in mapping:
-    parts = l.strip().split()
-    svg = parts[1]
-    png = parts[-1]
-    if not os.path.isfile(os.path.join(svg_dir, svg)):
-        missing_svg.append(svg)
-    if not os.path.isfile(os.path.join(png_dir, png)):
-        missing_png.append(png)
-
-print(f'Missing SVG: {missing_svg}')
-print(f'Missing PNG: {missing_png}')
-print(f'OK: {len(missing_svg)==0 and len(missing_png)==0}')
+"""Vérifie l'association SVG -> image du dataset à partir de l'index (mapping_index.py).
+
+Affiche les SVG sans image, les associations ambiguës et les images sans
+SVG ; avec --legacy, compare aussi d'anciens fichiers texte de mapping
+(lignes "[OK] a.svg associé à b.png" ou "a.svg --> b.png") à l'index.
+
+    python check_mapping_files.py dataset --legacy mapping.txt mapping_svg_png.txt mapping_full.txt
+"""
+import argparse
+import re
+import sys
+from mapping_index import MappingIndex
+
+_LEGACY_PATTERNS = [
+    re.compile(r'^\[OK\]\s+(\S+\.svg)\s+associé à\s+(\S+)'),
+    re.compile(r'^(\S+\.svg)\s+-->\s+(.+)$'),
+]
+
+
+def read_legacy_mapping(path):
+    """{SVG: image ou None} d'un ancien fichier de mapping texte."""
+    mapping = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            for pattern in _LEGACY_PATTERNS:
+                match = pattern.match(line.strip())
+                if match:
+                    target = match.group(2).strip()
+                    mapping[match.group(1)] = None if target.startswith('[') else target
+                    break
+    return mapping
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vérifie le mapping SVG -> image du dataset")
+    parser.add_argument('svg_dir', type=str, nargs='?', default='dataset', help='Dossier des SVG')
+    parser.add_argument('--img_dir', type=str, default=None, help='Dossier des images (défaut : svg_dir)')
+    parser.add_argument('--offset', type=int, default=None,
+                        help='Active la règle <n>_gt_k.svg -> <n+offset>.png')
+    parser.add_argument('--legacy', type=str, nargs='*', default=[], help='Anciens fichiers de mapping à comparer')
+    args = parser.parse_args()
+
+    index = MappingIndex(args.svg_dir, args.img_dir, offset=args.offset)
+    print(index.summary())
+    unresolved = index.unresolved()
+    ambiguous = index.ambiguous()
+    orphans = index.orphan_images()
+    for svg in unresolved:
+        print(f"[WARN] Aucune image pour {svg}")
+    for svg, image, reason in ambiguous:
+        print(f"[WARN] Association ambiguë {svg} -> {image} ({reason})")
+    if orphans:
+        print(f"{len(orphans)} images sans SVG : {orphans[:10]}{'...' if len(orphans) > 10 else ''}")
+
+    for path in args.legacy:
+        legacy = read_legacy_mapping(path)
+        diffs = [(svg, image, index.image_for(svg)) for svg, image in sorted(legacy.items())
+                 if image != index.image_for(svg)]
+        print(f"{path} : {len(legacy)} associations, {len(diffs)} en désaccord avec l'index")
+        for svg, image, expected in diffs[:20]:
+            print(f"  {svg}: {image} (index : {expected})")
+        if len(diffs) > 20:
+            print(f"  ... {len(diffs) - 20} autres")
+    print(f"OK: {not unresolved and not ambiguous}")
+    sys.exit(0 if not unresolved and not ambiguous else 1)
+
+
+if __name__ == '__main__':
+    main()
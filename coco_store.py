@@ -0,0 +1,393 @@
+"""Stockage binaire colonnaire des annotations COCO (format .cocobin).
+
+Un store est un dossier contenant :
+  - vertices.npy           float32 (V, 2)  tous les sommets de tous les polygones
+  - poly_offsets.npy       int64 (P + 1)   début de chaque polygone dans vertices
+  - ann_poly_offsets.npy   int64 (A + 1)   premier polygone de chaque annotation
+  - ann_*.npy              colonnes par annotation (id, image_id, category_id,
+                           bbox, area, iscrowd)
+  - image_ann_order.npy    int64 (A)       annotations triées par image
+  - image_ann_offsets.npy  int64 (I + 1)   plage de chaque image dans image_ann_order
+  - tables.json            images, categories, info, licenses
+
+Les tableaux sont ouverts en memory-map : on ne lit que ce qu'on consulte.
+load_coco / save_coco choisissent le format selon l'extension, ce qui permet
+aux scripts d'accepter indifféremment un .json ou un .cocobin.
+"""
+import hashlib
+import json
+import os
+import numpy as np
+from conversion_cache import file_hash
+from profiling import timed
+
+STORE_EXT = '.cocobin'
+STORE_VERSION = 1
+
+_ARRAYS = (
+    'vertices', 'poly_offsets', 'ann_poly_offsets',
+    'ann_ids', 'ann_image_ids', 'ann_category_ids', 'ann_bbox', 'ann_area', 'ann_iscrowd',
+    'image_ann_order', 'image_ann_offsets',
+)
+
+
+def is_store(path):
+    return path.rstrip('/\\').endswith(STORE_EXT)
+
+
+def content_hash(path):
+    """Hash du contenu d'un COCO JSON, ou de tous les fichiers d'un store .cocobin."""
+    if not is_store(path):
+        return file_hash(path)
+    h = hashlib.blake2b(digest_size=20)
+    for name in sorted(os.listdir(path)):
+        h.update(name.encode('utf-8'))
+        h.update(file_hash(os.path.join(path, name)).encode('ascii'))
+    return h.hexdigest()
+
+
+def _header(coco):
+    return {
+        'format': 'cocobin',
+        'version': STORE_VERSION,
+        'images': coco['images'],
+        'categories': coco['categories'],
+        'info': coco.get('info'),
+        'licenses': coco.get('licenses'),
+    }
+
+
+def _image_index(images, ann_image_ids):
+    """Ordre des annotations groupées par image (stable) et offsets par image."""
+    image_pos = {img['id']: i for i, img in enumerate(images)}
+    pos = np.fromiter((image_pos.get(i, len(images)) for i in ann_image_ids.tolist()),
+                      dtype=np.int64, count=len(ann_image_ids))
+    order = np.argsort(pos, kind='stable')
+    counts = np.bincount(pos, minlength=len(images) + 1)[:len(images)]
+    offsets = np.zeros(len(images) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return order, offsets
+
+
+def _concat_ranges(starts, counts):
+    """Indices de la concaténation des plages [start, start + count)."""
+    counts = np.asarray(counts, dtype=np.int64)
+    ends = np.cumsum(counts)
+    shift = np.repeat(np.asarray(starts, dtype=np.int64) - (ends - counts), counts)
+    return shift + np.arange(ends[-1] if len(ends) else 0, dtype=np.int64)
+
+
+def _write_arrays(path, header, arrays):
+    os.makedirs(path, exist_ok=True)
+    for name in _ARRAYS:
+        np.save(os.path.join(path, name + '.npy'), arrays[name])
+    with open(os.path.join(path, 'tables.json'), 'w', encoding='utf-8') as f:
+        json.dump(header, f, ensure_ascii=False)
+
+
+def _checked_annotation(ann, category_ids):
+    """ann, si son category_id figure dans la table des catégories (sinon ValueError explicite)."""
+    if ann.get('category_id') not in category_ids:
+        raise ValueError(f"Annotation {ann.get('id')} (image {ann.get('image_id')}) : category_id "
+                         f"{ann.get('category_id')!r} absent de la table des catégories {sorted(category_ids)}")
+    return ann
+
+
+@timed()
+def write_store(coco, path):
+    """Écrit un dict COCO (segmentation polygonale) au format .cocobin."""
+    annotations = coco['annotations']
+    n = len(annotations)
+    ann_ids = np.empty(n, dtype=np.int64)
+    ann_image_ids = np.empty(n, dtype=np.int64)
+    ann_category_ids = np.empty(n, dtype=np.int64)
+    ann_bbox = np.zeros((n, 4), dtype=np.float64)
+    ann_area = np.full(n, np.nan, dtype=np.float64)
+    ann_iscrowd = np.zeros(n, dtype=np.uint8)
+    ann_poly_offsets = np.zeros(n + 1, dtype=np.int64)
+    rings = []
+    category_ids = {cat['id'] for cat in coco['categories']}
+    for i, ann in enumerate(annotations):
+        _checked_annotation(ann, category_ids)
+        segmentation = ann.get('segmentation') or []
+        if isinstance(segmentation, dict):
+            raise ValueError(f"Annotation {ann.get('id')} : segmentation RLE non supportée par le format {STORE_EXT}")
+        ann_ids[i] = ann['id']
+        ann_image_ids[i] = ann['image_id']
+        ann_category_ids[i] = ann['category_id']
+        if ann.get('bbox') and len(ann['bbox']) == 4:
+            ann_bbox[i] = ann['bbox']
+        if ann.get('area') is not None:
+            ann_area[i] = ann['area']
+        ann_iscrowd[i] = ann.get('iscrowd', 0)
+        rings.extend(segmentation)
+        ann_poly_offsets[i + 1] = len(rings)
+    ring_sizes = np.fromiter((len(r) // 2 for r in rings), dtype=np.int64, count=len(rings))
+    poly_offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+    np.cumsum(ring_sizes, out=poly_offsets[1:])
+    vertices = np.fromiter(
+        (v for r in rings for v in r[:len(r) // 2 * 2]), dtype=np.float32, count=int(poly_offsets[-1]) * 2
+    ).reshape(-1, 2)
+    order, offsets = _image_index(coco['images'], ann_image_ids)
+    _write_arrays(path, _header(coco), {
+        'vertices': vertices, 'poly_offsets': poly_offsets, 'ann_poly_offsets': ann_poly_offsets,
+        'ann_ids': ann_ids, 'ann_image_ids': ann_image_ids, 'ann_category_ids': ann_category_ids,
+        'ann_bbox': ann_bbox, 'ann_area': ann_area, 'ann_iscrowd': ann_iscrowd,
+        'image_ann_order': order, 'image_ann_offsets': offsets,
+    })
+
+
+class CocoStore:
+    """Accès en lecture à un store .cocobin, avec des vues COCO à la demande."""
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with open(os.path.join(path, 'tables.json'), 'r', encoding='utf-8') as f:
+            header = json.load(f)
+        if header.get('format') != 'cocobin' or header.get('version') != STORE_VERSION:
+            raise ValueError(f"{path} : format de store non reconnu ({header.get('format')} v{header.get('version')})")
+        self.images = header['images']
+        self.categories = header['categories']
+        self.info = header.get('info')
+        self.licenses = header.get('licenses')
+        mode = 'r' if mmap else None
+        for name in _ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode=mode))
+        self._image_pos = {img['id']: i for i, img in enumerate(self.images)}
+
+    def __len__(self):
+        return len(self.ann_ids)
+
+    def polygons(self, index):
+        """Polygones (tableaux float32 (N, 2)) de l'annotation d'indice `index`."""
+        p0, p1 = self.ann_poly_offsets[index], self.ann_poly_offsets[index + 1]
+        offsets = self.poly_offsets[p0:p1 + 1]
+        return [self.vertices[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+
+    def annotation(self, index):
+        """Annotation d'indice `index`, au format dict COCO."""
+        ann = {
+            'id': int(self.ann_ids[index]),
+            'image_id': int(self.ann_image_ids[index]),
+            'category_id': int(self.ann_category_ids[index]),
+            'segmentation': [p.ravel().tolist() for p in self.polygons(index)],
+            'bbox': self.ann_bbox[index].tolist(),
+            'iscrowd': int(self.ann_iscrowd[index]),
+        }
+        area = float(self.ann_area[index])
+        if area == area:  # NaN = aire absente
+            ann['area'] = area
+        return ann
+
+    def annotation_indices(self, image_ids):
+        """Indices des annotations des images demandées (dans l'ordre des images)."""
+        parts = []
+        for image_id in image_ids:
+            pos = self._image_pos.get(image_id)
+            if pos is not None:
+                parts.append(self.image_ann_order[self.image_ann_offsets[pos]:self.image_ann_offsets[pos + 1]])
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    def annotations_for_image(self, image_id):
+        return [self.annotation(i) for i in self.annotation_indices([image_id]).tolist()]
+
+    def iter_annotations(self, indices=None):
+        if indices is None:
+            indices = range(len(self))
+        for i in indices:
+            yield self.annotation(int(i))
+
+    def to_coco(self, images=None):
+        """Dict COCO complet, ou restreint aux images données."""
+        if images is None:
+            images, indices = self.images, None
+        else:
+            indices = np.sort(self.annotation_indices([img['id'] for img in images]))
+        coco = {
+            'images': images,
+            'annotations': list(self.iter_annotations(indices)),
+            'categories': self.categories,
+        }
+        if self.info is not None:
+            coco['info'] = self.info
+        if self.licenses is not None:
+            coco['licenses'] = self.licenses
+        return coco
+
+    def save_subset(self, path, images, info=None, licenses=None):
+        """Écrit un nouveau store restreint aux images données, sans repasser par des dicts.
+
+        `images` peut contenir des entrées modifiées (file_name, width, ...).
+        """
+        indices = np.sort(self.annotation_indices([img['id'] for img in images]))
+        p0 = self.ann_poly_offsets[indices]
+        p1 = self.ann_poly_offsets[indices + 1]
+        poly_counts = p1 - p0
+        poly_idx = _concat_ranges(p0, poly_counts)
+        v0 = self.poly_offsets[poly_idx]
+        vert_counts = self.poly_offsets[poly_idx + 1] - v0
+        vert_idx = _concat_ranges(v0, vert_counts)
+        ann_poly_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(poly_counts, out=ann_poly_offsets[1:])
+        poly_offsets = np.zeros(len(poly_idx) + 1, dtype=np.int64)
+        np.cumsum(vert_counts, out=poly_offsets[1:])
+        ann_image_ids = np.asarray(self.ann_image_ids[indices])
+        order, offsets = _image_index(images, ann_image_ids)
+        header = _header({
+            'images': images,
+            'categories': self.categories,
+            'info': self.info if info is None else info,
+            'licenses': self.licenses if licenses is None else licenses,
+        })
+        _write_arrays(path, header, {
+            'vertices': np.asarray(self.vertices[vert_idx]),
+            'poly_offsets': poly_offsets, 'ann_poly_offsets': ann_poly_offsets,
+            'ann_ids': np.asarray(self.ann_ids[indices]), 'ann_image_ids': ann_image_ids,
+            'ann_category_ids': np.asarray(self.ann_category_ids[indices]),
+            'ann_bbox': np.asarray(self.ann_bbox[indices]), 'ann_area': np.asarray(self.ann_area[indices]),
+            'ann_iscrowd': np.asarray(self.ann_iscrowd[indices]),
+            'image_ann_order': order, 'image_ann_offsets': offsets,
+        })
+
+
+def update_store(path, info=None, licenses=None, area=None):
+    """Met à jour en place les tables info/licenses et/ou la colonne area d'un store."""
+    tables_path = os.path.join(path, 'tables.json')
+    with open(tables_path, 'r', encoding='utf-8') as f:
+        header = json.load(f)
+    if info is not None:
+        header['info'] = info
+    if licenses is not None:
+        header['licenses'] = licenses
+    with open(tables_path, 'w', encoding='utf-8') as f:
+        json.dump(header, f, ensure_ascii=False)
+    if area is not None:
+        np.save(os.path.join(path, 'ann_area.npy'), np.asarray(area, dtype=np.float64))
+
+
+@timed()
+def load_coco(path):
+    """Charge un fichier COCO (.json) ou un store (.cocobin) sous forme de dict."""
+    if is_store(path):
+        return CocoStore(path).to_coco()
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def read_categories(path):
+    """Table des catégories d'un COCO (.json) ou d'un store (sans charger les tableaux), triée par id."""
+    if is_store(path):
+        categories = CocoStore(path).categories
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            categories = json.load(f)['categories']
+    return sorted(categories, key=lambda c: c['id'])
+
+
+@timed()
+def save_coco(coco, path, **json_kwargs):
+    """Écrit un dict COCO en .cocobin ou en JSON (json_kwargs passés à json.dump)."""
+    if is_store(path):
+        write_store(coco, path)
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(coco, f, **json_kwargs)
+
+
+@timed()
+def dump_coco_stream(path, images, annotations, categories, info=None, licenses=None):
+    """Écrit un COCO JSON en flux : `annotations` peut être un itérable paresseux.
+
+    Une image / annotation par ligne ; le document complet n'est jamais
+    construit en mémoire. Une annotation dont le category_id n'est pas dans
+    `categories` lève ValueError (le fichier incomplet est supprimé).
+    """
+    def write_list(f, items):
+        f.write('[')
+        first = True
+        for item in items:
+            f.write('\n' if first else ',\n')
+            f.write(json.dumps(item, ensure_ascii=False, separators=(',', ':')))
+            first = False
+        f.write('\n]' if not first else ']')
+
+    category_ids = {cat['id'] for cat in categories}
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('{"images": ')
+            write_list(f, images)
+            f.write(',\n"annotations": ')
+            write_list(f, (_checked_annotation(ann, category_ids) for ann in annotations))
+            f.write(',\n"categories": ')
+            write_list(f, categories)
+            if info is not None:
+                f.write(',\n"info": ' + json.dumps(info, ensure_ascii=False))
+            if licenses is not None:
+                f.write(',\n"licenses": ' + json.dumps(licenses, ensure_ascii=False))
+            f.write('}\n')
+    except ValueError:
+        os.remove(path)
+        raise
+
+
+@timed()
+def write_subset(source, path, images, **json_kwargs):
+    """Écrit les images données (et leurs annotations) d'un dict COCO ou d'un CocoStore.
+
+    Entre deux stores, la copie se fait directement sur les tableaux.
+    """
+    if isinstance(source, CocoStore):
+        if is_store(path):
+            source.save_subset(path, images)
+            return
+        save_coco(source.to_coco(images), path, **json_kwargs)
+        return
+    image_ids = set(img['id'] for img in images)
+    coco = dict(source, images=images,
+                annotations=[ann for ann in source['annotations'] if ann['image_id'] in image_ids])
+    save_coco(coco, path, **json_kwargs)
+
+
+def load_detectron2_dicts(path, image_root):
+    """Dicts de dataset Detectron2 lus directement depuis un store .cocobin."""
+    from detectron2.structures import BoxMode
+
+    store = CocoStore(path)
+    # Même correspondance id COCO -> id contigu que register_coco_instances
+    cat_ids = sorted(cat['id'] for cat in store.categories)
+    id_map = {cat_id: i for i, cat_id in enumerate(cat_ids)}
+    dataset_dicts = []
+    for pos, img in enumerate(store.images):
+        indices = store.image_ann_order[store.image_ann_offsets[pos]:store.image_ann_offsets[pos + 1]]
+        objs = []
+        for i in indices.tolist():
+            objs.append({
+                'bbox': store.ann_bbox[i].tolist(),
+                'bbox_mode': BoxMode.XYWH_ABS,
+                'segmentation': [p.ravel().tolist() for p in store.polygons(i)],
+                'category_id': id_map[int(store.ann_category_ids[i])],
+                'iscrowd': int(store.ann_iscrowd[i]),
+            })
+        dataset_dicts.append({
+            'file_name': os.path.join(image_root, img['file_name']),
+            'height': img.get('height'),
+            'width': img.get('width'),
+            'image_id': img['id'],
+            'annotations': objs,
+        })
+    return dataset_dicts
+
+
+def register_coco_store(name, path, image_root):
+    """Équivalent de register_coco_instances pour un store .cocobin."""
+    from detectron2.data import DatasetCatalog, MetadataCatalog
+
+    store = CocoStore(path)
+    categories = sorted(store.categories, key=lambda c: c['id'])
+    DatasetCatalog.register(name, lambda: load_detectron2_dicts(path, image_root))
+    MetadataCatalog.get(name).set(
+        thing_classes=[c['name'] for c in categories],
+        thing_dataset_id_to_contiguous_id={c['id']: i for i, c in enumerate(categories)},
+        image_root=image_root,
+        evaluator_type='coco',
+    )
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+
+def file_hash(path):
+    """Hash (blake2b) du contenu d'un fichier."""
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def default_cache_path(output_path):
+    """Chemin du cache à côté du fichier de sortie (annotations.json -> annotations.cache.sqlite)."""
+    return os.path.splitext(output_path)[0] + '.cache.sqlite'
+
+
+class ConversionCache:
+    """Cache SQLite des résultats de conversion par fichier SVG.
+
+    Les entrées sont indexées par (hash du contenu, version) : un SVG
+    modifié ou un changement de version du parseur/convertisseur les rend
+    caduques. Les valeurs sont les dicts produits par svg_to_coco.convert_svg
+    (sans 'file_name', qui dépend du chemin et non du contenu).
+    """
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = str(version)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " hash TEXT NOT NULL, version TEXT NOT NULL, record TEXT NOT NULL,"
+            " PRIMARY KEY (hash, version))"
+        )
+
+    def get_many(self, hashes):
+        """Retourne {hash: record} pour les hash présents dans le cache."""
+        found = {}
+        wanted = list(set(hashes))
+        # Requêtes par lots : limite du nombre de paramètres SQLite
+        for i in range(0, len(wanted), 500):
+            batch = wanted[i:i + 500]
+            placeholders = ','.join('?' * len(batch))
+            rows = self.conn.execute(
+                f"SELECT hash, record FROM entries WHERE version = ? AND hash IN ({placeholders})",
+                [self.version] + batch
+            )
+            for h, record in rows:
+                found[h] = json.loads(record)
+        return found
+
+    def put_many(self, items):
+        """Enregistre une liste de (hash, record)."""
+        rows = []
+        for h, record in items:
+            record = {k: v for k, v in record.items() if k != 'file_name'}
+            rows.append((h, self.version, json.dumps(record, separators=(',', ':'))))
+        self.conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", rows)
+
+    def evict(self, keep_hashes):
+        """Supprime les entrées d'une autre version ou d'un contenu qui n'existe plus."""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep (hash TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM keep")
+        self.conn.executemany("INSERT OR IGNORE INTO keep VALUES (?)", ((h,) for h in keep_hashes))
+        cur = self.conn.execute(
+            "DELETE FROM entries WHERE version != ? OR hash NOT IN (SELECT hash FROM keep)",
+            (self.version,)
+        )
+        return cur.rowcount
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,47 @@
+"""Point d'entrée unique du pipeline : une sous-commande par script.
+
+Seul le module de la sous-commande demandée est importé, au moment de
+l'exécuter : `cvcsp.py convert ...` ne charge ni torch ni Detectron2, et
+`cvcsp.py train --dry-run` affiche le plan d'entraînement sans les importer.
+Les options après la sous-commande sont celles du script correspondant.
+
+    python cvcsp.py convert dataset --output annotations.json
+    python cvcsp.py split --coco annotations.json
+    python cvcsp.py probe
+    python cvcsp.py train --dry-run --sampling repeat
+    python cvcsp.py infer dataset/ --weights output_detectron2/model_final.pth
+    python cvcsp.py render dataset --out overlays
+    python cvcsp.py train --help         # options d'une sous-commande
+"""
+import argparse
+import importlib
+import sys
+
+# Sous-commande -> (module, description)
+COMMANDS = {
+    'convert': ('svg_to_coco', 'Conversion SVG -> COCO'),
+    'split': ('split_coco_train_val', 'Split train/val et mapping SVG -> image'),
+    'probe': ('add_hw_to_coco', 'Ajout width/height (lecture des en-têtes d\'images)'),
+    'train': ('train_detectron2_maskrcnn', 'Entraînement Mask R-CNN (--dry-run : plan seul)'),
+    'infer': ('infer_detectron2', 'Inférence CPU par batchs'),
+    'render': ('render_overlays', 'Rendu des annotations sur les plans (QA)'),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='cvcsp', description="Pipeline plans 2D : conversion, split, entraînement, inférence",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='\n'.join(f"  {name:8s} {description}" for name, (_, description) in COMMANDS.items()))
+    parser.add_argument('command', choices=COMMANDS, metavar='commande', help=', '.join(COMMANDS))
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Options de la sous-commande')
+    args = parser.parse_args(argv)
+
+    module = importlib.import_module(COMMANDS[args.command][0])
+    # Le main() du script lit sys.argv : il voit ses propres options, et son --help porte le bon nom
+    sys.argv = [f"cvcsp {args.command}"] + args.args
+    return module.main()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
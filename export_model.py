@@ -0,0 +1,151 @@
+"""Export du Mask R-CNN entraîné en TorchScript (tracé) et ONNX, avec contrôle de parité.
+
+Le modèle est exporté sans post-traitement (sorties à la résolution
+d'entrée du réseau, masques 28x28) : le redimensionnement et le collage
+des masques sont refaits par fast_predictor.py, qui n'importe pas
+Detectron2. Un fichier export_meta.json décrit le prétraitement et l'ordre
+des sorties.
+"""
+import argparse
+import json
+import os
+import numpy as np
+import torch
+from detectron2.data import transforms as T
+from detectron2.data.detection_utils import read_image
+from detectron2.export import TracingAdapter
+from coco_store import load_coco
+from infer_detectron2 import load_predictor
+
+
+def load_samples(coco_path, img_dir, cfg, limit):
+    """Images du split val, prétraitées comme DefaultPredictor."""
+    coco = load_coco(coco_path)
+    aug = T.ResizeShortestEdge([cfg.INPUT.MIN_SIZE_TEST, cfg.INPUT.MIN_SIZE_TEST], cfg.INPUT.MAX_SIZE_TEST)
+    samples = []
+    for img in coco['images'][:limit]:
+        image = read_image(os.path.join(img_dir, img['file_name']), format=cfg.INPUT.FORMAT)
+        resized = aug.get_transform(image).apply_image(image)
+        samples.append(torch.as_tensor(np.ascontiguousarray(resized.transpose(2, 0, 1))))
+    return samples
+
+
+def quantize_heads(model):
+    """Quantification dynamique int8 des couches linéaires des têtes ROI."""
+    model.roi_heads = torch.ao.quantization.quantize_dynamic(model.roi_heads, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def raw_inference(model, inputs):
+    """Sortie tracée : comme eager_outputs, sans post-traitement (masques ROI (N, 1, 28, 28) collés ensuite
+    par fast_predictor.paste_masks), comme l'export de detectron2 (tools/deploy)."""
+    instances = model.inference(inputs, do_postprocess=False)[0]
+    return [{'instances': instances}]
+
+
+def eager_outputs(model, image):
+    with torch.inference_mode():
+        instances = model.inference([{'image': image}], do_postprocess=False)[0]
+    fields = instances.get_fields()
+    # Même ordre que l'aplatissement de TracingAdapter (champs triés par nom)
+    return [fields[k].tensor if k == 'pred_boxes' else fields[k] for k in sorted(fields)]
+
+
+def compare(reference, candidate):
+    """Écart max entre deux listes de sorties ; None si le nombre d'instances diffère."""
+    if len(reference[0]) != len(candidate[0]):
+        return None
+    diffs = [float(np.abs(np.asarray(r, dtype=np.float64) - np.asarray(c, dtype=np.float64)).max(initial=0.0))
+             for r, c in zip(reference, candidate)]
+    return max(diffs, default=0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export TorchScript / ONNX du Mask R-CNN entraîné")
+    parser.add_argument('--weights', type=str, default='output_detectron2/model_final.pth', help='Checkpoint entraîné')
+    parser.add_argument('--coco', type=str, default='annotations_val_with_hw.json', help='Split val (parité + catégories)')
+    parser.add_argument('--img_dir', type=str, default='dataset', help='Dossier des images')
+    parser.add_argument('--out_dir', type=str, default='output_detectron2/export', help='Dossier des artefacts')
+    parser.add_argument('--formats', type=str, default='torchscript,onnx', help='Formats (torchscript, onnx)')
+    parser.add_argument('--int8', action='store_true', help='Exporte aussi une variante TorchScript à têtes int8')
+    parser.add_argument('--parity-images', type=int, default=8, help='Images val utilisées pour la parité')
+    parser.add_argument('--atol', type=float, default=1e-3, help='Tolérance absolue de parité')
+    args = parser.parse_args()
+
+    formats = [f.strip() for f in args.formats.split(',') if f.strip()]
+    os.makedirs(args.out_dir, exist_ok=True)
+    categories = sorted(load_coco(args.coco)['categories'], key=lambda c: c['id'])
+    cfg, model = load_predictor(args.weights, categories)
+    samples = load_samples(args.coco, args.img_dir, cfg, args.parity_images)
+    if not samples:
+        raise SystemExit(f"Aucune image de parité trouvée dans {args.coco}")
+
+    adapter = TracingAdapter(model, [{'image': samples[0]}], raw_inference)
+    with torch.inference_mode():
+        sample_out = model.inference([{'image': samples[0]}], do_postprocess=False)[0]
+    meta = {
+        'input_format': cfg.INPUT.FORMAT,
+        'min_size_test': cfg.INPUT.MIN_SIZE_TEST,
+        'max_size_test': cfg.INPUT.MAX_SIZE_TEST,
+        'output_fields': sorted(sample_out.get_fields()),
+        'categories': categories,
+        'score_thresh': cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST,
+        'artifacts': {},
+    }
+    references = [eager_outputs(model, image) for image in samples]
+
+    def check(name, run):
+        worst = 0.0
+        for image, ref in zip(samples, references):
+            with torch.inference_mode():
+                candidate = run(image)
+            diff = compare([t.numpy() for t in ref], candidate)
+            if diff is None:
+                print(f"[WARN] {name} : nombre d'instances différent du modèle eager")
+                return False
+            worst = max(worst, diff)
+        ok = worst <= args.atol
+        print(f"Parité {name} : écart max {worst:.2e} sur {len(samples)} images -> {'OK' if ok else 'ÉCHEC'}")
+        return ok
+
+    if 'torchscript' in formats:
+        with torch.inference_mode():
+            traced = torch.jit.trace(adapter, adapter.flattened_inputs)
+        path = os.path.join(args.out_dir, 'model.ts')
+        traced.save(path)
+        meta['artifacts']['torchscript'] = {
+            'path': 'model.ts',
+            'parity': check('torchscript', lambda im: [t.numpy() for t in traced(im)]),
+        }
+        if args.int8:
+            q_model = quantize_heads(load_predictor(args.weights, categories)[1])
+            q_adapter = TracingAdapter(q_model, [{'image': samples[0]}], raw_inference)
+            with torch.inference_mode():
+                q_traced = torch.jit.trace(q_adapter, q_adapter.flattened_inputs)
+            q_traced.save(os.path.join(args.out_dir, 'model_int8.ts'))
+            # Écart attendu (quantification) : informatif uniquement
+            meta['artifacts']['torchscript_int8'] = {'path': 'model_int8.ts'}
+            check('torchscript int8', lambda im: [t.numpy() for t in q_traced(im)])
+
+    if 'onnx' in formats:
+        path = os.path.join(args.out_dir, 'model.onnx')
+        torch.onnx.export(adapter, adapter.flattened_inputs, path, opset_version=16,
+                          input_names=['image'], output_names=meta['output_fields'],
+                          dynamic_axes={'image': {1: 'height', 2: 'width'}})
+        parity = None
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            print("[WARN] onnxruntime absent : parité ONNX non vérifiée")
+        else:
+            session = ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+            parity = check('onnx', lambda im: session.run(None, {'image': im.numpy()}))
+        meta['artifacts']['onnx'] = {'path': 'model.onnx', 'parity': parity}
+
+    with open(os.path.join(args.out_dir, 'export_meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
+    print(f"Artefacts écrits dans {args.out_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,8 @@
-import xml.etree.ElementTree as ET
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
-import re
+from matplotlib.collections import PolyCollection
 import argparse
+from svg_parser import parse_svg_file
 
 # Fichier SVG à lire
 SVG_FILE = "dataset/1_gt_14.svg"
@@ -17,49 +17,34 @@ DEFAULT_COLORS = {
 }
 
 def parse_svg_polygons(svg_path):
-    tree = ET.parse(svg_path)
-    root = tree.getroot()
-
-    # Namespace SVG (si présent)
-    ns = {'svg': 'http://www.w3.org/2000/svg'}
-
-    # Extraire toutes les classes (sans namespace)
-    classes = [c.text for c in root.findall('.//class')]
+    parsed = parse_svg_file(svg_path, with_fill=True)
+    polygons = parsed['polygons']
+    for poly in polygons:
+        if poly['fill'] is None:
+            poly['fill'] = DEFAULT_COLORS.get(poly['class'], '#CCCCCC')
+    return parsed['classes'], polygons
 
-    # Extraire tous les polygones (avec namespace SVG)
-    polygons = []
-    for poly in root.findall('.//svg:polygon', ns):
-        poly_class = poly.attrib.get('class', 'Unknown')
-        fill = poly.attrib.get('fill', DEFAULT_COLORS.get(poly_class, '#CCCCCC'))
-        points_str = poly.attrib.get('points', '')
-        # Extraire les points, robustement (supporte espace ou virgule comme séparateur)
-        points = []
-        for pair in re.findall(r"[\d.]+[ ,][\d.]+", points_str):
-            nums = re.split(r"[ ,]", pair.strip())
-            if len(nums) == 2:
-                try:
-                    points.append((float(nums[0]), float(nums[1])))
-                except ValueError:
-                    continue
-        polygons.append({
-            'class': poly_class,
-            'fill': fill,
-            'points': points
-        })
-    return classes, polygons
+def plot_svg_polygons(classes, polygons, output=None):
+    """Affiche le plan, ou l'enregistre dans `output` (backend Agg, sans fenêtre).
 
-def plot_svg_polygons(classes, polygons):
+    Une seule PolyCollection par classe (au lieu d'un patch par polygone).
+    Pour des répertoires entiers, voir render_overlays.py.
+    """
+    if output:
+        plt.switch_backend('Agg')
     fig, ax = plt.subplots(figsize=(12, 10))
-    legend_handles = {}
+    by_class = {}
     for poly in polygons:
-        pts = poly["points"]
-        if len(pts) < 3:
+        if len(poly["points"]) < 3:
             continue  # Un polygone doit avoir au moins 3 points
-        polygon_patch = patches.Polygon(pts, closed=True, facecolor=poly["fill"], edgecolor='black', linewidth=1, alpha=0.7, label=poly["class"])
-        ax.add_patch(polygon_patch)
-        # Préparer la légende
-        if poly["class"] not in legend_handles:
-            legend_handles[poly["class"]] = polygon_patch
+        by_class.setdefault(poly["class"], []).append(poly)
+    legend_handles = {}
+    for cname, polys in by_class.items():
+        ax.add_collection(PolyCollection([p["points"] for p in polys], closed=True,
+                                         facecolors=[p["fill"] for p in polys], edgecolors='black',
+                                         linewidths=1, alpha=0.7))
+        # Préparer la légende (couleur du premier polygone de la classe)
+        legend_handles[cname] = patches.Patch(facecolor=polys[0]["fill"], edgecolor='black', alpha=0.7)
     ax.autoscale()
     ax.set_aspect('equal')
     plt.title("Plan SVG avec légende")
@@ -67,11 +52,16 @@ def plot_svg_polygons(classes, polygons):
     plt.ylabel("y")
     plt.legend(legend_handles.values(), legend_handles.keys(), loc='upper right', bbox_to_anchor=(1.2, 1))
     plt.tight_layout()
-    plt.show()
+    if output:
+        fig.savefig(output, dpi=100)
+        plt.close(fig)
+    else:
+        plt.show()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Extrait et affiche les polygones d'un fichier SVG.")
     parser.add_argument("svg_file", type=str, help="Chemin du fichier SVG à traiter")
+    parser.add_argument("--output", type=str, default=None, help="Image de sortie (pas de fenêtre)")
     args = parser.parse_args()
 
     classes, polygons = parse_svg_polygons(args.svg_file)
@@ -80,4 +70,4 @@ if __name__ == "__main__":
     if len(polygons) == 0:
         print("Aucun polygone extrait. Vérifiez la structure du SVG ou le parsing des points.")
     else:
-        plot_svg_polygons(classes, polygons)
+        plot_svg_polygons(classes, polygons, args.output)
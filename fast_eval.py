@@ -0,0 +1,318 @@
+"""Évaluation COCO rapide des masques (segm) et évaluation asynchrone pendant l'entraînement.
+
+evaluate_segm reproduit le protocole COCOeval pour la segmentation (IoU de
+masques, seuils 0.50:0.95, 100 détections par image et par classe,
+précision interpolée sur 101 points de rappel), sans les tranches d'aire :
+les IoU sont calculées par pycocotools directement sur les RLE, et
+l'appariement glouton est vectorisé sur les seuils et les vérités terrain.
+Les masques de vérité terrain viennent du cache RLE (rle_cache.py).
+
+AsyncEvalHook lance cette évaluation toutes les N itérations dans un
+processus séparé, sur une copie des poids : la boucle d'entraînement
+n'attend pas. Les résultats sont ajoutés à async_eval.jsonl et peuvent
+déclencher un arrêt anticipé (EarlyStop).
+"""
+import argparse
+import json
+import os
+from collections import defaultdict
+import numpy as np
+from pycocotools import mask as mask_util
+from coco_store import load_coco
+from rle_cache import default_cache_path, ensure_rles, segmentation_key
+
+try:
+    from detectron2.engine import HookBase
+except ImportError:  # évaluation de fichiers JSONL (CLI) sans Detectron2
+    HookBase = object
+
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+RECALL_POINTS = np.linspace(0.0, 1.0, 101)
+
+
+def load_ground_truth(ann_path, cache_path=None):
+    """{(image_id, category_id): [RLE, ...]} depuis le cache RLE (calculé si absent).
+
+    Les annotations iscrowd sont ignorées (aucune dans nos données).
+    """
+    coco = load_coco(ann_path)
+    sizes = {img['id']: (img.get('height'), img.get('width')) for img in coco['images']}
+    keyed = []
+    for ann in coco['annotations']:
+        h, w = sizes.get(ann['image_id'], (None, None))
+        seg = ann.get('segmentation')
+        if ann.get('iscrowd', 0) or not h or not w or not isinstance(seg, list) or not seg:
+            continue
+        keyed.append(((ann['image_id'], ann['category_id']), (segmentation_key(seg, h, w), seg, h, w)))
+    found = ensure_rles([item for _, item in keyed], cache_path or default_cache_path(ann_path))
+    gt = defaultdict(list)
+    for group, (key, _, _, _) in keyed:
+        rle = found[key]
+        gt[group].append({'size': rle['size'], 'counts': rle['counts']})
+    return coco, gt
+
+
+def match_detections(ious, thresholds=IOU_THRESHOLDS):
+    """Appariement glouton COCO (détections triées par score décroissant).
+
+    ious : (D, G). Retourne tp (T, D) booléen : pour chaque seuil, la
+    détection d est un vrai positif si elle prend la vérité terrain libre de
+    meilleure IoU >= seuil. Boucle sur les détections seulement.
+    """
+    n_det, n_gt = ious.shape
+    tp = np.zeros((len(thresholds), n_det), dtype=bool)
+    if not n_gt:
+        return tp
+    matched = np.zeros((len(thresholds), n_gt), dtype=bool)
+    rows = np.arange(len(thresholds))
+    for d in range(n_det):
+        candidates = np.where((ious[d] >= thresholds[:, None]) & ~matched, ious[d], -1.0)
+        best = candidates.argmax(axis=1)
+        ok = candidates[rows, best] >= 0
+        tp[ok, d] = True
+        matched[rows[ok], best[ok]] = True
+    return tp
+
+
+def average_precision(scores, tp, n_gt):
+    """AP (T,) par seuil : précision enveloppe interpolée sur 101 points de rappel."""
+    if not n_gt:
+        return np.full(tp.shape[0], np.nan)
+    if not len(scores):
+        return np.zeros(tp.shape[0])
+    order = np.argsort(-scores, kind='mergesort')
+    tps = np.cumsum(tp[:, order], axis=1)
+    fps = np.cumsum(~tp[:, order], axis=1)
+    recall = tps / n_gt
+    precision = tps / np.maximum(tps + fps, np.spacing(1))
+    # Enveloppe décroissante de la précision (de droite à gauche)
+    precision = np.maximum.accumulate(precision[:, ::-1], axis=1)[:, ::-1]
+    ap = np.zeros(tp.shape[0])
+    for t in range(tp.shape[0]):
+        idx = np.searchsorted(recall[t], RECALL_POINTS, side='left')
+        valid = idx < len(order)
+        ap[t] = precision[t, idx[valid]].sum() / len(RECALL_POINTS)
+    return ap
+
+
+def metric_names(categories):
+    """Clés des résultats de evaluate_segm (métriques possibles pour l'arrêt anticipé)."""
+    return ['AP', 'AP50', 'AP75'] + [f"AP-{cat['name']}" for cat in categories]
+
+
+def evaluate_segm(gt, dt, categories, max_dets=100):
+    """AP de segmentation façon COCOeval, par classe et global (en %, comme Detectron2).
+
+    gt : {(image_id, category_id): [RLE]} ; dt : {(image_id, category_id): [(score, RLE)]}.
+    """
+    results = {}
+    per_class = []
+    per_class_50 = []
+    per_class_75 = []
+    for cat in categories:
+        cat_id = cat['id']
+        image_ids = {img for img, c in gt if c == cat_id} | {img for img, c in dt if c == cat_id}
+        n_gt = 0
+        all_scores = []
+        all_tp = []
+        # Ordre des images trié comme COCOeval : départage des scores égaux reproductible
+        for image_id in sorted(image_ids):
+            gts = gt.get((image_id, cat_id), [])
+            dets = sorted(dt.get((image_id, cat_id), []), key=lambda d: -d[0])[:max_dets]
+            n_gt += len(gts)
+            if not dets:
+                continue
+            if gts:
+                ious = np.asarray(mask_util.iou([d[1] for d in dets], gts, [0] * len(gts))).reshape(len(dets), len(gts))
+            else:
+                ious = np.zeros((len(dets), 0))
+            all_scores.append(np.array([d[0] for d in dets], dtype=np.float64))
+            all_tp.append(match_detections(ious))
+        scores = np.concatenate(all_scores) if all_scores else np.zeros(0)
+        tp = np.concatenate(all_tp, axis=1) if all_tp else np.zeros((len(IOU_THRESHOLDS), 0), dtype=bool)
+        ap = average_precision(scores, tp, n_gt)
+        results[f"AP-{cat['name']}"] = float(np.mean(ap)) * 100
+        per_class.append(np.mean(ap))
+        per_class_50.append(ap[0])
+        per_class_75.append(ap[5])
+    with np.errstate(invalid='ignore'):
+        results['AP'] = float(np.nanmean(per_class)) * 100 if per_class else float('nan')
+        results['AP50'] = float(np.nanmean(per_class_50)) * 100 if per_class else float('nan')
+        results['AP75'] = float(np.nanmean(per_class_75)) * 100 if per_class else float('nan')
+    return results
+
+
+def load_predictions(path, coco):
+    """Résultats COCO en JSONL (infer_detectron2.py) -> {(image_id, category_id): [(score, RLE)]}."""
+    by_name = {img['file_name']: img['id'] for img in coco['images']}
+    dt = defaultdict(list)
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            pred = json.loads(line)
+            if 'segmentation' not in pred:
+                continue
+            image_id = pred['image_id']
+            if isinstance(image_id, str):
+                image_id = by_name.get(image_id, image_id)
+            dt[(image_id, pred['category_id'])].append((pred['score'], pred['segmentation']))
+    return dt
+
+
+def format_results(results, categories):
+    lines = [f"AP {results['AP']:.1f} | AP50 {results['AP50']:.1f} | AP75 {results['AP75']:.1f}"]
+    for cat in categories:
+        value = results[f"AP-{cat['name']}"]
+        lines.append(f"  {cat['name']:12s}: {'n/a' if value != value else f'{value:.1f}'}")
+    return '\n'.join(lines)
+
+
+def _predict_and_evaluate(cfg, snapshot, ann_path, image_root, cache_path, threads):
+    """Exécuté dans le processus d'évaluation : prédit le split val avec la copie des poids puis l'évalue."""
+    import torch
+    from detectron2.checkpoint import DetectionCheckpointer
+    from detectron2.modeling import build_model
+    from infer_detectron2 import Preprocessor, instances_to_results
+
+    if threads:
+        torch.set_num_threads(threads)
+    model = build_model(cfg)
+    DetectionCheckpointer(model).load(snapshot)
+    model.eval()
+    coco, gt = load_ground_truth(ann_path, cache_path)
+    categories = sorted(coco['categories'], key=lambda c: c['id'])
+    contiguous_to_cat = [c['id'] for c in categories]
+    preprocess = Preprocessor(cfg)
+    dt = defaultdict(list)
+    for img in coco['images']:
+        _, _, units, _ = preprocess(os.path.join(image_root, img['file_name']))
+        with torch.inference_mode():
+            instances = model([units[0][1]])[0]['instances'].to('cpu')
+        for result in instances_to_results(instances, img['id'], contiguous_to_cat):
+            if 'segmentation' in result:
+                dt[(img['id'], result['category_id'])].append((result['score'], result['segmentation']))
+    return evaluate_segm(gt, dt, categories)
+
+
+class EarlyStop(BaseException):
+    """Levée par AsyncEvalHook quand la métrique suivie ne progresse plus.
+
+    BaseException (comme KeyboardInterrupt) : le `except Exception` de
+    TrainerBase.train ne la journalise pas comme une erreur d'entraînement.
+    """
+
+
+class AsyncEvalHook(HookBase):
+    """Évaluation périodique dans un processus séparé, avec arrêt anticipé optionnel.
+
+    Toutes les `period` itérations, les poids sont copiés sur disque et
+    évalués par un processus unique ; si l'évaluation précédente n'est pas
+    terminée, l'échéance est sautée plutôt que de bloquer l'entraînement.
+    Le meilleur instantané est conservé dans model_best.pth (itération best_iter) ;
+    l'entraînement le recharge avant l'évaluation finale.
+    """
+
+    def __init__(self, cfg, period, ann_path, image_root, metric='AP', patience=0, min_delta=0.0,
+                 device='cpu', threads=4):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        from rle_cache import build_rle_cache
+
+        self.categories = sorted(load_coco(ann_path)['categories'], key=lambda c: c['id'])
+        if metric not in metric_names(self.categories):
+            raise ValueError(f"Métrique inconnue : {metric!r} (possibles : {', '.join(metric_names(self.categories))})")
+        self.period = period
+        self.ann_path = ann_path
+        self.image_root = image_root
+        self.metric = metric
+        self.patience = patience
+        self.min_delta = min_delta
+        self.threads = threads
+        self.output_dir = cfg.OUTPUT_DIR
+        self.eval_cfg = cfg.clone()
+        self.eval_cfg.MODEL.DEVICE = device
+        # Vérité terrain rastérisée une fois ici, le processus d'évaluation ne fait que la relire
+        self.cache_path = build_rle_cache(ann_path)
+        # spawn : le processus parent peut déjà avoir initialisé CUDA
+        self.executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+        self.pending = None
+        self.best = None
+        self.best_iter = None
+        self.bad_evals = 0
+
+    def _submit(self, iteration):
+        import torch
+
+        model = getattr(self.trainer.model, 'module', self.trainer.model)
+        snapshot = os.path.join(self.output_dir, f"async_eval_{iteration:07d}.pth")
+        torch.save({'model': {k: v.detach().cpu() for k, v in model.state_dict().items()}}, snapshot)
+        future = self.executor.submit(_predict_and_evaluate, self.eval_cfg, snapshot, self.ann_path,
+                                      self.image_root, self.cache_path, self.threads)
+        self.pending = (iteration, snapshot, future)
+
+    def _collect(self):
+        iteration, snapshot, future = self.pending
+        self.pending = None
+        try:
+            results = future.result()
+        except Exception as e:
+            print(f"[ERREUR] Évaluation asynchrone (itération {iteration}) : {e}")
+            os.remove(snapshot)
+            return
+        with open(os.path.join(self.output_dir, 'async_eval.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(dict(results, iteration=iteration)) + '\n')
+        self.trainer.storage.put_scalars(**{f"async_eval/{k}": v for k, v in results.items() if v == v},
+                                         smoothing_hint=False)
+        print(f"Évaluation asynchrone (itération {iteration}) : {format_results(results, self.categories)}")
+
+        value = results[self.metric]
+        if value != value:
+            # NaN (ex. classe absente du split val) : évaluation sans effet sur l'arrêt anticipé
+            print(f"[WARN] {self.metric} indéfini à l'itération {iteration} : évaluation non comptée")
+            os.remove(snapshot)
+            return
+        if self.best is None or value > self.best + self.min_delta:
+            self.best, self.best_iter, self.bad_evals = value, iteration, 0
+            os.replace(snapshot, os.path.join(self.output_dir, 'model_best.pth'))
+        else:
+            self.bad_evals += 1
+            os.remove(snapshot)
+        if self.patience and self.bad_evals >= self.patience:
+            raise EarlyStop(f"{self.metric} sans amélioration depuis {self.bad_evals} évaluations "
+                            f"(meilleur {self.best:.2f} à l'itération {self.best_iter})")
+
+    def after_step(self):
+        if self.pending is not None and self.pending[2].done():
+            self._collect()
+        next_iter = self.trainer.iter + 1
+        if next_iter % self.period or next_iter >= self.trainer.max_iter:
+            return
+        if self.pending is None:
+            self._submit(next_iter)
+        else:
+            print(f"[WARN] Évaluation de l'itération {self.pending[0]} encore en cours : itération {next_iter} sautée")
+
+    def after_train(self):
+        try:
+            if self.pending is not None:
+                self._collect()
+        except EarlyStop:
+            pass
+        finally:
+            self.executor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Évaluation COCO rapide (segmentation) de prédictions JSONL")
+    parser.add_argument('annotations', type=str, help='Fichier COCO de vérité terrain (.json ou .cocobin, avec width/height)')
+    parser.add_argument('predictions', type=str, help='Prédictions JSONL (infer_detectron2.py)')
+    parser.add_argument('--cache', type=str, default=None, help='Cache RLE de la vérité terrain (défaut : à côté des annotations)')
+    args = parser.parse_args()
+
+    coco, gt = load_ground_truth(args.annotations, args.cache)
+    categories = sorted(coco['categories'], key=lambda c: c['id'])
+    results = evaluate_segm(gt, load_predictions(args.predictions, coco), categories)
+    print(format_results(results, categories))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""Prédicteur CPU léger pour les modèles exportés par export_model.py.
+
+N'importe que numpy, torch (+ torchvision pour les opérateurs) et PIL :
+pas de Detectron2 au démarrage. Le prétraitement (redimensionnement du plus
+petit côté) et le post-traitement (remise à l'échelle des boîtes, collage
+des masques 28x28) sont réimplémentés ici d'après export_meta.json.
+
+--compare lance chaque moteur (eager Detectron2, TorchScript, ONNX) dans un
+sous-processus et compare démarrage à froid, latence et mémoire.
+"""
+import time
+
+_T_START = time.perf_counter()
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg')
+
+
+def read_image(path, input_format='BGR'):
+    with Image.open(path) as im:
+        image = np.asarray(im.convert('RGB'))
+    return image[:, :, ::-1] if input_format == 'BGR' else image
+
+
+def resize_shortest_edge(image, min_size, max_size):
+    """Même règle que detectron2 ResizeShortestEdge (taille de test fixe)."""
+    h, w = image.shape[:2]
+    scale = min_size / min(h, w)
+    if max(h, w) * scale > max_size:
+        scale = max_size / max(h, w)
+    new_h, new_w = int(h * scale + 0.5), int(w * scale + 0.5)
+    resized = np.asarray(Image.fromarray(np.ascontiguousarray(image)).resize((new_w, new_h), Image.BILINEAR))
+    return resized, (new_h / h, new_w / w)
+
+
+def paste_masks(mask_probs, boxes, height, width, threshold=0.5):
+    """Colle les masques (N, 1, M, M) dans leurs boîtes sur une image (height, width)."""
+    import torch
+    import torch.nn.functional as F
+
+    masks = np.zeros((len(boxes), height, width), dtype=bool)
+    for k, (x0, y0, x1, y1) in enumerate(boxes.tolist()):
+        ix0, iy0 = max(int(np.floor(x0)), 0), max(int(np.floor(y0)), 0)
+        ix1, iy1 = min(int(np.ceil(x1)), width), min(int(np.ceil(y1)), height)
+        if ix1 <= ix0 or iy1 <= iy0:
+            continue
+        bw, bh = max(int(round(x1 - x0)), 1), max(int(round(y1 - y0)), 1)
+        resized = F.interpolate(mask_probs[k:k + 1], size=(bh, bw), mode='bilinear', align_corners=False)[0, 0]
+        ox, oy = int(np.floor(x0)), int(np.floor(y0))
+        crop = resized[iy0 - oy:iy1 - oy, ix0 - ox:ix1 - ox].numpy() >= threshold
+        masks[k, iy0:iy0 + crop.shape[0], ix0:ix0 + crop.shape[1]] = crop
+    return masks
+
+
+class FastPredictor:
+    """Charge un artefact exporté (TorchScript ou ONNX) et prédit sur des images BGR/RGB uint8."""
+
+    def __init__(self, export_dir, engine='torchscript', int8=False, threads=0):
+        with open(os.path.join(export_dir, 'export_meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.engine = engine
+        self.fields = self.meta['output_fields']
+        import torch
+        if threads:
+            torch.set_num_threads(threads)
+        if engine == 'torchscript':
+            import torchvision  # noqa: F401  (enregistre les opérateurs torchvision::nms / roi_align)
+            key = 'torchscript_int8' if int8 else 'torchscript'
+            if key not in self.meta['artifacts']:
+                raise ValueError(f"Artefact {key} absent de {export_dir} (relancer export_model.py{' --int8' if int8 else ''})")
+            self.model = torch.jit.load(os.path.join(export_dir, self.meta['artifacts'][key]['path']))
+            self.model.eval()
+        elif engine == 'onnx':
+            import onnxruntime as ort
+            path = os.path.join(export_dir, self.meta['artifacts']['onnx']['path'])
+            if int8:
+                path = self._quantized_onnx(path)
+            options = ort.SessionOptions()
+            if threads:
+                options.intra_op_num_threads = threads
+            self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        else:
+            raise ValueError(f"Moteur inconnu : {engine}")
+
+    @staticmethod
+    def _quantized_onnx(path):
+        """Quantification dynamique int8 (poids des MatMul/Gemm des têtes), mise en cache à côté du modèle."""
+        q_path = os.path.splitext(path)[0] + '_int8.onnx'
+        if not os.path.isfile(q_path) or os.path.getmtime(q_path) < os.path.getmtime(path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(path, q_path, op_types_to_quantize=['MatMul', 'Gemm'], weight_type=QuantType.QInt8)
+        return q_path
+
+    def _forward(self, chw):
+        if self.engine == 'onnx':
+            outputs = self.session.run(None, {'image': chw})
+        else:
+            import torch
+            with torch.inference_mode():
+                outputs = [t.numpy() for t in self.model(torch.from_numpy(chw))]
+        return dict(zip(self.fields, outputs))
+
+    def __call__(self, image):
+        import torch
+
+        height, width = image.shape[:2]
+        resized, (sy, sx) = resize_shortest_edge(image, self.meta['min_size_test'], self.meta['max_size_test'])
+        out = self._forward(np.ascontiguousarray(resized.transpose(2, 0, 1)))
+        boxes = np.asarray(out['pred_boxes'], dtype=np.float32).reshape(-1, 4) / np.array([sx, sy, sx, sy], dtype=np.float32)
+        boxes[:, 0::2] = boxes[:, 0::2].clip(0, width)
+        boxes[:, 1::2] = boxes[:, 1::2].clip(0, height)
+        result = {
+            'boxes': boxes,
+            'scores': np.asarray(out['scores']),
+            'classes': np.asarray(out['pred_classes']),
+        }
+        if 'pred_masks' in out:
+            result['masks'] = paste_masks(torch.as_tensor(np.asarray(out['pred_masks'], dtype=np.float32)),
+                                          boxes, height, width)
+        return result
+
+
+class EagerPredictor:
+    """Référence Detectron2 (DefaultPredictor) pour le benchmark ; importe tout Detectron2."""
+
+    def __init__(self, weights, coco, threads=0):
+        import torch
+        from coco_store import load_coco
+        from infer_detectron2 import load_predictor
+        from detectron2.engine import DefaultPredictor
+
+        if threads:
+            torch.set_num_threads(threads)
+        categories = sorted(load_coco(coco)['categories'], key=lambda c: c['id'])
+        cfg, _ = load_predictor(weights, categories)
+        self.predictor = DefaultPredictor(cfg)
+
+    def __call__(self, image):
+        instances = self.predictor(image)['instances'].to('cpu')
+        return {
+            'boxes': instances.pred_boxes.tensor.numpy(),
+            'scores': instances.scores.numpy(),
+            'classes': instances.pred_classes.numpy(),
+        }
+
+
+def list_images(inputs):
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(os.path.join(item, f) for f in sorted(os.listdir(item)) if f.lower().endswith(IMAGE_EXTS))
+        else:
+            paths.append(item)
+    return paths
+
+
+def run(args):
+    paths = list_images(args.inputs)[:args.limit or None]
+    if args.engine == 'eager':
+        predictor = EagerPredictor(args.weights, args.coco, args.threads)
+        input_format = 'BGR'
+    else:
+        predictor = FastPredictor(args.export_dir, args.engine, args.int8, args.threads)
+        input_format = predictor.meta['input_format']
+    cold_start = time.perf_counter() - _T_START
+
+    latencies = []
+    out = open(args.output, 'w', encoding='utf-8') if args.output else None
+    try:
+        for path in paths:
+            image = read_image(path, input_format)
+            t0 = time.perf_counter()
+            pred = predictor(image)
+            latencies.append(time.perf_counter() - t0)
+            if out:
+                out.write(json.dumps({
+                    'file_name': os.path.basename(path),
+                    'boxes': pred['boxes'].tolist(),
+                    'scores': pred['scores'].tolist(),
+                    'classes': pred['classes'].tolist(),
+                }) + '\n')
+    finally:
+        if out:
+            out.close()
+    lat_ms = np.array(latencies or [0.0]) * 1000
+    return {
+        'engine': args.engine + ('-int8' if args.int8 else ''),
+        'images': len(latencies),
+        'cold_start_s': round(cold_start, 3),
+        'p50_ms': round(float(np.percentile(lat_ms, 50)), 1),
+        'p95_ms': round(float(np.percentile(lat_ms, 95)), 1),
+        # ru_maxrss est en Ko sous Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def compare(args):
+    """Lance chaque moteur dans un processus séparé (mémoire et démarrage mesurés isolément)."""
+    engines = [('eager', False), ('torchscript', False)]
+    with open(os.path.join(args.export_dir, 'export_meta.json'), 'r', encoding='utf-8') as f:
+        artifacts = json.load(f)['artifacts']
+    if 'torchscript_int8' in artifacts:
+        engines.append(('torchscript', True))
+    if 'onnx' in artifacts:
+        engines += [('onnx', False), ('onnx', True)]
+    rows = []
+    for engine, int8 in engines:
+        cmd = [sys.executable, os.path.abspath(__file__), *args.inputs, '--engine', engine,
+               '--export_dir', args.export_dir, '--weights', args.weights, '--coco', args.coco,
+               '--threads', str(args.threads), '--limit', str(args.limit), '--metrics-json']
+        if int8:
+            cmd.append('--int8')
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"[WARN] Moteur {engine}{'-int8' if int8 else ''} en échec :\n{proc.stderr.strip()[-500:]}")
+            continue
+        rows.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    print(f"{'moteur':18s} {'démarrage (s)':>14s} {'p50 (ms)':>9s} {'p95 (ms)':>9s} {'RSS max (Mo)':>13s}")
+    for row in rows:
+        print(f"{row['engine']:18s} {row['cold_start_s']:14.2f} {row['p50_ms']:9.1f} {row['p95_ms']:9.1f} {row['peak_rss_mb']:13.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prédicteur CPU rapide sur modèle exporté (TorchScript / ONNX)")
+    parser.add_argument('inputs', nargs='+', help='Images ou dossiers d\'images')
+    parser.add_argument('--export_dir', type=str, default='output_detectron2/export', help='Dossier de export_model.py')
+    parser.add_argument('--engine', type=str, default='torchscript', choices=['torchscript', 'onnx', 'eager'])
+    parser.add_argument('--int8', action='store_true', help='Têtes quantifiées en int8 (quantification dynamique)')
+    parser.add_argument('--threads', type=int, default=0, help='Threads intra-op (0 = défaut)')
+    parser.add_argument('--limit', type=int, default=0, help='Nombre max d\'images (0 = toutes)')
+    parser.add_argument('--output', type=str, default=None, help='JSONL des prédictions (boîtes, scores, classes)')
+    parser.add_argument('--weights', type=str, default='output_detectron2/model_final.pth', help='Checkpoint (moteur eager)')
+    parser.add_argument('--coco', type=str, default='annotations_val_with_hw.json', help='Catégories (moteur eager)')
+    parser.add_argument('--compare', action='store_true', help='Compare tous les moteurs disponibles')
+    parser.add_argument('--metrics-json', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args)
+        return
+    metrics = run(args)
+    if args.metrics_json:
+        print(json.dumps(metrics))
+    else:
+        print(f"{metrics['images']} images ({metrics['engine']}) : démarrage {metrics['cold_start_s']:.2f} s, "
+              f"p50 {metrics['p50_ms']:.1f} ms, p95 {metrics['p95_ms']:.1f} ms, RSS max {metrics['peak_rss_mb']:.0f} Mo")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""Géométrie vectorisée des polygones (aires, boîtes, distances, orientation, simplification).
+
+Tous les polygones d'une image (ou d'un fichier) sont traités d'un coup sous
+forme « à plat », comme dans le format .cocobin :
+  - vertices  (V, 2)  sommets de tous les anneaux, bout à bout
+  - offsets   (P + 1) début de chaque anneau dans vertices
+
+Les anneaux sont implicitement fermés (le dernier sommet rejoint le premier).
+Les calculs sont faits en float64 ; les sommets retournés gardent le dtype
+d'entrée.
+"""
+import numpy as np
+
+
+def pack_rings(rings):
+    """Liste d'anneaux (N_i, 2) ou listes COCO [x1, y1, ...] -> (vertices, offsets)."""
+    arrays = [np.asarray(r, dtype=np.float64).reshape(-1, 2) for r in rings]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum([len(a) for a in arrays], out=offsets[1:])
+    vertices = np.concatenate(arrays) if arrays else np.zeros((0, 2), dtype=np.float64)
+    return vertices, offsets
+
+
+def unpack_rings(vertices, offsets):
+    """Inverse de pack_rings : vues (N_i, 2) sur vertices."""
+    return [vertices[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def segment_sums(values, offsets):
+    """Somme de values sur chaque plage [offsets[i], offsets[i + 1]) (plages vides acceptées)."""
+    cumulative = np.zeros(len(values) + 1, dtype=np.float64)
+    np.cumsum(values, out=cumulative[1:])
+    return cumulative[offsets[1:]] - cumulative[offsets[:-1]]
+
+
+def _next_indices(offsets):
+    """Indice du sommet suivant dans le même anneau (le dernier revient au premier)."""
+    nxt = np.arange(1, offsets[-1] + 1, dtype=np.int64)
+    counts = np.diff(offsets)
+    nonempty = counts > 0
+    nxt[offsets[1:][nonempty] - 1] = offsets[:-1][nonempty]
+    return nxt
+
+
+def signed_areas(vertices, offsets):
+    """Aires signées (formule du lacet) de chaque anneau.
+
+    Positives pour un anneau parcouru dans le sens horaire à l'écran
+    (repère image, y vers le bas).
+    """
+    pts = np.asarray(vertices, dtype=np.float64)
+    nxt = _next_indices(offsets)
+    cross = pts[:, 0] * pts[nxt, 1] - pts[nxt, 0] * pts[:, 1]
+    return 0.5 * segment_sums(cross, offsets)
+
+
+def ring_areas(vertices, offsets):
+    return np.abs(signed_areas(vertices, offsets))
+
+
+def ring_bboxes(vertices, offsets):
+    """Boîtes COCO [x, y, w, h] (P, 4) de chaque anneau ; zéros pour un anneau vide."""
+    pts = np.asarray(vertices, dtype=np.float64)
+    bboxes = np.zeros((len(offsets) - 1, 4), dtype=np.float64)
+    nonempty = np.diff(offsets) > 0
+    if nonempty.any():
+        starts = offsets[:-1][nonempty]
+        mins = np.minimum.reduceat(pts, starts, axis=0)
+        maxs = np.maximum.reduceat(pts, starts, axis=0)
+        bboxes[nonempty, :2] = mins
+        bboxes[nonempty, 2:] = maxs - mins
+    return bboxes
+
+
+def group_bboxes(bboxes, group_offsets):
+    """Fusionne des boîtes [x, y, w, h] par groupe (ex. anneaux d'une même annotation)."""
+    out = np.zeros((len(group_offsets) - 1, 4), dtype=np.float64)
+    nonempty = np.diff(group_offsets) > 0
+    if nonempty.any():
+        starts = group_offsets[:-1][nonempty]
+        mins = np.minimum.reduceat(bboxes[:, :2], starts, axis=0)
+        maxs = np.maximum.reduceat(bboxes[:, :2] + bboxes[:, 2:], starts, axis=0)
+        out[nonempty, :2] = mins
+        out[nonempty, 2:] = maxs - mins
+    return out
+
+
+def ring_edges(vertices, offsets):
+    """Arêtes (a, b) de tous les anneaux : deux tableaux (V, 2) float64, une arête par sommet."""
+    pts = np.asarray(vertices, dtype=np.float64)
+    return pts, pts[_next_indices(offsets)]
+
+
+def rings_contain(vertices, offsets, x, y):
+    """Booléens (P,) : le point (x, y) est à l'intérieur de chaque anneau (règle pair-impair)."""
+    a, b = ring_edges(vertices, offsets)
+    straddle = (a[:, 1] > y) != (b[:, 1] > y)
+    dy = np.where(straddle, b[:, 1] - a[:, 1], 1.0)
+    crossing = straddle & (x < a[:, 0] + (y - a[:, 1]) * (b[:, 0] - a[:, 0]) / dy)
+    return segment_sums(crossing, offsets).astype(np.int64) % 2 == 1
+
+
+def point_segment_distances(x, y, a, b):
+    """Distance du point (x, y) à chaque segment [a_i, b_i]."""
+    ab = b - a
+    length2 = (ab ** 2).sum(axis=1)
+    t = ((x - a[:, 0]) * ab[:, 0] + (y - a[:, 1]) * ab[:, 1]) / np.where(length2 > 0, length2, 1.0)
+    t = np.clip(t, 0.0, 1.0)
+    return np.hypot(a[:, 0] + t * ab[:, 0] - x, a[:, 1] + t * ab[:, 1] - y)
+
+
+def ring_distances(vertices, offsets, x, y):
+    """Distance (P,) du point (x, y) à chaque anneau : 0 à l'intérieur, sinon au bord le plus proche."""
+    out = np.full(len(offsets) - 1, np.inf)
+    nonempty = np.diff(offsets) > 0
+    if nonempty.any():
+        a, b = ring_edges(vertices, offsets)
+        dist = point_segment_distances(x, y, a, b)
+        out[nonempty] = np.minimum.reduceat(dist, offsets[:-1][nonempty])
+        out[rings_contain(vertices, offsets, x, y)] = 0.0
+    return out
+
+
+def _ring_indices(offsets, reverse):
+    """Indices de vertices avec les anneaux marqués par reverse parcourus à l'envers."""
+    counts = np.diff(offsets)
+    pos = np.arange(offsets[-1], dtype=np.int64)
+    starts = np.repeat(offsets[:-1], counts)
+    ends = np.repeat(offsets[1:], counts)
+    return np.where(np.repeat(reverse, counts), starts + ends - 1 - pos, pos)
+
+
+def orient(vertices, offsets, clockwise=True):
+    """Réoriente tous les anneaux dans le même sens (horaire à l'écran par défaut)."""
+    areas = signed_areas(vertices, offsets)
+    reverse = areas < 0 if clockwise else areas > 0
+    if not reverse.any():
+        return vertices
+    return vertices[_ring_indices(offsets, reverse)]
+
+
+def _closed_copy(vertices, offsets):
+    """Anneaux refermés (premier sommet répété à la fin) et offsets correspondants."""
+    counts = np.diff(offsets)
+    closed_offsets = offsets + np.arange(len(offsets), dtype=np.int64)
+    idx = np.empty(offsets[-1] + len(counts), dtype=np.int64)
+    body = np.ones(len(idx), dtype=bool)
+    body[closed_offsets[1:] - 1] = False
+    idx[body] = np.arange(offsets[-1], dtype=np.int64)
+    idx[~body] = offsets[:-1]
+    return vertices[idx], closed_offsets
+
+
+def simplify(vertices, offsets, tolerance):
+    """Douglas–Peucker sur tous les anneaux à la fois.
+
+    Chaque anneau est traité comme une polyligne fermée ; à chaque itération,
+    tous les segments encore ouverts de tous les anneaux sont subdivisés
+    ensemble. tolerance = 0 ne retire que les sommets alignés ou dupliqués
+    (sans perte). Un anneau qui tomberait sous 3 sommets est conservé tel quel,
+    de même que les anneaux dégénérés (vides, 1 ou 2 sommets).
+    Retourne (vertices, offsets).
+    """
+    if offsets[-1] == 0:
+        return vertices, offsets
+    counts = np.diff(offsets)
+    degenerate = counts < 3
+    if degenerate.any():
+        return _simplify_rings(vertices, offsets, ~degenerate, tolerance)
+    closed, closed_offsets = _closed_copy(np.asarray(vertices), offsets)
+    pts = closed.astype(np.float64)
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[closed_offsets[:-1]] = True
+    keep[closed_offsets[1:] - 1] = True
+
+    seg_start = closed_offsets[:-1].copy()
+    seg_end = closed_offsets[1:] - 1
+    while len(seg_start):
+        counts = seg_end - seg_start - 1
+        active = counts > 0
+        seg_start, seg_end, counts = seg_start[active], seg_end[active], counts[active]
+        if not len(seg_start):
+            break
+        seg_id = np.repeat(np.arange(len(seg_start)), counts)
+        ends = np.cumsum(counts)
+        inner = np.repeat(seg_start + 1 - (ends - counts), counts) + np.arange(ends[-1])
+        a, b, p = pts[seg_start[seg_id]], pts[seg_end[seg_id]], pts[inner]
+        ab = b - a
+        ap = p - a
+        length = np.hypot(ab[:, 0], ab[:, 1])
+        cross = np.abs(ab[:, 0] * ap[:, 1] - ab[:, 1] * ap[:, 0])
+        # Corde de longueur nulle (anneau refermé sur lui-même) : distance au point
+        dist = np.where(length > 0, cross / np.where(length > 0, length, 1.0), np.hypot(ap[:, 0], ap[:, 1]))
+        group_starts = ends - counts
+        best = np.maximum.reduceat(dist, group_starts)
+        # Premier sommet atteignant le maximum de chaque segment
+        is_best = dist == best[seg_id]
+        first = np.flatnonzero(is_best)
+        _, pick = np.unique(seg_id[first], return_index=True)
+        split = inner[first[pick]]
+        grow = best > tolerance
+        keep[split[grow]] = True
+        seg_start, seg_end = (np.concatenate([seg_start[grow], split[grow]]),
+                              np.concatenate([split[grow], seg_end[grow]]))
+
+    # Retire le sommet de fermeture ajouté par _closed_copy
+    keep[closed_offsets[1:] - 1] = False
+    ring_of = np.repeat(np.arange(len(offsets) - 1), np.diff(closed_offsets))
+    kept_counts = np.bincount(ring_of[keep], minlength=len(offsets) - 1)
+    too_small = (kept_counts < 3) & (np.diff(offsets) >= 3)
+    if too_small.any():
+        body = np.ones(len(pts), dtype=bool)
+        body[closed_offsets[1:] - 1] = False
+        keep |= body & np.repeat(too_small, np.diff(closed_offsets))
+        kept_counts = np.bincount(ring_of[keep], minlength=len(offsets) - 1)
+    new_offsets = np.zeros(len(offsets), dtype=np.int64)
+    np.cumsum(kept_counts, out=new_offsets[1:])
+    return closed[keep], new_offsets
+
+
+def _concat_ranges(starts, counts):
+    """Indices de la concaténation des plages [start, start + count)."""
+    ends = np.cumsum(counts)
+    shift = np.repeat(np.asarray(starts, dtype=np.int64) - (ends - counts), counts)
+    return shift + np.arange(ends[-1] if len(ends) else 0, dtype=np.int64)
+
+
+def _simplify_rings(vertices, offsets, selected, tolerance):
+    """simplify sur les seuls anneaux sélectionnés ; les autres (vides, 1 ou 2 sommets) restent tels quels."""
+    vertices = np.asarray(vertices)
+    counts = np.diff(offsets)
+    sub_vertices, sub_offsets = simplify(
+        vertices[_concat_ranges(offsets[:-1][selected], counts[selected])],
+        np.concatenate([[0], np.cumsum(counts[selected])]).astype(np.int64), tolerance)
+    new_counts = counts.copy()
+    new_counts[selected] = np.diff(sub_offsets)
+    new_offsets = np.zeros(len(offsets), dtype=np.int64)
+    np.cumsum(new_counts, out=new_offsets[1:])
+    out = np.empty((new_offsets[-1], 2), dtype=vertices.dtype)
+    out[_concat_ranges(new_offsets[:-1][selected], new_counts[selected])] = sub_vertices
+    kept = ~selected
+    out[_concat_ranges(new_offsets[:-1][kept], counts[kept])] = vertices[_concat_ranges(offsets[:-1][kept],
+                                                                                         counts[kept])]
+    return out, new_offsets
+
+
+def polygon_area(points):
+    """Aire (non signée) d'un seul anneau (N, 2)."""
+    pts = np.asarray(points, dtype=np.float64)
+    return float(ring_areas(pts, np.array([0, len(pts)], dtype=np.int64))[0])
+
+
+def segmentation_areas(annotations):
+    """Aire réelle (somme des anneaux) des annotations COCO polygonales.
+
+    Retourne un tableau (A,) ; NaN pour les annotations sans polygone
+    (segmentation absente ou RLE).
+    """
+    rings = []
+    ann_offsets = np.zeros(len(annotations) + 1, dtype=np.int64)
+    polygonal = np.zeros(len(annotations), dtype=bool)
+    for i, ann in enumerate(annotations):
+        segmentation = ann.get('segmentation')
+        if isinstance(segmentation, list) and segmentation:
+            rings.extend(segmentation)
+            polygonal[i] = True
+        ann_offsets[i + 1] = len(rings)
+    vertices, offsets = pack_rings(rings)
+    areas = segment_sums(ring_areas(vertices, offsets), ann_offsets)
+    areas[~polygonal] = np.nan
+    return areas
@@ -0,0 +1,225 @@
+"""Cache d'images décodées partagé par les workers du dataloader d'entraînement.
+
+Chaque image est décodée une seule fois (PNG/JPEG -> uint8 HxWx3, réduite
+si max_side est donné) et écrite en .npy dans un dossier de cache ; les
+lectures suivantes sont des np.load(mmap_mode='r') : des vues sans copie
+sur le cache de pages du système, partagé par tous les processus. Avec un
+dossier sous /dev/shm, le cache est en mémoire partagée POSIX.
+
+La clé dépend du chemin, de la date de modification et de la taille du
+fichier, du format de couleurs et de max_side. Le cache est borné par un
+budget en octets : au-delà, les entrées les moins récemment utilisées
+(date de modification du .npy, mise à jour à chaque lecture) sont
+supprimées. Un processus qui a déjà ouvert une entrée supprimée garde sa
+vue valide.
+
+CachedDatasetMapper remplace la lecture d'image de DatasetMapper ; si
+l'image en cache a été réduite, une ScaleTransform ramène les annotations
+à sa résolution.
+
+    python image_cache.py dataset --max-side 1333        # remplit le cache et compare les temps de lecture
+"""
+import argparse
+import functools
+import hashlib
+import os
+import time
+from collections import OrderedDict
+import numpy as np
+
+DEFAULT_CACHE_DIR = '.image_cache'
+DEFAULT_BUDGET_MB = 4096
+CACHE_VERSION = 1
+
+
+def decode_image(path, image_format='BGR', max_side=0):
+    """Image uint8 (H, W, 3) comme detectron2.data.detection_utils.read_image, réduite à max_side si > 0."""
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as im:
+        if max_side:
+            # JPEG : décodage directement à échelle réduite
+            im.draft('RGB', (max_side, max_side))
+        im = ImageOps.exif_transpose(im)
+        im = im.convert('RGB')
+        if max_side and max(im.size) > max_side:
+            scale = max_side / max(im.size)
+            im = im.resize((max(1, round(im.width * scale)), max(1, round(im.height * scale))), Image.BILINEAR)
+        array = np.asarray(im)
+    if image_format == 'BGR':
+        array = array[:, :, ::-1]
+    return np.ascontiguousarray(array)
+
+
+class ImageCache:
+    """Images décodées en .npy memory-mappés, avec budget LRU sur le dossier de cache."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_side=0, budget_mb=DEFAULT_BUDGET_MB, image_format='BGR',
+                 open_handles=64):
+        self.cache_dir = cache_dir
+        self.max_side = max_side or 0
+        self.budget = int(budget_mb * 2**20)
+        self.image_format = image_format
+        self.open_handles = open_handles
+        self._views = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._write_failed = False
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_path(self, path, stat):
+        key = f"{CACHE_VERSION}|{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}|{self.image_format}|{self.max_side}"
+        return os.path.join(self.cache_dir, hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest() + '.npy')
+
+    def get(self, path):
+        """Vue en lecture seule (H, W, 3) de l'image décodée (décodée et mise en cache si absente)."""
+        entry = self._entry_path(path, os.stat(path))
+        view = self._views.get(entry)
+        if view is not None:
+            self._views.move_to_end(entry)
+            self.hits += 1
+            return view
+        try:
+            view = np.load(entry, mmap_mode='r')
+            self.hits += 1
+            try:
+                os.utime(entry)  # ordre LRU partagé entre processus
+            except OSError:
+                pass
+        except (OSError, ValueError):
+            self.misses += 1
+            image = decode_image(path, self.image_format, self.max_side)
+            if not self._put(entry, image):
+                return image
+            view = np.load(entry, mmap_mode='r')
+        self._views[entry] = view
+        if len(self._views) > self.open_handles:
+            self._views.popitem(last=False)
+        return view
+
+    def _put(self, entry, image):
+        if image.nbytes > self.budget or self._write_failed:
+            return False
+        self._evict(self.budget - image.nbytes)
+        tmp = f"{entry}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                np.save(f, image)
+            os.replace(tmp, entry)  # atomique : un autre worker ne voit jamais un fichier partiel
+            return True
+        except OSError as e:
+            # Ex. /dev/shm plein : on continue sans cache plutôt que d'interrompre l'entraînement
+            print(f"[WARN] Écriture impossible dans le cache d'images {self.cache_dir} ({e}) : cache désactivé")
+            self._write_failed = True
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return False
+
+    def _evict(self, limit):
+        """Supprime les entrées les moins récemment lues jusqu'à ce que le total tienne dans `limit` octets."""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                if e.name.endswith('.npy'):
+                    try:
+                        stat = e.stat()
+                    except FileNotFoundError:
+                        continue  # supprimée par un autre worker
+                    entries.append((stat.st_mtime_ns, stat.st_size, e.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._views.pop(path, None)
+            total -= size
+
+    def usage(self):
+        """(nombre d'entrées, octets) du dossier de cache."""
+        sizes = [e.stat().st_size for e in os.scandir(self.cache_dir) if e.name.endswith('.npy')]
+        return len(sizes), sum(sizes)
+
+
+class _CachedMapping:
+    """DatasetMapper lisant les images dans un ImageCache au lieu de les décoder à chaque epoch."""
+
+    def __init__(self, cfg, is_train=True, cache=None):
+        super().__init__(cfg, is_train)
+        self.cache = cache
+
+    def __call__(self, dataset_dict):
+        import copy
+        import torch
+        from detectron2.data import transforms as T
+
+        dataset_dict = copy.deepcopy(dataset_dict)
+        image = self.cache.get(dataset_dict['file_name'])
+        height = dataset_dict.get('height') or image.shape[0]
+        width = dataset_dict.get('width') or image.shape[1]
+        aug_input = T.AugInput(image)
+        transforms = self.augmentations(aug_input)
+        if image.shape[:2] != (height, width):
+            # Image réduite dans le cache : les annotations (à la résolution d'origine) suivent
+            transforms = T.TransformList([T.ScaleTransform(height, width, image.shape[0], image.shape[1])]
+                                         + transforms.transforms)
+        image = aug_input.image
+        if not image.flags.writeable:
+            image = np.array(image)  # aucune augmentation n'a copié la vue du cache
+        dataset_dict['image'] = torch.as_tensor(np.ascontiguousarray(image.transpose(2, 0, 1)))
+        if not self.is_train:
+            dataset_dict.pop('annotations', None)
+            return dataset_dict
+        if 'annotations' in dataset_dict:
+            self._transform_annotations(dataset_dict, transforms, image.shape[:2])
+        return dataset_dict
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_dataset_mapper():
+    try:
+        from detectron2.data import DatasetMapper
+    except ImportError:  # remplissage du cache (CLI) sans Detectron2
+        DatasetMapper = object
+    return type('CachedDatasetMapper', (_CachedMapping, DatasetMapper),
+                {'__module__': __name__, '__doc__': _CachedMapping.__doc__})
+
+
+def __getattr__(name):
+    # Comme profiling.TrainProfileHook : DatasetMapper (donc torch) n'est importé qu'à la première
+    # utilisation de CachedDatasetMapper, pas pour lire les constantes du module ou lancer la CLI
+    if name == 'CachedDatasetMapper':
+        return _cached_dataset_mapper()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remplit le cache d'images décodées et mesure le gain de lecture")
+    parser.add_argument('img_dir', type=str, help='Dossier des images')
+    parser.add_argument('--cache-dir', type=str, default=DEFAULT_CACHE_DIR, help='Dossier du cache (ex. /dev/shm/cvcsp)')
+    parser.add_argument('--max-side', type=int, default=0, help='Plus grand côté des images en cache (0 = taille réelle)')
+    parser.add_argument('--budget-mb', type=float, default=DEFAULT_BUDGET_MB, help='Taille maximale du cache (Mo)')
+    parser.add_argument('--format', type=str, default='BGR', choices=['BGR', 'RGB'], help='cfg.INPUT.FORMAT')
+    args = parser.parse_args()
+
+    paths = sorted(e.path for e in os.scandir(args.img_dir)
+                   if os.path.splitext(e.name)[1].lower() in ('.png', '.jpg', '.jpeg'))
+    timings = []
+    for label in ('premier passage', 'deuxième passage'):
+        # Nouvelle instance : pas de vues déjà ouvertes, comme un nouveau worker
+        cache = ImageCache(args.cache_dir, args.max_side, args.budget_mb, args.format)
+        start = time.perf_counter()
+        for path in paths:
+            np.asarray(cache.get(path)).sum(dtype=np.uint64)  # force la lecture des pages
+        timings.append(time.perf_counter() - start)
+        print(f"{label} : {timings[-1]:.2f} s pour {len(paths)} images ({cache.hits} en cache, {cache.misses} décodées)")
+    entries, size = cache.usage()
+    print(f"Cache {args.cache_dir} : {entries} images, {size / 2**20:.0f} Mo (budget {args.budget_mb:.0f} Mo)")
+    if timings[1]:
+        print(f"Lecture depuis le cache : x{timings[0] / timings[1]:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import json
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from profiling import timed
+
+# Cache disque par défaut (dans le dossier des images)
+DEFAULT_CACHE_NAME = '.image_sizes.json'
+CACHE_VERSION = 1
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Marqueurs JPEG Start-Of-Frame (hors DHT 0xC4, JPG 0xC8 et DAC 0xCC)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _png_size(f):
+    header = f.read(24)
+    if len(header) < 24 or header[:8] != _PNG_SIGNATURE or header[12:16] != b'IHDR':
+        return None
+    return struct.unpack('>II', header[16:24])
+
+
+def _jpeg_size(f):
+    if f.read(2) != b'\xff\xd8':
+        return None
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            continue  # Marqueurs sans segment
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if marker in _JPEG_SOF:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack('>HH', data[1:5])
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+@timed()
+def read_image_size(path):
+    """(width, height) d'une image en ne lisant que son en-tête (PNG/JPEG).
+
+    Les autres formats passent par PIL (qui n'ouvre lui aussi que l'en-tête).
+    """
+    with open(path, 'rb') as f:
+        size = _png_size(f)
+        if size is None:
+            f.seek(0)
+            size = _jpeg_size(f)
+    if size is None:
+        from PIL import Image
+        with Image.open(path) as im:
+            size = im.size
+    return int(size[0]), int(size[1])
+
+
+class SizeCache:
+    """Cache disque (chemin, mtime, taille) -> (width, height)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        if path and os.path.isfile(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == CACHE_VERSION:
+                    self.entries = data.get('entries', {})
+            except (OSError, ValueError):
+                print(f"[WARN] Cache de tailles illisible, ignoré : {path}")
+
+    def get(self, key, stat):
+        entry = self.entries.get(key)
+        if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            return entry[2], entry[3]
+        return None
+
+    def put(self, key, stat, size):
+        self.entries[key] = [stat.st_mtime_ns, stat.st_size, size[0], size[1]]
+        self.dirty = True
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_VERSION, 'entries': self.entries}, f)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+def default_cache_path(img_dir):
+    return os.path.join(img_dir, DEFAULT_CACHE_NAME)
+
+
+@timed()
+def probe_sizes(paths, workers=8, cache_path=None, svg_hints=None, trust_svg=False):
+    """Détermine la taille de plusieurs images en parallèle (threads, en-têtes seulement).
+
+    svg_hints : {chemin image: chemin SVG} ; la taille <width>/<height> du SVG
+    sert de voie rapide si trust_svg (l'image n'est alors pas lue), sinon elle
+    est comparée à celle de l'image et les écarts sont signalés. Le SVG n'est
+    lu que pour les images absentes du cache.
+
+    Retourne (sizes, errors, mismatches) : {chemin: (w, h)}, {chemin: message}
+    et une liste de (chemin, taille SVG, taille image).
+    """
+    from svg_parser import read_svg_size
+
+    svg_hints = svg_hints or {}
+    cache = SizeCache(cache_path)
+
+    def probe(path):
+        key = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            return path, None, str(e), None
+        size = cache.get(key, stat)
+        if size is not None:
+            # Déjà lue (et comparée au SVG) lors d'un passage précédent
+            return path, size, None, None
+        svg_path = svg_hints.get(path)
+        svg_size = read_svg_size(svg_path) if svg_path else None
+        if trust_svg and svg_size is not None:
+            return path, svg_size, None, None
+        try:
+            size = read_image_size(path)
+        except Exception as e:
+            return path, None, str(e), svg_size
+        cache.put(key, stat, size)
+        return path, size, None, svg_size
+
+    sizes, errors, mismatches = {}, {}, []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for path, size, error, svg_size in executor.map(probe, paths):
+            if error is not None:
+                errors[path] = error
+                continue
+            sizes[path] = size
+            if svg_size is not None and svg_size != size:
+                mismatches.append((path, svg_size, size))
+    for path, svg_size, size in mismatches:
+        print(f"[WARN] Taille SVG {svg_size[0]}x{svg_size[1]} différente de l'image "
+              f"{size[0]}x{size[1]} : {path}")
+    cache.save()
+    return sizes, errors, mismatches
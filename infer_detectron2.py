@@ -0,0 +1,224 @@
+"""Inférence CPU par batchs du Mask R-CNN entraîné par train_detectron2_maskrcnn.py.
+
+Le checkpoint est chargé une seule fois avec la même configuration que
+l'entraînement ; les images sont décodées et prétraitées dans un pool de
+threads pendant que le modèle traite le batch précédent, et les
+prédictions sont écrites au fil de l'eau en JSONL (résultats COCO, une
+instance par ligne).
+
+torch et Detectron2 ne sont importés qu'à l'exécution (`cvcsp infer --help` s'affiche sans eux).
+"""
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pycocotools import mask as mask_util
+from coco_store import load_coco
+from tiling import instance_to_coco_result, stitch_predictions, tile_grid
+from train_detectron2_maskrcnn import build_cfg
+
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg')
+
+
+def list_images(inputs):
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(os.path.join(item, f) for f in sorted(os.listdir(item)) if f.lower().endswith(IMAGE_EXTS))
+        else:
+            paths.append(item)
+    return paths
+
+
+def load_predictor(weights, categories, device='cpu', score_thresh=0.5):
+    """Construit le modèle (config d'entraînement) et charge le checkpoint une fois."""
+    from detectron2.checkpoint import DetectionCheckpointer
+    from detectron2.modeling import build_model
+
+    cfg = build_cfg(len(categories))
+    cfg.MODEL.WEIGHTS = weights
+    cfg.MODEL.DEVICE = device
+    cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = score_thresh
+    model = build_model(cfg)
+    DetectionCheckpointer(model).load(weights)
+    model.eval()
+    return cfg, model
+
+
+class Preprocessor:
+    """Décodage + redimensionnement identiques à DefaultPredictor (exécuté dans les threads)."""
+
+    def __init__(self, cfg, tile_size=0, tile_overlap=128):
+        from detectron2.data import transforms as T
+
+        self.aug = T.ResizeShortestEdge([cfg.INPUT.MIN_SIZE_TEST, cfg.INPUT.MIN_SIZE_TEST], cfg.INPUT.MAX_SIZE_TEST)
+        self.input_format = cfg.INPUT.FORMAT
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+
+    def _prepare(self, image):
+        import torch
+
+        height, width = image.shape[:2]
+        resized = self.aug.get_transform(image).apply_image(image)
+        tensor = torch.as_tensor(np.ascontiguousarray(resized.transpose(2, 0, 1)))
+        return {'image': tensor, 'height': height, 'width': width}
+
+    def __call__(self, path):
+        from detectron2.data.detection_utils import read_image
+
+        start = time.perf_counter()
+        image = read_image(path, format=self.input_format)
+        height, width = image.shape[:2]
+        if self.tile_size:
+            rects = tile_grid(width, height, self.tile_size, self.tile_overlap)
+        else:
+            rects = [(0, 0, width, height)]
+        units = [(rect, self._prepare(image[rect[1]:rect[3], rect[0]:rect[2]])) for rect in rects]
+        return path, (height, width), units, start
+
+
+def prefetch(executor, fn, items, depth):
+    """Comme executor.map, mais avec au plus `depth` tâches en avance (mémoire bornée)."""
+    queue = deque()
+    for item in items:
+        queue.append(executor.submit(fn, item))
+        if len(queue) >= depth:
+            yield queue.popleft().result()
+    while queue:
+        yield queue.popleft().result()
+
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def instances_to_results(instances, image_id, contiguous_to_cat):
+    """Instances Detectron2 (image entière) -> résultats COCO avec masques RLE."""
+    boxes = instances.pred_boxes.tensor.numpy()
+    scores = instances.scores.numpy()
+    classes = instances.pred_classes.numpy()
+    rles = []
+    if instances.has('pred_masks') and len(instances):
+        masks = instances.pred_masks.numpy().astype(np.uint8)
+        rles = mask_util.encode(np.asfortranarray(masks.transpose(1, 2, 0)))
+    results = []
+    for k in range(len(scores)):
+        x0, y0, x1, y1 = boxes[k].tolist()
+        result = {
+            'image_id': image_id,
+            'category_id': contiguous_to_cat[int(classes[k])],
+            'bbox': [x0, y0, x1 - x0, y1 - y0],
+            'score': float(scores[k]),
+        }
+        if rles:
+            rle = rles[k]
+            result['segmentation'] = {'size': rle['size'], 'counts': rle['counts'].decode('ascii')}
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inférence CPU par batchs (résultats COCO en JSONL)")
+    parser.add_argument('inputs', nargs='+', help='Images ou dossiers d\'images')
+    parser.add_argument('--weights', type=str, default='output_detectron2/model_final.pth', help='Checkpoint entraîné')
+    parser.add_argument('--coco', type=str, default='annotations_train_with_hw.json',
+                        help='Fichier COCO donnant les catégories (et les image_id si les noms correspondent)')
+    parser.add_argument('--output', type=str, default='predictions.jsonl', help='Fichier JSONL de sortie')
+    parser.add_argument('--batch-size', type=int, default=4, help='Images (ou tuiles) par passe avant')
+    parser.add_argument('--threads', type=int, default=0, help='Threads intra-op torch (0 = défaut torch)')
+    parser.add_argument('--decode-workers', type=int, default=4, help='Threads de décodage/prétraitement')
+    parser.add_argument('--score-thresh', type=float, default=0.5, help='Seuil de score des détections')
+    parser.add_argument('--tile-size', type=int, default=0, help='Inférence par tuiles (0 = image entière)')
+    parser.add_argument('--tile-overlap', type=int, default=128, help='Recouvrement entre tuiles (pixels)')
+    args = parser.parse_args()
+
+    import torch
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    coco = load_coco(args.coco)
+    categories = sorted(coco['categories'], key=lambda c: c['id'])
+    contiguous_to_cat = [c['id'] for c in categories]
+    image_ids = {img['file_name']: img['id'] for img in coco['images']}
+    next_id = max(image_ids.values(), default=0) + 1
+    del coco
+
+    paths = list_images(args.inputs)
+    if not paths:
+        print("Aucune image à traiter.")
+        return
+    cfg, model = load_predictor(args.weights, categories, score_thresh=args.score_thresh)
+    preprocess = Preprocessor(cfg, args.tile_size, args.tile_overlap)
+    print(f"{len(paths)} images, batch {args.batch_size}, {torch.get_num_threads()} threads torch.")
+
+    latencies = []
+    n_instances = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.decode_workers) as executor, \
+            open(args.output, 'w', encoding='utf-8') as out:
+        # Décodage en avance pendant que le modèle travaille ; chaque tuile devient une unité de batch
+        decoded = prefetch(executor, preprocess, paths, depth=2 * max(args.decode_workers, args.batch_size))
+        pending = {}
+
+        def units():
+            for path, size, image_units, t0 in decoded:
+                pending[path] = {'size': size, 'start': t0, 'left': len(image_units), 'preds': []}
+                for rect, inputs in image_units:
+                    yield path, rect, inputs
+
+        for batch in iter_batches(units(), args.batch_size):
+            with torch.inference_mode():
+                outputs = model([inputs for _, _, inputs in batch])
+            for (path, rect, _), output in zip(batch, outputs):
+                state = pending[path]
+                state['preds'].append((rect, output['instances'].to('cpu')))
+                state['left'] -= 1
+                if state['left']:
+                    continue
+                name = os.path.basename(path)
+                image_id = image_ids.get(name)
+                if image_id is None:
+                    # Image absente du COCO : nouvel id entier (les résultats COCO exigent des ids entiers)
+                    image_id = image_ids[name] = next_id
+                    next_id += 1
+                    print(f"[WARN] {name} absente de {args.coco} : image_id {image_id} attribué")
+                height, width = state['size']
+                if len(state['preds']) == 1 and rect == (0, 0, width, height):
+                    results = instances_to_results(state['preds'][0][1], image_id, contiguous_to_cat)
+                else:
+                    tile_preds = [
+                        (r, inst.pred_boxes.tensor.numpy(), inst.scores.numpy(), inst.pred_classes.numpy(),
+                         inst.pred_masks.numpy() if inst.has('pred_masks') else None)
+                        for r, inst in state['preds']
+                    ]
+                    results = [
+                        instance_to_coco_result(inst, image_id, height, width, contiguous_to_cat[inst['class']])
+                        for inst in stitch_predictions(tile_preds)
+                    ]
+                for result in results:
+                    result['file_name'] = name
+                    out.write(json.dumps(result) + '\n')
+                n_instances += len(results)
+                latencies.append(time.perf_counter() - state['start'])
+                del pending[path]
+    elapsed = time.perf_counter() - start
+
+    lat_ms = np.array(latencies) * 1000
+    print(f"Prédictions écrites dans {args.output} ({n_instances} instances).")
+    print(f"Débit : {len(latencies) / elapsed:.2f} images/s ({elapsed:.1f} s)")
+    print(f"Latence par image : p50 {np.percentile(lat_ms, 50):.0f} ms, p95 {np.percentile(lat_ms, 95):.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""Index SVG -> image du dataset, persistant et mis à jour de façon incrémentale.
+
+Un seul parcours des dossiers (os.scandir) construit des tables de hachage :
+les images par nom sans extension, puis pour chaque SVG l'image retenue et
+la règle appliquée, dans l'ordre :
+
+- exact  : X.svg            -> X.png
+- prefix : X_gt_<k>.svg     -> X.png  (convention du dataset)
+- offset : <n>_gt_<k>.svg   -> <n+offset>.png  (seulement si offset est donné)
+
+Pour une même règle, les extensions sont départagées par ordre de préférence
+(.png, .jpg, .jpeg). L'index est écrit dans le dossier des images
+(.mapping_index.json, versionné) ; à l'ouverture, il n'est réutilisé tel quel
+que si la liste des SVG et des images n'a pas changé (signature des noms, qui
+ignore les fichiers de cache écrits dans ces dossiers), sinon seuls les SVG
+touchés par les fichiers ajoutés ou supprimés sont résolus à nouveau. Les SVG sans image
+et les associations ambiguës (plusieurs extensions, image partagée par
+plusieurs SVG) sont signalés.
+"""
+import hashlib
+import json
+import os
+from collections import defaultdict
+from profiling import timed
+
+INDEX_VERSION = 2
+DEFAULT_INDEX_NAME = '.mapping_index.json'
+# Extensions d'images, par ordre de préférence
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg')
+
+
+def svg_prefix(svg_name):
+    """Préfixe avant '_gt_' (X_gt_3.svg -> X), ou None si le nom ne suit pas la convention."""
+    stem = os.path.splitext(svg_name)[0]
+    return stem.split('_gt_')[0] if '_gt_' in stem else None
+
+
+def candidate_stems(svg_name, offset=None):
+    """[(règle, nom d'image sans extension)] à essayer, dans l'ordre."""
+    candidates = [('exact', os.path.splitext(svg_name)[0])]
+    prefix = svg_prefix(svg_name)
+    if prefix is not None:
+        candidates.append(('prefix', prefix))
+        if offset is not None and prefix.isdigit():
+            candidates.append(('offset', str(int(prefix) + offset)))
+    return candidates
+
+
+def default_index_path(img_dir):
+    return os.path.join(img_dir, DEFAULT_INDEX_NAME)
+
+
+def listing_signature(svgs, images):
+    """Empreinte des noms de SVG et d'images : l'association ne dépend que d'eux.
+
+    Le mtime des dossiers ne convient pas : l'index lui-même, ou le cache
+    .image_sizes.json, écrits dans le dossier des images, le modifieraient.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for name in sorted(svgs) + ['/'] + sorted(images):
+        h.update(name.encode('utf-8') + b'\0')
+    return h.hexdigest()
+
+
+class MappingIndex:
+    """Associations SVG -> image ; toutes les requêtes sont des accès dictionnaire."""
+
+    def __init__(self, svg_dir, img_dir=None, path=None, offset=None):
+        self.svg_dir = svg_dir
+        self.img_dir = img_dir or svg_dir
+        self.path = default_index_path(self.img_dir) if path is None else path
+        self.offset = offset
+        self.params = {
+            'version': INDEX_VERSION,
+            'svg_dir': os.path.abspath(self.svg_dir),
+            'img_dir': os.path.abspath(self.img_dir),
+            'offset': offset,
+        }
+        self.signature = None
+        self.svgs = set()
+        self.images = {}   # nom sans extension -> [noms], par ordre de préférence
+        self.pairs = {}    # SVG -> (image ou None, règle ou None, [autres images de la même règle])
+        self.dirty = False
+        self._load()
+        self.update()
+
+    def _load(self):
+        if not self.path or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            print(f"[WARN] Index de mapping illisible, reconstruit : {self.path}")
+            return
+        if data.get('params') != self.params:
+            return
+        self.signature = data['signature']
+        self.svgs = set(data['svgs'])
+        self.images = data['images']
+        self.pairs = {svg: tuple(pair) for svg, pair in data['pairs'].items()}
+
+    def _scan(self):
+        """(noms des SVG, noms des images) ; un seul parcours si les dossiers sont les mêmes."""
+        svgs, images = set(), []
+        if os.path.abspath(self.svg_dir) == os.path.abspath(self.img_dir):
+            scans = [(self.svg_dir, True, True)]
+        else:
+            scans = [(self.svg_dir, True, False), (self.img_dir, False, True)]
+        for directory, want_svg, want_images in scans:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    ext = os.path.splitext(entry.name)[1].lower()
+                    if want_svg and ext == '.svg':
+                        svgs.add(entry.name)
+                    elif want_images and ext in IMAGE_EXTS:
+                        images.append(entry.name)
+        return svgs, images
+
+    @timed('mapping_update')
+    def update(self):
+        """Met l'index à jour si des SVG ou des images ont changé ; retourne le nombre de SVG résolus."""
+        svgs, image_names = self._scan()
+        signature = listing_signature(svgs, image_names)
+        if signature == self.signature:
+            return 0
+        images = defaultdict(list)
+        for name in image_names:
+            images[os.path.splitext(name)[0]].append(name)
+        rank = {ext: k for k, ext in enumerate(IMAGE_EXTS)}
+        for names in images.values():
+            names.sort(key=lambda n: (rank[os.path.splitext(n)[1].lower()], n))
+        images = dict(images)
+
+        # Seuls les SVG nouveaux, ou dont une image candidate est apparue/disparue, sont résolus
+        changed_stems = {stem for stem in set(images) | set(self.images)
+                         if images.get(stem) != self.images.get(stem)}
+        todo = svgs - set(self.pairs)
+        if changed_stems:
+            todo |= {svg for svg in svgs & set(self.pairs)
+                     if any(stem in changed_stems for _, stem in candidate_stems(svg, self.offset))}
+        self.svgs = svgs
+        self.images = images
+        self.pairs = {svg: pair for svg, pair in self.pairs.items() if svg in svgs}
+        for svg in todo:
+            self.pairs[svg] = self.resolve(svg)
+        self.signature = signature
+        self.dirty = True
+        self.save()
+        return len(todo)
+
+    def resolve(self, svg_name, exts=None):
+        """(image, règle, autres images) pour un SVG, sans passer par l'index persistant."""
+        for rule, stem in candidate_stems(svg_name, self.offset):
+            names = self.images.get(stem)
+            if names and exts is not None:
+                names = [n for n in names if os.path.splitext(n)[1].lower() in exts]
+            if names:
+                return names[0], rule, names[1:]
+        return None, None, []
+
+    def image_for(self, svg_name, exts=None):
+        """Nom de l'image associée au SVG (None si aucune), restreinte à `exts` si donné."""
+        pair = self.pairs.get(svg_name)
+        if pair is None or (exts is not None and pair[0] is not None
+                            and os.path.splitext(pair[0])[1].lower() not in exts):
+            return self.resolve(svg_name, exts)[0]
+        return pair[0]
+
+    def rule_for(self, svg_name):
+        pair = self.pairs.get(svg_name)
+        return pair[1] if pair else None
+
+    def svgs_by_image(self):
+        by_image = defaultdict(list)
+        for svg, (image, _, _) in self.pairs.items():
+            if image is not None:
+                by_image[image].append(svg)
+        return by_image
+
+    def unresolved(self):
+        return sorted(svg for svg, (image, _, _) in self.pairs.items() if image is None)
+
+    def ambiguous(self):
+        """[(SVG, image retenue, raison)] : plusieurs extensions candidates ou image partagée."""
+        issues = []
+        for svg, (image, _, others) in sorted(self.pairs.items()):
+            if others:
+                issues.append((svg, image, f"autres candidats : {', '.join(others)}"))
+        for image, svgs in sorted(self.svgs_by_image().items()):
+            if len(svgs) > 1:
+                for svg in sorted(svgs):
+                    issues.append((svg, image, f"image partagée par {len(svgs)} SVG"))
+        return issues
+
+    def orphan_images(self):
+        used = self.svgs_by_image()
+        return sorted(n for names in self.images.values() for n in names if n not in used)
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'params': self.params, 'signature': self.signature, 'svgs': sorted(self.svgs),
+                       'images': self.images, 'pairs': self.pairs}, f)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+    def summary(self):
+        rules = defaultdict(int)
+        for _, rule, _ in self.pairs.values():
+            rules[rule or 'aucune'] += 1
+        n_images = sum(len(names) for names in self.images.values())
+        detail = ', '.join(f"{rule} : {n}" for rule, n in sorted(rules.items()))
+        return f"{len(self.svgs)} SVG et {n_images} images indexés ({detail})"
@@ -0,0 +1,267 @@
+"""Instrumentation du pipeline : durée, CPU et mémoire par étape, rapport JSON.
+
+Chaque script crée un RunReport ; les étapes sont mesurées avec
+`with report.stage('nom'):` (durée, temps CPU, RSS début/fin et pic de
+l'étape), les fonctions chaudes avec le décorateur @timed (appels et temps
+cumulés, sans coût si aucun rapport n'est actif). Le rapport de chaque
+script est fusionné dans un même fichier JSON (par défaut
+output_detectron2/run_report.json, à côté de metrics.json), une entrée par
+script.
+
+Avec profile=<fichier.prof>, le script est aussi profilé par cProfile (thread
+principal et threads de travail) ; le fichier se lit avec pstats ou
+snakeviz. Le travail fait dans des processus séparés n'est pas profilé.
+"""
+import cProfile
+import contextlib
+import functools
+import json
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+DEFAULT_REPORT = os.path.join('output_detectron2', 'run_report.json')
+
+_ACTIVE = None
+
+
+def _memory_mb():
+    """(RSS courant, pic de RSS) du processus en Mo, via /proc si disponible."""
+    try:
+        values = {}
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    key, value = line.split(':', 1)
+                    values[key] = int(value.split()[0]) / 1024
+        return values['VmRSS'], values['VmHWM']
+    except (OSError, KeyError):
+        # ru_maxrss est en Ko sous Linux ; pas de RSS courant hors /proc
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return peak, peak
+
+
+def _reset_peak():
+    """Remet à zéro le pic de RSS (VmHWM) pour mesurer une étape isolément (Linux)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+class RunReport:
+    """Mesures d'un script, écrites dans le rapport JSON commun par close()."""
+
+    def __init__(self, name, path=DEFAULT_REPORT, profile=None):
+        global _ACTIVE
+        self.name = name
+        self.path = path
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self.start = time.perf_counter()
+        self.stages = []
+        self.functions = {}
+        self.extra = {}
+        self._stack = []
+        self._lock = threading.Lock()
+        self._profile_path = profile
+        self._profiles = []
+        if profile:
+            self._start_profile()
+        _ACTIVE = self
+
+    @contextlib.contextmanager
+    def stage(self, name, **info):
+        """Mesure une étape ; le dict produit peut recevoir des compteurs (images, annotations...)."""
+        entry = {'name': name, **info}
+        rss_start, peak_before = _memory_mb()
+        # Le pic atteint jusqu'ici appartient aux étapes englobantes, avant la remise à zéro
+        for parent in self._stack:
+            parent['_peak'] = max(parent['_peak'], peak_before)
+        _reset_peak()
+        t0 = time.perf_counter()
+        cpu0 = time.process_time()
+        entry['_peak'] = rss_start
+        self._stack.append(entry)
+        try:
+            yield entry
+        finally:
+            self._stack.pop()
+            rss_end, peak = _memory_mb()
+            peak = max(peak, entry.pop('_peak'))
+            entry.update({
+                'wall_s': round(time.perf_counter() - t0, 3),
+                'cpu_s': round(time.process_time() - cpu0, 3),
+                'rss_start_mb': round(rss_start, 1),
+                'rss_end_mb': round(rss_end, 1),
+                'peak_rss_mb': round(peak, 1),
+            })
+            # Le pic a été remis à zéro : les étapes englobantes héritent de celui-ci
+            for parent in self._stack:
+                parent['_peak'] = max(parent['_peak'], peak)
+            if self._stack:
+                self._stack[-1].setdefault('stages', []).append(entry)
+            else:
+                self.stages.append(entry)
+
+    def add_call(self, name, seconds):
+        with self._lock:
+            stats = self.functions.setdefault(name, {'calls': 0, 'total_s': 0.0})
+            stats['calls'] += 1
+            stats['total_s'] += seconds
+
+    def _start_profile(self):
+        lock = threading.Lock()
+
+        def profile_thread(*_):
+            # Premier événement d'un nouveau thread : on y installe un profileur dédié
+            sys.setprofile(None)
+            prof = cProfile.Profile()
+            with lock:
+                self._profiles.append(prof)
+            prof.enable()
+
+        threading.setprofile(profile_thread)
+        main = cProfile.Profile()
+        self._profiles.append(main)
+        main.enable()
+
+    def _dump_profile(self, top=20):
+        threading.setprofile(None)
+        self._profiles[0].disable()
+        stats = pstats.Stats(self._profiles[0])
+        for prof in self._profiles[1:]:
+            prof.create_stats()
+            if prof.stats:
+                stats.add(prof)
+        stats.dump_stats(self._profile_path)
+        print(f"Profil cProfile écrit dans {self._profile_path} ({len(self._profiles)} threads profilés)")
+        stats.sort_stats('cumulative').print_stats(top)
+
+    def close(self):
+        """Arrête le profilage éventuel et fusionne ce rapport dans le fichier JSON."""
+        global _ACTIVE
+        if _ACTIVE is self:
+            _ACTIVE = None
+        if self._profile_path:
+            self._dump_profile()
+        _, peak = _memory_mb()
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        run = {
+            'started': self.started,
+            'argv': sys.argv,
+            'wall_s': round(time.perf_counter() - self.start, 3),
+            'peak_rss_mb': round(max([peak] + [s['peak_rss_mb'] for s in self.stages]), 1),
+            'children_peak_rss_mb': round(children, 1),
+            'stages': self.stages,
+            'functions': {k: {'calls': v['calls'], 'total_s': round(v['total_s'], 3)}
+                          for k, v in sorted(self.functions.items(), key=lambda kv: -kv[1]['total_s'])},
+            **self.extra,
+        }
+        report = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    report = json.load(f)
+            except ValueError:
+                print(f"[WARN] Rapport {self.path} illisible : remplacé")
+        report[self.name] = run
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Rapport d'exécution ({self.name}, {run['wall_s']:.1f} s, pic RSS {run['peak_rss_mb']:.0f} Mo) "
+              f"écrit dans {self.path}")
+        return run
+
+
+def timed(name=None):
+    """Décorateur : cumule appels et durée dans le rapport actif (sans effet sinon)."""
+    def decorate(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            report = _ACTIVE
+            if report is None:
+                return func(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                report.add_call(label, time.perf_counter() - t0)
+        return wrapper
+    return decorate
+
+
+def add_report_args(parser):
+    """Options communes --report / --profile des scripts du pipeline."""
+    parser.add_argument('--report', type=str, default=DEFAULT_REPORT, help='Rapport JSON des durées et mémoire par étape')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='Profil cProfile (.prof, lisible avec pstats/snakeviz) des fonctions chaudes')
+
+
+class _TrainProfile:
+    """Sépare, à chaque itération, l'attente du dataloader du calcul (passe avant/arrière + hooks)."""
+
+    def __init__(self, report):
+        self.report = report
+        self.step_times = []
+        self.data_times = []
+
+    def before_step(self):
+        self._t0 = time.perf_counter()
+
+    def after_step(self):
+        self.step_times.append(time.perf_counter() - self._t0)
+        # data_time est mesuré par SimpleTrainer.run_step autour de next(data_loader)
+        history = self.trainer.storage.histories().get('data_time')
+        if history is not None and history.values() and history.values()[-1][1] == self.trainer.iter:
+            self.data_times.append(history.values()[-1][0])
+        else:
+            self.data_times.append(float('nan'))
+
+    def after_train(self):
+        if not self.step_times:
+            return
+        steps = np.array(self.step_times)
+        data = np.array(self.data_times)
+        known = ~np.isnan(data)
+        data_wait = float(data[known].sum())
+        total = float(steps[known].sum()) if known.any() else float(steps.sum())
+        self.report.extra['training'] = {
+            'iterations': len(steps),
+            'step_total_s': round(float(steps.sum()), 3),
+            'data_wait_s': round(data_wait, 3),
+            'compute_s': round(total - data_wait, 3),
+            'data_wait_fraction': round(data_wait / total, 4) if total else None,
+            'step_p50_ms': round(float(np.percentile(steps, 50)) * 1000, 1),
+            'step_p95_ms': round(float(np.percentile(steps, 95)) * 1000, 1),
+            'peak_rss_mb': round(_memory_mb()[1], 1),
+        }
+        import torch
+        if torch.cuda.is_available():
+            self.report.extra['training']['cuda_peak_mb'] = round(torch.cuda.max_memory_allocated() / 2**20, 1)
+
+
+@functools.lru_cache(maxsize=None)
+def _train_profile_hook():
+    try:
+        from detectron2.engine import HookBase
+    except ImportError:  # scripts de préparation des données, sans Detectron2
+        HookBase = object
+    return type('TrainProfileHook', (_TrainProfile, HookBase),
+                {'__module__': __name__, '__doc__': _TrainProfile.__doc__})
+
+
+def __getattr__(name):
+    # TrainProfileHook hérite du HookBase de Detectron2 : la classe n'est créée qu'à la première
+    # demande, pour que les scripts de préparation des données n'importent ni torch ni Detectron2
+    if name == 'TrainProfileHook':
+        return _train_profile_hook()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
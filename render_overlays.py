@@ -0,0 +1,190 @@
+"""Rendu en lot des annotations SVG superposées aux plans PNG (QA visuelle, sans affichage).
+
+Chaque SVG <prefixe>_gt_*.svg est dessiné sur l'image <prefixe>.png (ou
+.jpg) par rastérisation directe (PIL) : l'image est d'abord réduite à la
+taille de sortie, puis chaque classe est peinte dans un calque
+semi-transparent unique (couleur fixe par classe, indépendante des
+couleurs incohérentes des SVG) composé en une seule fois. Les plans sont
+traités dans un pool de processus ; une planche contact optionnelle
+regroupe les vignettes.
+
+    python render_overlays.py dataset --out overlays --max-side 1024 --contact-sheet
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+import numpy as np
+from PIL import Image, ImageDraw
+from mapping_index import MappingIndex
+from svg_parser import parse_svg_file
+
+# Couleur par classe ; les grandes surfaces (pièces) sont peintes en premier
+CLASS_COLORS = {
+    'Room': (255, 142, 70),
+    'Parking': (142, 70, 142),
+    'Separation': (214, 70, 70),
+    'Wall': (31, 119, 180),
+    'Window': (246, 189, 15),
+    'Door': (139, 186, 0),
+    'Text': (0, 142, 142),
+}
+OTHER_COLOR = (128, 128, 128)
+
+
+def find_pairs(svg_dir, img_dir=None):
+    """[(svg, image ou None)] : chaque SVG avec son image selon l'index de mapping, triés."""
+    img_dir = img_dir or svg_dir
+    index = MappingIndex(svg_dir, img_dir)
+    pairs = []
+    for svg in sorted(index.svgs):
+        image = index.image_for(svg)
+        pairs.append((os.path.join(svg_dir, svg), os.path.join(img_dir, image) if image else None))
+    return pairs
+
+
+def draw_legend(image, counts):
+    draw = ImageDraw.Draw(image)
+    y = 4
+    for cls, count in counts.items():
+        color = CLASS_COLORS.get(cls, OTHER_COLOR)
+        draw.rectangle((4, y, 16, y + 12), fill=color, outline=(0, 0, 0))
+        draw.text((20, y), f"{cls} ({count})", fill=(0, 0, 0))
+        y += 16
+
+
+def render_overlay(svg_path, img_path, max_side=1024, alpha=110, legend=True):
+    """Image RGB du plan avec ses polygones ; (image, nombre de polygones par classe)."""
+    parsed = parse_svg_file(svg_path)
+    svg_w, svg_h = parsed['width'], parsed['height']
+    if img_path is not None:
+        base = Image.open(img_path)
+        if max_side:
+            # JPEG : décodage directement à échelle réduite
+            base.draft('RGB', (max_side, max_side))
+            base.thumbnail((max_side, max_side), Image.BILINEAR, reducing_gap=2.0)
+        base = base.convert('RGB')
+    else:
+        # Pas d'image : fond blanc à la taille déclarée dans le SVG
+        w, h = int(svg_w or 1000), int(svg_h or 1000)
+        scale = min(1.0, max_side / max(w, h)) if max_side else 1.0
+        base = Image.new('RGB', (max(1, round(w * scale)), max(1, round(h * scale))), (255, 255, 255))
+    # Repère SVG -> pixels de l'image de sortie (gère aussi une image de taille différente du SVG)
+    sx = base.width / svg_w if svg_w else 1.0
+    sy = base.height / svg_h if svg_h else 1.0
+    scale = np.array([sx, sy], dtype=np.float32)
+
+    by_class = {}
+    for poly in parsed['polygons']:
+        if len(poly['points']) >= 3:
+            by_class.setdefault(poly['class'], []).append(poly['points'])
+    order = [c for c in CLASS_COLORS if c in by_class] + sorted(c for c in by_class if c not in CLASS_COLORS)
+    # Un calque par image, une passe par classe : pas de double assombrissement des chevauchements
+    layer = Image.new('RGBA', base.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(layer)
+    for cls in order:
+        color = CLASS_COLORS.get(cls, OTHER_COLOR)
+        for pts in by_class[cls]:
+            draw.polygon((pts * scale).ravel().tolist(), fill=color + (alpha,), outline=color + (255,))
+    image = Image.alpha_composite(base.convert('RGBA'), layer).convert('RGB')
+    counts = {cls: len(by_class[cls]) for cls in order}
+    if legend:
+        draw_legend(image, counts)
+    return image, counts
+
+
+def _render_job(job):
+    svg_path, img_path, out_path, max_side, alpha, cell_size = job
+    try:
+        image, counts = render_overlay(svg_path, img_path, max_side, alpha)
+        image.save(out_path, quality=85)
+        cell = None
+        if cell_size:
+            image.thumbnail((cell_size, cell_size), Image.BILINEAR)
+            cell = image
+        return svg_path, counts, cell, None
+    except Exception as e:
+        return svg_path, None, None, str(e)
+
+
+class ContactSheets:
+    """Planches contact paginées, écrites au fil de l'eau (mémoire bornée)."""
+
+    def __init__(self, out_dir, cell_size=256, cols=8, rows=8):
+        self.out_dir = out_dir
+        self.cell_size = cell_size
+        self.cols = cols
+        self.per_sheet = cols * rows
+        self.cells = []
+        self.pages = 0
+
+    def add(self, cell, label):
+        self.cells.append((cell, label))
+        if len(self.cells) == self.per_sheet:
+            self.flush()
+
+    def flush(self):
+        if not self.cells:
+            return
+        label_h = 14
+        rows = (len(self.cells) + self.cols - 1) // self.cols
+        sheet = Image.new('RGB', (self.cols * self.cell_size, rows * (self.cell_size + label_h)), (255, 255, 255))
+        draw = ImageDraw.Draw(sheet)
+        for k, (cell, label) in enumerate(self.cells):
+            x = (k % self.cols) * self.cell_size
+            y = (k // self.cols) * (self.cell_size + label_h)
+            sheet.paste(cell, (x + (self.cell_size - cell.width) // 2, y))
+            draw.text((x + 2, y + self.cell_size), label[:self.cell_size // 6], fill=(0, 0, 0))
+        self.pages += 1
+        sheet.save(os.path.join(self.out_dir, f"contact_sheet_{self.pages:03d}.jpg"), quality=85)
+        self.cells = []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rendu en lot des annotations SVG sur les plans (QA visuelle)")
+    parser.add_argument('svg_dir', type=str, help='Dossier des SVG')
+    parser.add_argument('--img_dir', type=str, default=None, help='Dossier des images (défaut : svg_dir)')
+    parser.add_argument('--out', type=str, default='overlays', help='Dossier de sortie')
+    parser.add_argument('--max-side', type=int, default=1024, help='Plus grand côté des rendus (0 = taille réelle)')
+    parser.add_argument('--alpha', type=int, default=110, help='Opacité du remplissage (0-255)')
+    parser.add_argument('--format', type=str, default='jpg', choices=['jpg', 'png'], help='Format des rendus')
+    parser.add_argument('--contact-sheet', action='store_true', help='Planches contact des vignettes')
+    parser.add_argument('--cell-size', type=int, default=256, help='Taille des vignettes de la planche contact')
+    parser.add_argument('--skip-existing', action='store_true', help='Ne refait pas les rendus plus récents que leurs sources')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Nombre de processus')
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    pairs = find_pairs(args.svg_dir, args.img_dir)
+    jobs = []
+    for svg_path, img_path in pairs:
+        out_path = os.path.join(args.out, os.path.splitext(os.path.basename(svg_path))[0] + '.' + args.format)
+        # La planche contact a besoin de toutes les vignettes : pas de saut dans ce cas
+        if args.skip_existing and not args.contact_sheet and os.path.isfile(out_path):
+            sources = [svg_path] + ([img_path] if img_path else [])
+            if os.path.getmtime(out_path) >= max(os.path.getmtime(p) for p in sources):
+                continue
+        jobs.append((svg_path, img_path, out_path, args.max_side, args.alpha,
+                     args.cell_size if args.contact_sheet else 0))
+    missing = sum(1 for _, img in pairs if img is None)
+    print(f"{len(pairs)} SVG trouvés ({missing} sans image), {len(jobs)} à rendre avec {args.workers} processus.")
+
+    sheets = ContactSheets(args.out, args.cell_size) if args.contact_sheet else None
+    errors = []
+    chunksize = max(1, len(jobs) // (args.workers * 16))
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for svg_path, counts, cell, error in tqdm(executor.map(_render_job, jobs, chunksize=chunksize),
+                                                  total=len(jobs), desc="Rendu"):
+            if error:
+                errors.append((svg_path, error))
+                print(f"[ERREUR] {svg_path}: {error}")
+            elif sheets is not None:
+                sheets.add(cell, os.path.basename(svg_path))
+    if sheets is not None:
+        sheets.flush()
+        print(f"{sheets.pages} planche(s) contact écrite(s) dans {args.out}")
+    print(f"{len(jobs) - len(errors)} rendus écrits dans {args.out} ({len(errors)} erreurs).")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""Cache de masques RLE précalculés pour l'entraînement Detectron2.
+
+Chaque annotation polygonale est rastérisée une seule fois, à la résolution
+native de son image, en RLE compressé (pycocotools). Les entrées sont
+indexées par le hash du contenu (taille d'image + polygones) : une
+annotation modifiée est recalculée, les entrées orphelines sont purgées.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from coco_store import load_coco
+
+
+def default_cache_path(ann_path):
+    """annotations_train_with_hw.json -> annotations_train_with_hw.rle.sqlite"""
+    return os.path.splitext(ann_path.rstrip('/\\'))[0] + '.rle.sqlite'
+
+
+def segmentation_key(segmentation, height, width):
+    """Hash du contenu d'une annotation (polygones + taille de l'image)."""
+    payload = json.dumps([height, width, segmentation], separators=(',', ':'))
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def polygons_to_rle(segmentation, height, width):
+    """Rastérise une segmentation polygonale COCO en un RLE compressé unique."""
+    from pycocotools import mask as mask_util
+
+    rles = mask_util.frPyObjects(segmentation, height, width)
+    rle = mask_util.merge(rles) if isinstance(rles, list) else rles
+    return rle['counts'].decode('ascii'), float(mask_util.area(rle))
+
+
+def _rasterize_batch(items):
+    return [(key, h, w) + polygons_to_rle(seg, h, w) for key, seg, h, w in items]
+
+
+class RleCache:
+    """Cache SQLite clé de contenu -> (height, width, counts RLE, aire en pixels)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS masks ("
+            " key TEXT PRIMARY KEY, height INTEGER, width INTEGER, counts TEXT, area REAL)"
+        )
+
+    def get_many(self, keys):
+        found = {}
+        wanted = list(set(keys))
+        for i in range(0, len(wanted), 500):
+            batch = wanted[i:i + 500]
+            placeholders = ','.join('?' * len(batch))
+            rows = self.conn.execute(
+                f"SELECT key, height, width, counts, area FROM masks WHERE key IN ({placeholders})", batch
+            )
+            for key, h, w, counts, area in rows:
+                found[key] = {'size': [h, w], 'counts': counts, 'area': area}
+        return found
+
+    def put_many(self, rows):
+        self.conn.executemany("INSERT OR REPLACE INTO masks VALUES (?, ?, ?, ?, ?)", rows)
+
+    def evict(self, keep_keys):
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep (key TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM keep")
+        self.conn.executemany("INSERT OR IGNORE INTO keep VALUES (?)", ((k,) for k in keep_keys))
+        cur = self.conn.execute("DELETE FROM masks WHERE key NOT IN (SELECT key FROM keep)")
+        return cur.rowcount
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def ensure_rles(items, cache_path, workers=1, evict=False):
+    """Retourne {clé: RLE} pour des (clé, segmentation, height, width), en calculant les manquants.
+
+    Si evict, les entrées du cache qui ne correspondent à aucun item sont supprimées.
+    """
+    cache = RleCache(cache_path)
+    try:
+        keys = [item[0] for item in items]
+        found = cache.get_many(keys)
+        todo = list({item[0]: item for item in items if item[0] not in found}.values())
+        if todo:
+            batches = [todo[i:i + 256] for i in range(0, len(todo), 256)]
+            if workers > 1:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    results = list(tqdm(executor.map(_rasterize_batch, batches), total=len(batches),
+                                        desc="Rastérisation RLE"))
+            else:
+                results = [_rasterize_batch(b) for b in tqdm(batches, desc="Rastérisation RLE")]
+            for rows in results:
+                cache.put_many(rows)
+                for key, h, w, counts, area in rows:
+                    found[key] = {'size': [h, w], 'counts': counts, 'area': area}
+        if evict:
+            evicted = cache.evict(keys)
+            if evicted:
+                print(f"{evicted} masques obsolètes supprimés du cache {cache_path}.")
+    finally:
+        cache.close()
+    return found
+
+
+def build_rle_cache(ann_path, cache_path=None, workers=1):
+    """Étape hors-ligne : rastérise toutes les annotations d'un fichier COCO (.json ou .cocobin)."""
+    cache_path = cache_path or default_cache_path(ann_path)
+    coco = load_coco(ann_path)
+    sizes = {img['id']: (img.get('height'), img.get('width')) for img in coco['images']}
+    items = []
+    skipped = 0
+    for ann in coco['annotations']:
+        h, w = sizes.get(ann['image_id'], (None, None))
+        seg = ann.get('segmentation')
+        if not h or not w or not isinstance(seg, list) or not seg:
+            skipped += 1
+            continue
+        items.append((segmentation_key(seg, h, w), seg, h, w))
+    if skipped:
+        print(f"[WARN] {skipped} annotations ignorées (taille d'image inconnue ou segmentation non polygonale)")
+    found = ensure_rles(items, cache_path, workers=workers, evict=True)
+    print(f"Cache RLE {cache_path} : {len(found)} masques pour {len(items)} annotations.")
+    return cache_path
+
+
+def attach_rles(dataset_dicts, cache_path, workers=1):
+    """Remplace les polygones des dicts Detectron2 par les RLE du cache (calculés si absents).
+
+    À utiliser avec cfg.INPUT.MASK_FORMAT = "bitmask".
+    """
+    items = []
+    for record in dataset_dicts:
+        h, w = record['height'], record['width']
+        for obj in record.get('annotations', []):
+            seg = obj.get('segmentation')
+            if isinstance(seg, list) and seg:
+                obj['_rle_key'] = segmentation_key(seg, h, w)
+                items.append((obj['_rle_key'], seg, h, w))
+    found = ensure_rles(items, cache_path, workers=workers)
+    for record in dataset_dicts:
+        for obj in record.get('annotations', []):
+            key = obj.pop('_rle_key', None)
+            if key is not None:
+                rle = found[key]
+                obj['segmentation'] = {'size': rle['size'], 'counts': rle['counts']}
+    return dataset_dicts
+
+
+def register_rle_instances(name, ann_path, image_root, cache_path=None):
+    """Comme register_coco_instances / register_coco_store, mais avec des masques RLE du cache."""
+    from detectron2.data import DatasetCatalog, MetadataCatalog
+    from detectron2.data.datasets import load_coco_json
+    from coco_store import is_store, load_detectron2_dicts, register_coco_store
+
+    cache_path = cache_path or default_cache_path(ann_path)
+    if is_store(ann_path):
+        register_coco_store(name, ann_path, image_root)
+        DatasetCatalog.remove(name)
+        DatasetCatalog.register(name, lambda: attach_rles(load_detectron2_dicts(ann_path, image_root), cache_path))
+        return
+    DatasetCatalog.register(name, lambda: attach_rles(load_coco_json(ann_path, image_root, name), cache_path))
+    MetadataCatalog.get(name).set(json_file=ann_path, image_root=image_root, evaluator_type="coco")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Précalcule les masques RLE des annotations COCO (cache pour l'entraînement)")
+    parser.add_argument('annotations', nargs='+', help='Fichiers COCO (.json ou .cocobin) avec width/height')
+    parser.add_argument('--workers', type=int, default=1, help='Nombre de processus de rastérisation')
+    args = parser.parse_args()
+    for ann_path in args.annotations:
+        build_rle_cache(ann_path, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+"""Échantillonnage de l'entraînement par classe (repeat factor) et par exemples difficiles.
+
+Mode 'repeat' (repeat factor sampling, comme pour LVIS) : pour chaque
+catégorie c, f_c est la fraction des images qui en contiennent au moins
+une instance, r_c = max(1, sqrt(t / f_c)) ; chaque image est tirée en
+moyenne r_i = max(r_c des catégories présentes) fois par epoch. Les images
+contenant des catégories rares (Parking, Text) reviennent plus souvent que
+celles qui n'ont que des murs et des pièces.
+
+Les statistiques (catégories présentes par image) sont calculées une fois
+et mises en cache à côté du fichier d'annotations (<annotations>.sampling.json),
+indexées par le hash de son contenu. Un COCO déjà chargé (dict, ex. les tuiles
+calculées en mémoire par train --dry-run) est traité sans cache.
+
+Mode 'hard' : en plus, le poids de chaque image est multiplié par
+(perte récente / perte moyenne) ** power. La perte totale de chaque
+itération est attribuée aux images du batch (moyenne glissante) dans un
+tenseur en mémoire partagée, relu par l'échantillonneur dans les workers du
+dataloader à chaque renouvellement des tirages.
+
+    python sampling.py annotations_train_with_hw.json --threshold 1.0
+"""
+import argparse
+import functools
+import itertools
+import json
+import math
+import os
+import numpy as np
+from coco_store import CocoStore, content_hash, is_store, load_coco, read_categories
+
+SAMPLING_VERSION = 1
+
+
+def default_stats_path(ann_path):
+    """annotations_train.json -> annotations_train.sampling.json (idem pour un .cocobin)."""
+    return os.path.splitext(ann_path.rstrip('/\\'))[0] + '.sampling.json'
+
+
+def compute_stats(ann):
+    """{'num_images', 'image_categories': {image_id: [category_id, ...]}, 'category_images': {category_id: n}}.
+
+    ann : chemin d'un COCO (.json ou .cocobin) ou COCO déjà chargé (dict).
+    """
+    if isinstance(ann, str) and is_store(ann):
+        store = CocoStore(ann)
+        image_ids = [img['id'] for img in store.images]
+        ann_images = np.asarray(store.ann_image_ids)
+        ann_cats = np.asarray(store.ann_category_ids)
+    else:
+        coco = load_coco(ann) if isinstance(ann, str) else ann
+        image_ids = [img['id'] for img in coco['images']]
+        ann_images = np.fromiter((a['image_id'] for a in coco['annotations']), dtype=np.int64)
+        ann_cats = np.fromiter((a['category_id'] for a in coco['annotations']), dtype=np.int64)
+    # Couples (image, catégorie) distincts : une image compte une fois par catégorie
+    pairs = np.unique(np.stack([ann_images, ann_cats], axis=1), axis=0) if len(ann_images) else np.zeros((0, 2))
+    image_categories = {str(i): [] for i in image_ids}
+    for image_id, cat_id in pairs.tolist():
+        if str(image_id) in image_categories:
+            image_categories[str(image_id)].append(int(cat_id))
+    cats, counts = np.unique(pairs[:, 1], return_counts=True)
+    return {
+        'num_images': len(image_ids),
+        'image_categories': image_categories,
+        'category_images': {str(int(c)): int(n) for c, n in zip(cats.tolist(), counts.tolist())},
+    }
+
+
+def load_stats(ann, cache_path=None, write=True):
+    """Statistiques du fichier d'annotations, relues du cache si son contenu n'a pas changé.
+
+    write=False (--dry-run) : le cache est lu s'il est à jour, mais jamais écrit.
+    """
+    if not isinstance(ann, str):
+        return compute_stats(ann)
+    cache_path = cache_path or default_stats_path(ann)
+    digest = content_hash(ann)
+    if os.path.isfile(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('version') == SAMPLING_VERSION and cached.get('hash') == digest:
+                return cached['stats']
+        except (OSError, ValueError):
+            print(f"[WARN] Cache d'échantillonnage illisible, recalculé : {cache_path}")
+    stats = compute_stats(ann)
+    if not write:
+        return stats
+    tmp = cache_path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'version': SAMPLING_VERSION, 'hash': digest, 'stats': stats}, f)
+    os.replace(tmp, cache_path)
+    return stats
+
+
+def repeat_factors(stats, threshold=1.0):
+    """({image_id: r_i}, {category_id: r_c}) selon la règle du repeat factor sampling."""
+    n = max(stats['num_images'], 1)
+    cat_factors = {int(c): max(1.0, math.sqrt(threshold / (count / n)))
+                   for c, count in stats['category_images'].items()}
+    image_factors = {int(i): max([cat_factors[c] for c in cats], default=1.0)
+                     for i, cats in stats['image_categories'].items()}
+    return image_factors, cat_factors
+
+
+class _HardExampleSampling:
+    """Tirages infinis avec remise, pondérés par repeat factor x difficulté récente.
+
+    Les poids sont recalculés tous les `refresh` tirages à partir des
+    tenseurs partagés `losses` / `seen` (mis à jour par le processus
+    principal) ; les images jamais vues gardent leur repeat factor seul.
+    """
+
+    def __init__(self, factors, losses, seen, power=1.0, refresh=256, clip=(0.25, 4.0), seed=None):
+        from detectron2.utils import comm
+
+        self._factors = factors
+        self._losses = losses
+        self._seen = seen
+        self._power = power
+        self._refresh = refresh
+        self._clip = clip
+        self._seed = int(comm.shared_random_seed() if seed is None else seed)
+        self._rank = comm.get_rank()
+        self._world_size = comm.get_world_size()
+
+    def weights(self):
+        import torch
+
+        seen = self._seen.bool()
+        difficulty = torch.ones_like(self._factors)
+        if seen.any():
+            losses = self._losses[seen]
+            mean = losses.mean()
+            if mean > 0:
+                difficulty[seen] = (losses / mean).clamp(*self._clip) ** self._power
+        return self._factors * difficulty
+
+    def _infinite_indices(self):
+        import torch
+
+        g = torch.Generator()
+        g.manual_seed(self._seed)
+        while True:
+            yield from torch.multinomial(self.weights(), self._refresh, replacement=True, generator=g).tolist()
+
+    def __iter__(self):
+        # Même découpage entre processus que TrainingSampler de Detectron2
+        yield from itertools.islice(self._infinite_indices(), self._rank, None, self._world_size)
+
+
+class RecordingLoader:
+    """Enveloppe du dataloader : retient les image_id du dernier batch fourni au trainer."""
+
+    def __init__(self, loader, sampling):
+        self.loader = loader
+        self.sampling = sampling
+
+    def __iter__(self):
+        for batch in self.loader:
+            self.sampling.last_ids = [d['image_id'] for d in batch]
+            yield batch
+
+
+class ClassAwareSampling:
+    """Construit le dataloader d'entraînement pondéré ; garde l'état du mode 'hard'."""
+
+    def __init__(self, ann, mode='repeat', threshold=1.0, hard_power=1.0, decay=0.9, write_cache=True):
+        self.mode = mode
+        self.hard_power = hard_power
+        self.decay = decay
+        self.stats = load_stats(ann, write=write_cache)
+        self.image_factors, self.cat_factors = repeat_factors(self.stats, threshold)
+        self.index_of = {}
+        self.losses = None
+        self.seen = None
+        self.last_ids = []
+
+    def summary(self, categories):
+        names = {c['id']: c['name'] for c in categories}
+        n = max(self.stats['num_images'], 1)
+        lines = [f"Échantillonnage '{self.mode}' : {sum(self.image_factors.values()):.0f} tirages par epoch "
+                 f"pour {self.stats['num_images']} images"]
+        for cat_id, factor in sorted(self.cat_factors.items()):
+            share = self.stats['category_images'][str(cat_id)] / n
+            lines.append(f"  {names.get(cat_id, cat_id)}: {share:.1%} des images, facteur {factor:.2f}")
+        return '\n'.join(lines)
+
+    def build_train_loader(self, cfg, mapper=None):
+        import torch
+        from detectron2.data import build_detection_train_loader, get_detection_dataset_dicts
+        from detectron2.data.samplers import RepeatFactorTrainingSampler
+
+        dataset = get_detection_dataset_dicts(cfg.DATASETS.TRAIN,
+                                              filter_empty=cfg.DATALOADER.FILTER_EMPTY_ANNOTATIONS)
+        # Facteurs alignés sur l'ordre des dicts (après filtrage des images sans annotation)
+        factors = torch.tensor([self.image_factors.get(d['image_id'], 1.0) for d in dataset], dtype=torch.float32)
+        if self.mode != 'hard':
+            return build_detection_train_loader(cfg, mapper=mapper, dataset=dataset,
+                                                sampler=RepeatFactorTrainingSampler(factors))
+        self.index_of = {d['image_id']: i for i, d in enumerate(dataset)}
+        # Mémoire partagée : les workers du dataloader voient les pertes mises à jour par le trainer
+        self.losses = torch.zeros(len(dataset)).share_memory_()
+        self.seen = torch.zeros(len(dataset), dtype=torch.uint8).share_memory_()
+        hard_sampler = _training_classes()['HardExampleSampler']
+        sampler = hard_sampler(factors, self.losses, self.seen, power=self.hard_power,
+                               refresh=max(cfg.SOLVER.IMS_PER_BATCH * 16, 64))
+        return RecordingLoader(build_detection_train_loader(cfg, mapper=mapper, dataset=dataset, sampler=sampler), self)
+
+    def record(self, loss):
+        """Attribue la perte de l'itération aux images du dernier batch (moyenne glissante)."""
+        indices = [self.index_of[i] for i in self.last_ids if i in self.index_of]
+        if not indices or not math.isfinite(loss):
+            return
+        for i in indices:
+            old = float(self.losses[i])
+            self.losses[i] = self.decay * old + (1 - self.decay) * loss if self.seen[i] else loss
+            self.seen[i] = 1
+
+
+class _HardExampleRecording:
+    """Transmet la perte totale de chaque itération à ClassAwareSampling (mode 'hard')."""
+
+    def __init__(self, sampling):
+        self.sampling = sampling
+
+    def after_step(self):
+        history = self.trainer.storage.histories().get('total_loss')
+        # total_loss est écrit par SimpleTrainer à chaque itération (processus principal)
+        if history is not None and history.values() and history.values()[-1][1] == self.trainer.iter:
+            self.sampling.record(history.values()[-1][0])
+
+
+@functools.lru_cache(maxsize=None)
+def _training_classes():
+    try:
+        from detectron2.engine import HookBase
+        from torch.utils.data import Sampler
+    except ImportError:  # statistiques seules (CLI), sans PyTorch ni Detectron2
+        HookBase = object
+        Sampler = object
+    return {
+        'HardExampleSampler': type('HardExampleSampler', (_HardExampleSampling, Sampler),
+                                   {'__module__': __name__, '__doc__': _HardExampleSampling.__doc__}),
+        'HardExampleHook': type('HardExampleHook', (_HardExampleRecording, HookBase),
+                                {'__module__': __name__, '__doc__': _HardExampleRecording.__doc__}),
+    }
+
+
+def __getattr__(name):
+    # Comme profiling.TrainProfileHook : torch et Detectron2 ne sont importés qu'à la première
+    # utilisation de ces classes (les statistiques et le plan d'entraînement n'en ont pas besoin)
+    if name in ('HardExampleSampler', 'HardExampleHook'):
+        return _training_classes()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Facteurs de répétition par catégorie d'un fichier COCO")
+    parser.add_argument('annotations', type=str, help='COCO d\'entraînement (.json ou .cocobin)')
+    parser.add_argument('--threshold', type=float, default=1.0,
+                        help='Fraction d\'images sous laquelle une catégorie est suréchantillonnée')
+    args = parser.parse_args()
+    sampling = ClassAwareSampling(args.annotations, threshold=args.threshold)
+    print(sampling.summary(read_categories(args.annotations)))
+    factors = np.array(list(sampling.image_factors.values()) or [1.0])
+    print(f"Facteur par image : min {factors.min():.2f}, médian {np.median(factors):.2f}, max {factors.max():.2f} ; "
+          f"{int((factors > 1).sum())} images suréchantillonnées")
+
+
+if __name__ == '__main__':
+    main()
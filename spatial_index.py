@@ -0,0 +1,479 @@
+"""Index spatial des annotations par image : requêtes fenêtre, point, k plus proches, intersection.
+
+Pour chaque image, les boîtes des annotations (calculées sur les polygones)
+sont rangées dans un R-tree compacté par STR (Sort-Tile-Recursive) : les
+boîtes sont triées en tranches verticales par centre x, puis par centre y
+dans chaque tranche, et regroupées par NODE_CAPACITY. Les niveaux supérieurs
+regroupent les nœuds consécutifs du niveau inférieur. Tout l'arbre tient
+dans des tableaux numpy : les enfants du nœud i sont les entrées
+[i * capacity, (i + 1) * capacity) du niveau du dessous, et une requête
+descend l'arbre un niveau à la fois, tous les nœuds retenus testés d'un coup.
+
+Les tests exacts (point dans le polygone, distance, intersection de
+polygones) ne portent que sur les candidats retenus par l'arbre, avec les
+fonctions vectorisées de geometry.py.
+
+L'index de tout le fichier est écrit à côté des annotations
+(<annotations>.spatial.npz), indexé par le hash de leur contenu.
+
+    python spatial_index.py annotations.json --bench 200
+    python spatial_index.py annotations.json --image 3 --adjacent Door Wall
+"""
+import argparse
+import json
+import math
+import os
+import time
+import numpy as np
+import geometry
+from coco_store import content_hash, load_coco
+from profiling import timed
+
+SPATIAL_VERSION = 1
+NODE_CAPACITY = 16
+# Nombre maximal de paires d'arêtes comparées d'un coup dans les tests exacts
+_EDGE_BLOCK = 1 << 18
+
+
+def default_index_path(ann_path):
+    """annotations_train.json -> annotations_train.spatial.npz (idem pour un .cocobin)."""
+    return os.path.splitext(ann_path.rstrip('/\\'))[0] + '.spatial.npz'
+
+
+def _concat_ranges(starts, counts):
+    """Indices de la concaténation des plages [start, start + count)."""
+    counts = np.asarray(counts, dtype=np.int64)
+    ends = np.cumsum(counts)
+    shift = np.repeat(np.asarray(starts, dtype=np.int64) - (ends - counts), counts)
+    return shift + np.arange(ends[-1] if len(ends) else 0, dtype=np.int64)
+
+
+def str_order(boxes, capacity=NODE_CAPACITY):
+    """Ordre STR des boîtes (x0, y0, x1, y1) : tranches par centre x, puis tri par centre y."""
+    n = len(boxes)
+    if n <= capacity:
+        return np.arange(n, dtype=np.int64)
+    slices = math.ceil(math.sqrt(math.ceil(n / capacity)))
+    by_x = np.argsort(boxes[:, 0] + boxes[:, 2], kind='stable')
+    slice_of = np.empty(n, dtype=np.int64)
+    slice_of[by_x] = np.arange(n) // (slices * capacity)
+    return np.lexsort((boxes[:, 1] + boxes[:, 3], slice_of))
+
+
+def pack_levels(boxes, capacity=NODE_CAPACITY):
+    """Boîtes des nœuds de chaque niveau, du niveau des feuilles jusqu'à la racine (un seul nœud)."""
+    levels = []
+    while len(boxes) and (not levels or len(boxes) > 1):
+        starts = np.arange(0, len(boxes), capacity)
+        boxes = np.concatenate([np.minimum.reduceat(boxes[:, :2], starts, axis=0),
+                                np.maximum.reduceat(boxes[:, 2:], starts, axis=0)], axis=1)
+        levels.append(boxes)
+    return levels
+
+
+def _rings_of(ann):
+    """Anneaux d'une annotation ; rectangle de sa bbox si elle n'a pas de polygone (RLE)."""
+    segmentation = ann.get('segmentation')
+    if isinstance(segmentation, list):
+        rings = [r for r in segmentation if len(r) >= 6]
+        if rings:
+            return rings
+    x, y, w, h = ann['bbox']
+    return [[x, y, x + w, y, x + w, y + h, x, y + h]]
+
+
+def _cross(o, p, q):
+    """Produit vectoriel (p - o) x (q - o), avec diffusion numpy."""
+    return (p[..., 0] - o[..., 0]) * (q[..., 1] - o[..., 1]) - (p[..., 1] - o[..., 1]) * (q[..., 0] - o[..., 0])
+
+
+def _edge_contacts(a, b, c, d, tolerance):
+    """Pour chaque arête [a_i, b_i] : touche-t-elle l'une des arêtes [c_j, d_j] (à tolerance près) ?"""
+    hit = np.zeros(len(a), dtype=bool)
+    block = max(1, _EDGE_BLOCK // max(len(c), 1))
+    for s in range(0, len(a), block):
+        p, q = a[s:s + block, None, :], b[s:s + block, None, :]
+        d1, d2 = _cross(c, d, p), _cross(c, d, q)
+        d3, d4 = _cross(p, q, c), _cross(p, q, d)
+        # Segments colinéaires : l'intersection se réduit au recouvrement de leurs boîtes
+        overlap = ((np.minimum(p[..., 0], q[..., 0]) <= np.maximum(c[:, 0], d[:, 0]))
+                   & (np.minimum(c[:, 0], d[:, 0]) <= np.maximum(p[..., 0], q[..., 0]))
+                   & (np.minimum(p[..., 1], q[..., 1]) <= np.maximum(c[:, 1], d[:, 1]))
+                   & (np.minimum(c[:, 1], d[:, 1]) <= np.maximum(p[..., 1], q[..., 1])))
+        touch = (d1 * d2 <= 0) & (d3 * d4 <= 0) & overlap
+        if tolerance > 0:
+            # Distance entre segments disjoints : min des distances extrémité-segment
+            near = np.minimum(
+                np.minimum(geometry.point_segment_distances(p[..., 0], p[..., 1], c, d),
+                           geometry.point_segment_distances(q[..., 0], q[..., 1], c, d)),
+                np.minimum(geometry.point_segment_distances(c[:, None, 0], c[:, None, 1], p[:, 0], q[:, 0]).T,
+                           geometry.point_segment_distances(d[:, None, 0], d[:, None, 1], p[:, 0], q[:, 0]).T))
+            touch |= near <= tolerance
+        hit[s:s + block] = touch.any(axis=1)
+    return hit
+
+
+def _points_in_rings(points, vertices, offsets):
+    """Booléens (N,) : chaque point est-il dans au moins un des anneaux ?"""
+    inside = np.zeros(len(points), dtype=bool)
+    for k in range(len(offsets) - 1):
+        a, b = geometry.ring_edges(vertices[offsets[k]:offsets[k + 1]], offsets[k:k + 2] - offsets[k])
+        x, y = points[:, None, 0], points[:, None, 1]
+        straddle = (a[:, 1] > y) != (b[:, 1] > y)
+        dy = np.where(straddle, b[:, 1] - a[:, 1], 1.0)
+        crossing = straddle & (x < a[:, 0] + (y - a[:, 1]) * (b[:, 0] - a[:, 0]) / dy)
+        inside |= crossing.sum(axis=1) % 2 == 1
+    return inside
+
+
+class ImageIndex:
+    """R-tree STR des annotations d'une image ; les requêtes retournent des IDs d'annotations COCO."""
+
+    def __init__(self, ids, category_ids, boxes, vertices, poly_offsets, ann_poly_offsets, levels,
+                 capacity=NODE_CAPACITY, categories=None):
+        self.ids = ids
+        self.category_ids = category_ids
+        self.boxes = boxes
+        self.vertices = vertices
+        self.poly_offsets = poly_offsets
+        self.ann_poly_offsets = ann_poly_offsets
+        self.levels = levels
+        self.capacity = capacity
+        self.categories = categories or {}  # nom -> ID de catégorie
+
+    @classmethod
+    def from_annotations(cls, annotations, capacity=NODE_CAPACITY, categories=None):
+        """Construit l'index d'une image à partir de ses annotations COCO (dicts)."""
+        rings, counts = [], []
+        for ann in annotations:
+            ann_rings = _rings_of(ann)
+            rings.extend(ann_rings)
+            counts.append(len(ann_rings))
+        vertices, poly_offsets = geometry.pack_rings(rings)
+        ann_poly_offsets = np.zeros(len(annotations) + 1, dtype=np.int64)
+        np.cumsum(counts, out=ann_poly_offsets[1:])
+        boxes = geometry.group_bboxes(geometry.ring_bboxes(vertices, poly_offsets), ann_poly_offsets)
+        boxes[:, 2:] += boxes[:, :2]
+        order = str_order(boxes, capacity)
+
+        # Annotations (et leurs anneaux) réordonnées selon STR
+        ring_counts = np.diff(ann_poly_offsets)[order]
+        rings_idx = _concat_ranges(ann_poly_offsets[:-1][order], ring_counts)
+        vertex_counts = np.diff(poly_offsets)[rings_idx]
+        vertices = vertices[_concat_ranges(poly_offsets[:-1][rings_idx], vertex_counts)].astype(np.float32)
+        poly_offsets = np.zeros(len(rings_idx) + 1, dtype=np.int64)
+        np.cumsum(vertex_counts, out=poly_offsets[1:])
+        np.cumsum(ring_counts, out=ann_poly_offsets[1:])
+        ids = np.array([a['id'] for a in annotations], dtype=np.int64)[order]
+        category_ids = np.array([a['category_id'] for a in annotations], dtype=np.int64)[order]
+        boxes = boxes[order]
+        return cls(ids, category_ids, boxes, vertices, poly_offsets, ann_poly_offsets,
+                   pack_levels(boxes, capacity), capacity, categories)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _category_mask(self, positions, category):
+        if category is None:
+            return positions
+        wanted = [self.categories.get(c, c) for c in ([category] if isinstance(category, (str, int)) else category)]
+        return positions[np.isin(self.category_ids[positions], wanted)]
+
+    def _search(self, x0, y0, x1, y1):
+        """Positions des annotations dont la boîte touche le rectangle [x0, x1] x [y0, y1]."""
+        if not self.levels:
+            return np.zeros(0, dtype=np.int64)
+        sizes = [len(level) for level in self.levels[:-1]]
+        sizes = [len(self.boxes)] + sizes
+        nodes = np.zeros(1, dtype=np.int64)
+        for level, below in zip(reversed(self.levels), reversed(sizes)):
+            b = level[nodes]
+            nodes = nodes[(b[:, 0] <= x1) & (b[:, 2] >= x0) & (b[:, 1] <= y1) & (b[:, 3] >= y0)]
+            if not len(nodes):
+                return nodes
+            starts = nodes * self.capacity
+            nodes = _concat_ranges(starts, np.minimum(starts + self.capacity, below) - starts)
+        b = self.boxes[nodes]
+        return nodes[(b[:, 0] <= x1) & (b[:, 2] >= x0) & (b[:, 1] <= y1) & (b[:, 3] >= y0)]
+
+    def _rings(self, positions):
+        """(vertices, offsets, groupes d'anneaux) des annotations aux positions données."""
+        r0 = self.ann_poly_offsets[positions]
+        ring_counts = self.ann_poly_offsets[positions + 1] - r0
+        rings = _concat_ranges(r0, ring_counts)
+        v0 = self.poly_offsets[rings]
+        vertex_counts = self.poly_offsets[rings + 1] - v0
+        offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+        np.cumsum(vertex_counts, out=offsets[1:])
+        groups = np.zeros(len(positions) + 1, dtype=np.int64)
+        np.cumsum(ring_counts, out=groups[1:])
+        return self.vertices[_concat_ranges(v0, vertex_counts)], offsets, groups
+
+    def window(self, x0, y0, x1, y1, category=None):
+        """IDs des annotations dont la boîte touche le rectangle (x0, y0, x1, y1)."""
+        return self.ids[self._category_mask(self._search(x0, y0, x1, y1), category)]
+
+    def point(self, x, y, category=None, exact=True):
+        """IDs des annotations contenant le point (dans leur polygone si exact, sinon dans leur boîte)."""
+        pos = self._category_mask(self._search(x, y, x, y), category)
+        if exact and len(pos):
+            vertices, offsets, groups = self._rings(pos)
+            pos = pos[geometry.segment_sums(geometry.rings_contain(vertices, offsets, x, y), groups) > 0]
+        return self.ids[pos]
+
+    def _distances(self, positions, x, y):
+        vertices, offsets, groups = self._rings(positions)
+        return np.minimum.reduceat(geometry.ring_distances(vertices, offsets, x, y), groups[:-1])
+
+    def nearest(self, x, y, k=1, category=None):
+        """(IDs, distances) des k annotations les plus proches du point (distance au polygone, 0 dedans)."""
+        if not self.levels or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        root = self.levels[-1][0]
+        extent = max(root[2] - root[0], root[3] - root[1], 1.0)
+        # Fenêtre initiale : de quoi contenir ~k boîtes si elles étaient uniformément réparties
+        radius = extent * math.sqrt(k / len(self))
+        while True:
+            pos = self._category_mask(self._search(x - radius, y - radius, x + radius, y + radius), category)
+            covers = (x - radius <= root[0] and y - radius <= root[1] and x + radius >= root[2]
+                      and y + radius >= root[3])
+            if len(pos) >= k or covers:
+                break
+            radius *= 2
+        if not len(pos):
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        dist = self._distances(pos, x, y)
+        kth = np.partition(dist, min(k, len(dist)) - 1)[min(k, len(dist)) - 1]
+        if kth > radius and not covers:
+            # Une annotation hors de la fenêtre peut être plus proche que la k-ième trouvée :
+            # toutes celles à distance <= kth ont leur boîte dans le carré de demi-côté kth
+            pos = self._category_mask(self._search(x - kth, y - kth, x + kth, y + kth), category)
+            dist = self._distances(pos, x, y)
+        best = np.argsort(dist, kind='stable')[:k]
+        return self.ids[pos[best]], dist[best]
+
+    def _touching(self, vertices, offsets, positions, tolerance=0.0):
+        """Masque des annotations (aux positions données) qui touchent les anneaux, à tolerance près."""
+        if not len(positions):
+            return np.zeros(0, dtype=bool)
+        cand_vertices, cand_offsets, groups = self._rings(positions)
+        a, b = geometry.ring_edges(cand_vertices, cand_offsets)
+        c, d = geometry.ring_edges(vertices, offsets)
+        edge_hit = _edge_contacts(a, b, c, d, tolerance)
+        hit = geometry.segment_sums(edge_hit, cand_offsets[groups]) > 0
+        # Sans arête sécante, l'un des deux est entièrement contenu dans l'autre (ou ils sont disjoints)
+        first = cand_offsets[groups[:-1]]
+        hit |= _points_in_rings(np.asarray(cand_vertices[first], dtype=np.float64), vertices, offsets)
+        x, y = vertices[0]
+        hit |= geometry.segment_sums(geometry.rings_contain(cand_vertices, cand_offsets, x, y), groups) > 0
+        return hit
+
+    def intersecting(self, polygon, category=None, tolerance=0.0):
+        """IDs des annotations dont le polygone coupe ou contient `polygon` ((N, 2) ou liste COCO)."""
+        vertices, offsets = geometry.pack_rings([polygon])
+        lo, hi = vertices.min(axis=0) - tolerance, vertices.max(axis=0) + tolerance
+        pos = self._category_mask(self._search(lo[0], lo[1], hi[0], hi[1]), category)
+        return self.ids[pos[self._touching(vertices, offsets, pos, tolerance)]]
+
+    def intersecting_many(self, polygons, category=None, tolerance=0.0):
+        """Filtrage en masse : [IDs des annotations touchées] pour chaque polygone (ex. prédictions)."""
+        return [self.intersecting(polygon, category, tolerance) for polygon in polygons]
+
+    def adjacent(self, category_a, category_b, tolerance=2.0):
+        """Paires (ID a, ID b) d'annotations des deux catégories à moins de `tolerance` pixels."""
+        pairs = []
+        for pos in self._category_mask(np.arange(len(self)), category_a).tolist():
+            x0, y0, x1, y1 = self.boxes[pos]
+            cand = self._category_mask(self._search(x0 - tolerance, y0 - tolerance, x1 + tolerance, y1 + tolerance),
+                                       category_b)
+            cand = cand[cand != pos]
+            if not len(cand):
+                continue
+            vertices, offsets, _ = self._rings(np.array([pos]))
+            for other in cand[self._touching(vertices.astype(np.float64), offsets, cand, tolerance)].tolist():
+                pairs.append((int(self.ids[pos]), int(self.ids[other])))
+        return pairs
+
+
+class SpatialIndex:
+    """Index spatial de toutes les images d'un fichier COCO, stocké dans des tableaux à plat."""
+
+    _ARRAYS = ('image_ids', 'image_ann_offsets', 'ann_ids', 'ann_category_ids', 'boxes', 'vertices',
+               'poly_offsets', 'ann_poly_offsets', 'node_boxes', 'level_offsets', 'image_level_offsets')
+
+    def __init__(self, arrays, categories, capacity=NODE_CAPACITY):
+        self.arrays = arrays
+        self.categories = categories
+        self.capacity = capacity
+        self._names = {c['name']: c['id'] for c in categories}
+        self._pos = {int(i): k for k, i in enumerate(arrays['image_ids'].tolist())}
+        self._images = {}
+
+    @classmethod
+    @timed('spatial_build')
+    def build(cls, coco, capacity=NODE_CAPACITY):
+        by_image = {img['id']: [] for img in coco['images']}
+        for ann in coco['annotations']:
+            if ann['image_id'] in by_image:
+                by_image[ann['image_id']].append(ann)
+        parts = [ImageIndex.from_annotations(anns, capacity) for anns in by_image.values()]
+        return cls(cls._concat(list(by_image), parts), coco['categories'], capacity)
+
+    @staticmethod
+    def _concat(image_ids, parts):
+        def cat(values, dtype, shape=(0,)):
+            return np.concatenate(values) if values else np.zeros(shape, dtype=dtype)
+
+        def offsets(counts):
+            out = np.zeros(len(counts) + 1, dtype=np.int64)
+            np.cumsum(counts, out=out[1:])
+            return out
+
+        levels = [level for p in parts for level in p.levels]
+        vertex_base = offsets([len(p.vertices) for p in parts])
+        ring_base = offsets([len(p.poly_offsets) - 1 for p in parts])
+        return {
+            'image_ids': np.asarray(image_ids, dtype=np.int64),
+            'image_ann_offsets': offsets([len(p) for p in parts]),
+            'ann_ids': cat([p.ids for p in parts], np.int64),
+            'ann_category_ids': cat([p.category_ids for p in parts], np.int64),
+            'boxes': cat([p.boxes for p in parts], np.float64, (0, 4)),
+            'vertices': cat([p.vertices for p in parts], np.float32, (0, 2)),
+            # Offsets globaux : chaque image décalée de ce qui la précède (le 0 initial n'est écrit qu'une fois)
+            'poly_offsets': np.concatenate([[0]] + [p.poly_offsets[1:] + vertex_base[k]
+                                                    for k, p in enumerate(parts)]).astype(np.int64),
+            'ann_poly_offsets': np.concatenate([[0]] + [p.ann_poly_offsets[1:] + ring_base[k]
+                                                        for k, p in enumerate(parts)]).astype(np.int64),
+            'node_boxes': cat(levels, np.float64, (0, 4)),
+            'level_offsets': offsets([len(level) for level in levels]),
+            'image_level_offsets': offsets([len(p.levels) for p in parts]),
+        }
+
+    def __len__(self):
+        return len(self._pos)
+
+    def image_ids(self):
+        return list(self._pos)
+
+    def image(self, image_id):
+        """ImageIndex de l'image (vues sur les tableaux du fichier, construites à la première demande)."""
+        index = self._images.get(image_id)
+        if index is None:
+            k = self._pos[image_id]
+            a = self.arrays
+            a0, a1 = a['image_ann_offsets'][k], a['image_ann_offsets'][k + 1]
+            r0, r1 = a['ann_poly_offsets'][a0], a['ann_poly_offsets'][a1]
+            v0 = a['poly_offsets'][r0]
+            l0, l1 = a['image_level_offsets'][k], a['image_level_offsets'][k + 1]
+            levels = [a['node_boxes'][a['level_offsets'][j]:a['level_offsets'][j + 1]] for j in range(l0, l1)]
+            index = ImageIndex(a['ann_ids'][a0:a1], a['ann_category_ids'][a0:a1], a['boxes'][a0:a1],
+                               a['vertices'][v0:a['poly_offsets'][r1]], a['poly_offsets'][r0:r1 + 1] - v0,
+                               a['ann_poly_offsets'][a0:a1 + 1] - r0, levels, self.capacity, self._names)
+            self._images[image_id] = index
+        return index
+
+    def save(self, path, digest):
+        meta = {'version': SPATIAL_VERSION, 'hash': digest, 'capacity': self.capacity, 'categories': self.categories}
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **self.arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def read(cls, path, digest=None, capacity=None):
+        """Index d'un .spatial.npz, ou None s'il est illisible, d'une autre version ou périmé."""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(str(data['meta']))
+                if (meta.get('version') != SPATIAL_VERSION or (digest is not None and meta.get('hash') != digest)
+                        or (capacity is not None and meta.get('capacity') != capacity)):
+                    return None
+                arrays = {name: data[name] for name in cls._ARRAYS}
+        except (OSError, ValueError, KeyError):
+            print(f"[WARN] Index spatial illisible, reconstruit : {path}")
+            return None
+        return cls(arrays, meta['categories'], meta['capacity'])
+
+
+@timed('spatial_load')
+def load_index(ann_path, path=None, capacity=NODE_CAPACITY):
+    """Index spatial du fichier d'annotations, relu de <annotations>.spatial.npz s'il est à jour."""
+    path = path or default_index_path(ann_path)
+    digest = content_hash(ann_path)
+    if os.path.isfile(path):
+        index = SpatialIndex.read(path, digest, capacity)
+        if index is not None:
+            return index
+    index = SpatialIndex.build(load_coco(ann_path), capacity)
+    index.save(path, digest)
+    return index
+
+
+def _bench(index, n_queries, seed=0):
+    """Temps médian et p99 (ms) de chaque type de requête, sur des requêtes aléatoires."""
+    rng = np.random.default_rng(seed)
+    image_ids = [i for i in index.image_ids() if len(index.image(i))]
+    timings = {'window': [], 'point': [], 'nearest(5)': [], 'intersecting': []}
+    for _ in range(n_queries):
+        img = index.image(image_ids[rng.integers(len(image_ids))])
+        root = img.levels[-1][0]
+        x, y = rng.uniform(root[0], root[2]), rng.uniform(root[1], root[3])
+        side = 0.1 * max(root[2] - root[0], root[3] - root[1])
+        square = [[x, y], [x + side, y], [x + side, y + side], [x, y + side]]
+        for name, query in (('window', lambda: img.window(x, y, x + side, y + side)),
+                            ('point', lambda: img.point(x, y)),
+                            ('nearest(5)', lambda: img.nearest(x, y, 5)),
+                            ('intersecting', lambda: img.intersecting(square))):
+            start = time.perf_counter()
+            query()
+            timings[name].append((time.perf_counter() - start) * 1000)
+    return {name: (float(np.median(t)), float(np.percentile(t, 99))) for name, t in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index spatial des annotations COCO et requêtes")
+    parser.add_argument('annotations', type=str, help='COCO (.json ou .cocobin) produit par svg_to_coco')
+    parser.add_argument('--index', type=str, default=None, help='Fichier d\'index (défaut : <annotations>.spatial.npz)')
+    parser.add_argument('--capacity', type=int, default=NODE_CAPACITY, help='Nombre d\'enfants par nœud du R-tree')
+    parser.add_argument('--image', type=int, default=None, help='Image interrogée (défaut : la plus annotée)')
+    parser.add_argument('--window', type=float, nargs=4, metavar=('X0', 'Y0', 'X1', 'Y1'), help='Requête fenêtre')
+    parser.add_argument('--point', type=float, nargs=2, metavar=('X', 'Y'), help='Annotations contenant le point')
+    parser.add_argument('--nearest', type=float, nargs=3, metavar=('X', 'Y', 'K'), help='k plus proches du point')
+    parser.add_argument('--adjacent', type=str, nargs=2, metavar=('CAT_A', 'CAT_B'),
+                        help='Paires d\'annotations adjacentes (ex. Door Wall)')
+    parser.add_argument('--tolerance', type=float, default=2.0, help='Distance maximale pour --adjacent (pixels)')
+    parser.add_argument('--bench', type=int, default=0, help='Nombre de requêtes aléatoires à chronométrer')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = load_index(args.annotations, args.index, args.capacity)
+    n_anns = len(index.arrays['ann_ids'])
+    print(f"Index spatial : {len(index)} images, {n_anns} annotations, "
+          f"{len(index.arrays['node_boxes'])} nœuds ({time.perf_counter() - start:.2f} s)")
+    if not n_anns:
+        return
+
+    image_id = args.image
+    if image_id is None:
+        image_id = max(index.image_ids(), key=lambda i: len(index.image(i)))
+    img = index.image(image_id)
+    print(f"Image {image_id} : {len(img)} annotations, {len(img.levels)} niveaux")
+    if args.window:
+        print(f"Fenêtre {args.window} : {img.window(*args.window).tolist()}")
+    if args.point:
+        print(f"Point {args.point} : {img.point(*args.point).tolist()}")
+    if args.nearest:
+        ids, dist = img.nearest(args.nearest[0], args.nearest[1], int(args.nearest[2]))
+        print(f"Plus proches de {args.nearest[:2]} : {list(zip(ids.tolist(), np.round(dist, 1).tolist()))}")
+    if args.adjacent:
+        start = time.perf_counter()
+        pairs = img.adjacent(*args.adjacent, tolerance=args.tolerance)
+        print(f"{len(pairs)} paires {args.adjacent[0]}-{args.adjacent[1]} à moins de {args.tolerance:g} px "
+              f"({(time.perf_counter() - start) * 1000:.1f} ms) : {pairs[:10]}{'...' if len(pairs) > 10 else ''}")
+    if args.bench:
+        for name, (median, p99) in _bench(index, args.bench).items():
+            print(f"  {name:14s} médiane {median:.3f} ms, p99 {p99:.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
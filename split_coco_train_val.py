@@ -3,6 +3,62 @@ import json
 import argparse
 import random
 from collections import defaultdict
+import numpy as np
+from coco_store import CocoStore, is_store, dump_coco_stream, write_store
+from image_size import default_cache_path, probe_sizes
+from mapping_index import MappingIndex
+from profiling import RunReport, add_report_args
+
+def bucket_annotations(annotations):
+    """Regroupe les annotations par image_id en un seul passage."""
+    buckets = defaultdict(list)
+    for ann in annotations:
+        buckets[ann['image_id']].append(ann)
+    return buckets
+
+def split_random(images, n_train, rng):
+    order = list(range(len(images)))
+    rng.shuffle(order)
+    return order[:n_train], order[n_train:]
+
+def split_stratified(counts, n_train, rng):
+    """Split glouton équilibrant le nombre d'instances par catégorie.
+
+    counts : matrice (n_images, n_categories). Inspiré de l'« iterative
+    stratification » : les images sont traitées par catégorie la plus rare
+    d'abord, et chacune va dans le split qui manque le plus d'instances de
+    cette catégorie, en respectant le nombre d'images voulu par split.
+    """
+    n_images = counts.shape[0]
+    totals = counts.sum(axis=0).astype(np.float64)
+    frac_train = n_train / n_images if n_images else 0.0
+    targets = np.stack([totals * frac_train, totals * (1.0 - frac_train)])
+    quotas = [n_train, n_images - n_train]
+    got = np.zeros_like(targets)
+    # Catégorie la plus rare de chaque image (-1 si aucune annotation)
+    masked = np.where(counts > 0, totals[None, :], np.inf)
+    rarest = np.where(np.isfinite(masked.min(axis=1)), masked.argmin(axis=1), -1)
+    rarity = masked.min(axis=1)
+    tie_break = np.array([rng.random() for _ in range(n_images)])
+    order = np.lexsort((tie_break, rarity))
+    assignment = [[], []]
+    for i in order.tolist():
+        if len(assignment[0]) >= quotas[0]:
+            split = 1
+        elif len(assignment[1]) >= quotas[1]:
+            split = 0
+        else:
+            k = rarest[i]
+            need = targets[:, k] - got[:, k] if k >= 0 else np.zeros(2)
+            if need[0] != need[1]:
+                split = int(np.argmax(need))
+            else:
+                # Départage par le taux de remplissage des quotas d'images
+                fill = [len(assignment[s]) / max(quotas[s], 1) for s in (0, 1)]
+                split = int(fill[1] < fill[0])
+        assignment[split].append(i)
+        got[split] += counts[i]
+    return assignment[0], assignment[1]
 
 def main():
     parser = argparse.ArgumentParser(description="Split COCO annotations en train/val selon les PNG présents.")
@@ -12,122 +68,134 @@ def main():
     parser.add_argument('--seed', type=int, default=42, help='Seed aléatoire pour le split')
     parser.add_argument('--out_train', type=str, default='annotations_train.json', help='Fichier COCO train')
     parser.add_argument('--out_val', type=str, default='annotations_val.json', help='Fichier COCO val')
+    parser.add_argument('--workers', type=int, default=8, help='Threads pour la lecture des tailles d\'images')
+    parser.add_argument('--stratify', action='store_true',
+                        help='Équilibre le nombre d\'instances par catégorie entre train et val')
+    parser.add_argument('--trust-svg', action='store_true',
+                        help='Prend la taille <width>/<height> des SVG sans lire les images (voie rapide)')
+    parser.add_argument('--image-exts', type=str, nargs='+', default=['.png'],
+                        help='Extensions d\'images acceptées (ex: .png .jpg)')
+    add_report_args(parser)
     args = parser.parse_args()
-
-    random.seed(args.seed)
-
-    # Lister tous les PNG disponibles
-    all_files = sorted(os.listdir(args.img_dir))
-    png_files = [f for f in all_files if f.lower().endswith('.png')]
-    svg_files = [f for f in all_files if f.lower().endswith('.svg')]
-    print(f"{len(png_files)} images PNG et {len(svg_files)} SVG trouvés dans {args.img_dir}.")
-
-    # Charger les annotations COCO
-    with open(args.coco, 'r', encoding='utf-8') as f:
-        coco = json.load(f)
-
-    # Garder uniquement les images pour lesquelles un PNG existe (selon la règle alphabétique)
-    kept_images = []
-    missing_png = []
-    mapping_log = []
-
-    # Mapping : chaque SVG <prefixe>_gt_*.svg doit être associé à <prefixe>.png
-    for img in coco['images']:
-        svg_name = img['file_name']
-        svg_base = os.path.splitext(svg_name)[0]
-        # Extraire le préfixe avant _gt_
-        if '_gt_' in svg_base:
-            prefix = svg_base.split('_gt_')[0]
-            png_file = f"{prefix}.png"
-            if png_file in png_files:
+    report = RunReport('split_coco_train_val', args.report, profile=args.profile)
+
+    rng = random.Random(args.seed)
+
+    # Index SVG -> image (persistant, mis à jour seulement si le dossier a changé)
+    with report.stage('index_mapping'):
+        index = MappingIndex(args.img_dir)
+    print(f"{index.summary()} dans {args.img_dir}.")
+    exts = tuple(e.lower() if e.startswith('.') else '.' + e.lower() for e in args.image_exts)
+
+    # Charger les annotations COCO (un store .cocobin n'est lu qu'à la demande)
+    with report.stage('load_coco'):
+        if is_store(args.coco):
+            source = CocoStore(args.coco)
+            images = [dict(img) for img in source.images]
+            categories = source.categories
+            info, licenses = source.info, source.licenses
+            buckets = None
+        else:
+            with open(args.coco, 'r', encoding='utf-8') as f:
+                coco = json.load(f)
+            source = None
+            images = coco['images']
+            categories = coco['categories']
+            info, licenses = coco.get('info'), coco.get('licenses')
+            buckets = bucket_annotations(coco['annotations'])
+            del coco
+
+    # Garder uniquement les images pour lesquelles un PNG existe (règles de mapping_index.py)
+    with report.stage('map_png'):
+        kept_images = []
+        kept_svg_names = []
+        missing_png = []
+        for img in images:
+            svg_name = img['file_name']
+            png_file = index.image_for(os.path.basename(svg_name), exts)
+            if png_file is not None:
                 img['file_name'] = png_file
                 kept_images.append(img)
-                mapping_log.append(f"[OK] {svg_name} associé à {png_file}")
+                kept_svg_names.append(svg_name)
             else:
                 missing_png.append(svg_name)
-                mapping_log.append(f"[WARN] Aucun PNG trouvé pour {svg_name} (attendu : {png_file})")
-        else:
-            missing_png.append(svg_name)
-            mapping_log.append(f"[WARN] Format inattendu pour {svg_name}")
-
-    for log in mapping_log:
-        print(log)
+                print(f"[WARN] Aucune image {'/'.join(exts)} trouvée pour {svg_name}")
+        for svg_name, image, reason in index.ambiguous():
+            print(f"[WARN] Association ambiguë {svg_name} -> {image} ({reason})")
 
-    print(f"{len(kept_images)} images gardées (avec PNG associé par préfixe).")
+    print(f"{len(kept_images)} images gardées (avec image associée).")
     if missing_png:
         print(f"{len(missing_png)} images ignorées (PNG manquant) : {missing_png[:10]}{'...' if len(missing_png)>10 else ''}")
 
-    # Garder uniquement les annotations liées aux images conservées
-    kept_image_ids = set(img['id'] for img in kept_images)
-    kept_annotations = [ann for ann in coco['annotations'] if ann['image_id'] in kept_image_ids]
-
-    # Ajouter width/height à chaque image
-    from PIL import Image
-    for img in kept_images:
-        img_path = os.path.join(args.img_dir, img['file_name'])
-        try:
-            with Image.open(img_path) as im:
-                img['width'], img['height'] = im.size
-        except Exception as e:
-            print(f"[WARN] Impossible d'obtenir width/height pour {img['file_name']}: {e}")
-
+    # Ajouter width/height à chaque image (en-têtes seulement, en parallèle, avec cache)
+    # La taille déclarée dans le SVG source sert de contrôle croisé (ou remplace la lecture avec --trust-svg)
+    img_paths = [os.path.join(args.img_dir, img['file_name']) for img in kept_images]
+    svg_hints = {
+        path: os.path.join(args.img_dir, svg_name)
+        for path, svg_name in zip(img_paths, kept_svg_names)
+        if os.path.isfile(os.path.join(args.img_dir, svg_name))
+    }
+    with report.stage('probe_sizes', images=len(img_paths)):
+        sizes, errors, _ = probe_sizes(img_paths, workers=args.workers,
+                                       cache_path=default_cache_path(args.img_dir), svg_hints=svg_hints,
+                                       trust_svg=args.trust_svg)
+    for img, img_path in zip(kept_images, img_paths):
+        if img_path in sizes:
+            img['width'], img['height'] = sizes[img_path]
+        else:
+            print(f"[WARN] Impossible d'obtenir width/height pour {img['file_name']}: {errors[img_path]}")
+
+    # Nombre d'instances par (image, catégorie), pour les statistiques et --stratify
+    cat_index = {cat['id']: k for k, cat in enumerate(categories)}
+    counts = np.zeros((len(kept_images), len(categories)), dtype=np.int64)
+    for i, img in enumerate(kept_images):
+        if source is not None:
+            cat_ids = source.ann_category_ids[source.annotation_indices([img['id']])].tolist()
+        else:
+            cat_ids = [ann['category_id'] for ann in buckets.get(img['id'], ())]
+        for cat_id in cat_ids:
+            k = cat_index.get(cat_id)
+            if k is not None:
+                counts[i, k] += 1
     print(f"{len(kept_images)} images gardées (avec PNG correspondant).")
-    print(f"{len(kept_annotations)} annotations gardées.")
-
-    # Split train/val
-    random.shuffle(kept_images)
-    n_train = int(len(kept_images) * args.train_pct)
-    train_images = kept_images[:n_train]
-    val_images = kept_images[n_train:]
-    train_image_ids = set(img['id'] for img in train_images)
-    val_image_ids = set(img['id'] for img in val_images)
-    train_annotations = [ann for ann in kept_annotations if ann['image_id'] in train_image_ids]
-    val_annotations = [ann for ann in kept_annotations if ann['image_id'] in val_image_ids]
-
-    def make_coco(images, annotations):
-        return {
-            'images': images,
-            'annotations': annotations,
-            'categories': coco['categories'],
-            'info': coco.get('info', {}),
-            'licenses': coco.get('licenses', [])
-        }
-
-    with open(args.out_train, 'w', encoding='utf-8') as f:
-        json.dump(make_coco(train_images, train_annotations), f, ensure_ascii=False, indent=2)
-        print(f"Fichier train écrit : {args.out_train} ({len(train_images)} images, {len(train_annotations)} annotations)")
-    with open(args.out_val, 'w', encoding='utf-8') as f:
-        json.dump(make_coco(val_images, val_annotations), f, ensure_ascii=False, indent=2)
-        print(f"Fichier val écrit : {args.out_val} ({len(val_images)} images, {len(val_annotations)} annotations)")
-
-    kept_image_ids = set(img['id'] for img in kept_images)
-    # Garder uniquement les annotations dont l'image existe
-    kept_annotations = [ann for ann in coco['annotations'] if ann['image_id'] in kept_image_ids]
-    print(f"{len(kept_annotations)} annotations gardées.")
-
-    # Split train/val
-    random.shuffle(kept_images)
-    n_train = int(len(kept_images) * args.train_pct)
-    train_images = kept_images[:n_train]
-    val_images = kept_images[n_train:]
-    train_ids = set(img['id'] for img in train_images)
-    val_ids = set(img['id'] for img in val_images)
-    train_annotations = [ann for ann in kept_annotations if ann['image_id'] in train_ids]
-    val_annotations = [ann for ann in kept_annotations if ann['image_id'] in val_ids]
-
-    # Sauvegarde
-    for split, imgs, anns, out in [
-        ('train', train_images, train_annotations, args.out_train),
-        ('val', val_images, val_annotations, args.out_val)
-    ]:
-        coco_out = {
-            'images': imgs,
-            'annotations': anns,
-            'categories': coco['categories']
-        }
-        with open(out, 'w', encoding='utf-8') as f:
-            json.dump(coco_out, f, indent=2)
-        print(f"Fichier {split} écrit : {out} ({len(imgs)} images, {len(anns)} annotations)")
+    print(f"{int(counts.sum())} annotations gardées.")
+
+    # Split train/val (un seul mélange)
+    with report.stage('split', stratify=args.stratify):
+        n_train = int(len(kept_images) * args.train_pct)
+        if args.stratify:
+            train_idx, val_idx = split_stratified(counts, n_train, rng)
+        else:
+            train_idx, val_idx = split_random(kept_images, n_train, rng)
+
+    print("Instances par catégorie (train / val) :")
+    train_counts = counts[train_idx].sum(axis=0)
+    val_counts = counts[val_idx].sum(axis=0)
+    for k, cat in enumerate(categories):
+        print(f"  {cat['name']}: {int(train_counts[k])} / {int(val_counts[k])}")
+
+    # Sauvegarde (JSON écrit en flux, annotation par annotation)
+    with report.stage('write'):
+        for split, idx, out in [
+            ('train', train_idx, args.out_train),
+            ('val', val_idx, args.out_val)
+        ]:
+            imgs = [kept_images[i] for i in idx]
+            if source is not None:
+                ann_indices = source.annotation_indices([img['id'] for img in imgs])
+                if is_store(out):
+                    source.save_subset(out, imgs)
+                else:
+                    dump_coco_stream(out, imgs, source.iter_annotations(ann_indices), categories, info, licenses)
+            else:
+                anns = (ann for img in imgs for ann in buckets.get(img['id'], ()))
+                if is_store(out):
+                    write_store({'images': imgs, 'annotations': list(anns), 'categories': categories,
+                                 'info': info, 'licenses': licenses}, out)
+                else:
+                    dump_coco_stream(out, imgs, anns, categories, info, licenses)
+            print(f"Fichier {split} écrit : {out} ({len(imgs)} images, {int(counts[idx].sum())} annotations)")
+    report.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,121 @@
+import re
+import xml.etree.ElementTree as ET
+import numpy as np
+
+# Version du format produit par le parseur (utilisée pour invalider les caches)
+PARSER_VERSION = 1
+
+_PAIR_RE = re.compile(r"[\d.]+[ ,][\d.]+")
+_SEP_RE = re.compile(r"[ ,]")
+
+
+_SVG_NS = '{http://www.w3.org/2000/svg}'
+# Tags reconnus (avec ou sans namespace SVG) -> type d'événement
+_TAGS = {}
+for _name in ('polygon', 'width', 'height', 'class'):
+    _TAGS[_name] = _name
+    _TAGS[_SVG_NS + _name] = _name
+
+
+def _parse_points_fallback(points_str):
+    """Extraction tolérante (paire par paire) pour les attributs points mal formés."""
+    points = []
+    for pair in _PAIR_RE.findall(points_str):
+        nums = _SEP_RE.split(pair.strip())
+        if len(nums) == 2:
+            try:
+                points.append((float(nums[0]), float(nums[1])))
+            except ValueError:
+                continue
+    return np.asarray(points, dtype=np.float32).reshape(-1, 2)
+
+
+def parse_points(points_str):
+    """Décode un attribut SVG points ("x1,y1 x2,y2 ...") en tableau float32 (N, 2)."""
+    try:
+        flat = np.array(points_str.replace(',', ' ').split(), dtype=np.float32)
+    except ValueError:
+        return _parse_points_fallback(points_str)
+    if flat.size % 2:
+        flat = flat[:-1]
+    return flat.reshape(-1, 2)
+
+
+def iter_svg(svg_path, with_fill=False, taxonomy=None):
+    """Parcourt un SVG en streaming (iterparse).
+
+    Produit des tuples ('width'|'height', float), ('class', str) et
+    ('polygon', dict) au fil de la lecture ; chaque élément est vidé
+    dès qu'il a été traité. Avec une taxonomie (voir taxonomy.py), la
+    classe des polygones est remplacée par leur catégorie, et les
+    polygones ignorés produisent ('ignored', étiquette) sans que leurs
+    points soient décodés.
+    """
+    for _, elem in ET.iterparse(svg_path):
+        kind = _TAGS.get(elem.tag)
+        if kind is None:
+            continue
+        if kind == 'polygon':
+            attrib = elem.attrib
+            cls = attrib.get('class', 'Unknown')
+            category = cls if taxonomy is None else taxonomy.category(cls)
+            if category is None:
+                yield 'ignored', cls
+                elem.clear()
+                continue
+            poly = {
+                'class': category,
+                'points': parse_points(attrib.get('points', '')),
+            }
+            if with_fill:
+                poly['fill'] = attrib.get('fill')
+            yield kind, poly
+        elif kind == 'class':
+            if elem.text:
+                yield kind, elem.text.strip()
+        else:
+            try:
+                yield kind, float(elem.text)
+            except (TypeError, ValueError):
+                pass
+        elem.clear()
+
+
+def parse_svg_file(svg_path, with_fill=False, taxonomy=None):
+    """Parse un SVG d'annotations.
+
+    Retourne un dict {'width', 'height', 'classes', 'polygons', 'ignored'}
+    où chaque polygone est un dict {'class', 'points'} (+ 'fill' si
+    demandé) et 'points' un tableau NumPy float32 de forme (N, 2) ;
+    'ignored' compte les polygones écartés par la taxonomie, par étiquette.
+    """
+    result = {'width': None, 'height': None, 'classes': [], 'polygons': [], 'ignored': {}}
+    for kind, value in iter_svg(svg_path, with_fill=with_fill, taxonomy=taxonomy):
+        if kind == 'polygon':
+            result['polygons'].append(value)
+        elif kind == 'class':
+            result['classes'].append(value)
+        elif kind == 'ignored':
+            result['ignored'][value] = result['ignored'].get(value, 0) + 1
+        else:
+            result[kind] = value
+    return result
+
+
+def read_svg_size(svg_path):
+    """Lit uniquement l'en-tête <width>/<height> d'un SVG (arrêt au premier polygone).
+
+    Retourne (width, height) ou None si l'en-tête est absent ou illisible.
+    """
+    size = {}
+    try:
+        for kind, value in iter_svg(svg_path):
+            if kind in ('width', 'height'):
+                size[kind] = value
+            if len(size) == 2 or kind == 'polygon':
+                break
+    except (OSError, ET.ParseError):
+        return None
+    if len(size) != 2:
+        return None
+    return int(size['width']), int(size['height'])
@@ -1,123 +1,176 @@
 import os
 import sys
-import json
 import argparse
-import xml.etree.ElementTree as ET
-import re
 from collections import defaultdict
+from functools import partial
 from tqdm import tqdm
+import geometry
+from svg_parser import parse_svg_file, PARSER_VERSION
+from coco_store import save_coco
+from profiling import RunReport, add_report_args, timed
+from conversion_cache import ConversionCache, default_cache_path, file_hash
+from taxonomy import load_taxonomy
+
+# Version de convert_svg (à incrémenter si le format des résultats change)
+CONVERT_VERSION = 2
 
 # --- Utilitaires ---
 def find_svg_files(directory):
-    """Trouve tous les fichiers SVG dans un dossier (récursif)."""
+    """Trouve tous les fichiers SVG dans un dossier (récursif), triés par chemin."""
     svg_files = []
     for root, _, files in os.walk(directory):
         for file in files:
             if file.lower().endswith('.svg'):
                 svg_files.append(os.path.join(root, file))
-    return svg_files
+    # Tri : l'ordre (donc les IDs COCO) ne dépend pas du système de fichiers
+    return sorted(svg_files)
 
-def parse_svg(svg_path):
-    """Extrait les polygones et classes d'un fichier SVG."""
+@timed()
+def parse_svg(svg_path, taxonomy=None):
+    """Extrait les classes, les polygones et les polygones ignorés (par étiquette) d'un SVG (voir svg_parser)."""
     try:
-        tree = ET.parse(svg_path)
-        root = tree.getroot()
-        ns = {'svg': 'http://www.w3.org/2000/svg'}
-        # Extraire toutes les classes (sans namespace)
-        classes = [c.text for c in root.findall('.//class')]
-        # Extraire les polygones (avec namespace SVG)
-        polygons = []
-        for poly in root.findall('.//svg:polygon', ns):
-            poly_class = poly.attrib.get('class', 'Unknown')
-            points_str = poly.attrib.get('points', '')
-            # Extraction robuste des points
-            points = []
-            for pair in re.findall(r"[\d.]+[ ,][\d.]+", points_str):
-                nums = re.split(r"[ ,]", pair.strip())
-                if len(nums) == 2:
-                    try:
-                        points.append((float(nums[0]), float(nums[1])))
-                    except ValueError:
-                        continue
-            polygons.append({
-                'class': poly_class,
-                'points': points
-            })
-        return classes, polygons
+        parsed = parse_svg_file(svg_path, taxonomy=taxonomy)
+        return parsed['classes'], parsed['polygons'], parsed['ignored']
     except Exception as e:
         print(f"[ERREUR] Fichier {svg_path}: {e}")
-        return [], []
+        return [], [], {}
 
-def polygon_to_bbox(points):
-    xs = [p[0] for p in points]
-    ys = [p[1] for p in points]
-    x_min, x_max = min(xs), max(xs)
-    y_min, y_max = min(ys), max(ys)
-    return [x_min, y_min, x_max - x_min, y_max - y_min]
+def convert_svg(svg_path, simplify=None, taxonomy=None):
+    """Convertit un SVG en résultat intermédiaire, indépendant des IDs COCO.
 
-def polygon_to_coco_segmentation(points):
-    # COCO attend une liste de listes de coordonnées [x1, y1, x2, y2, ...]
-    return [sum(points, ())]
+    Exécutable dans un processus séparé : le dict retourné est picklable et
+    les IDs ne sont attribués qu'à la fusion (voir build_coco). Tous les
+    polygones du fichier passent ensemble par geometry : simplification
+    Douglas–Peucker optionnelle (tolérance en pixels), orientation commune,
+    aire réelle et boîte englobante. Avec une taxonomie, les classes sont
+    déjà les catégories d'entraînement et les polygones ignorés ne sont
+    pas décodés.
+    """
+    # Les <class> de l'en-tête listent tout le vocabulaire : seules les
+    # classes effectivement présentes sur les polygones deviennent des catégories
+    _, polygons, ignored = parse_svg(svg_path, taxonomy)
+    valid = [poly for poly in polygons if len(poly['points']) >= 3]
+    vertices, offsets = geometry.pack_rings([poly['points'] for poly in valid])
+    if simplify is not None:
+        vertices, offsets = geometry.simplify(vertices, offsets, simplify)
+    vertices = geometry.orient(vertices, offsets)
+    areas = geometry.ring_areas(vertices, offsets).tolist()
+    bboxes = geometry.ring_bboxes(vertices, offsets).tolist()
+    annotations = []
+    for i, poly in enumerate(valid):
+        annotations.append({
+            'class_name': poly['class'],
+            # COCO attend une liste de listes de coordonnées [x1, y1, x2, y2, ...]
+            'segmentation': [vertices[offsets[i]:offsets[i + 1]].ravel().tolist()],
+            'bbox': bboxes[i],
+            'area': areas[i],
+        })
+    skipped = len(polygons) - len(valid)
+    return {
+        'file_name': os.path.basename(svg_path),
+        'annotations': annotations,
+        'skipped': skipped,
+        'ignored': ignored
+    }
 
-# --- Main conversion ---
-def main():
-    parser = argparse.ArgumentParser(description="Convertit des SVG en annotations COCO (Detectron2, segmentation)")
-    parser.add_argument('svg_dir', type=str, help='Dossier contenant les SVG à convertir')
-    parser.add_argument('--output', type=str, default='annotations.json', help='Fichier de sortie COCO')
-    args = parser.parse_args()
+def iter_converted(svg_files, workers=1, simplify=None, taxonomy=None):
+    """Convertit les SVG (en parallèle si workers > 1) en conservant l'ordre d'entrée."""
+    convert = partial(convert_svg, simplify=simplify, taxonomy=taxonomy)
+    if workers <= 1:
+        for svg_path in svg_files:
+            yield convert(svg_path)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    chunksize = max(1, len(svg_files) // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map() restitue les résultats dans l'ordre des fichiers : IDs déterministes
+        yield from executor.map(convert, svg_files, chunksize=chunksize)
 
-    svg_files = find_svg_files(args.svg_dir)
-    if not svg_files:
-        print(f"Aucun fichier SVG trouvé dans {args.svg_dir}")
-        sys.exit(1)
-    print(f"{len(svg_files)} fichiers SVG trouvés.")
+def load_or_convert(svg_files, cache_path, workers=1, simplify=None, taxonomy=None):
+    """Comme iter_converted, mais ne reparse que les SVG absents du cache.
 
-    # Extraction des classes globales et polygones
-    all_classes = set()
-    all_polygons = []
+    Retourne la liste des résultats dans l'ordre de svg_files ; le cache est
+    mis à jour et purgé des entrées obsolètes.
+    """
+    # La tolérance de simplification et la taxonomie font partie de la version : les changer invalide le cache
+    vocabulary = taxonomy.fingerprint() if taxonomy is not None else 'raw'
+    cache = ConversionCache(cache_path, version=f"{PARSER_VERSION}.{CONVERT_VERSION}.{simplify}.{vocabulary}")
+    try:
+        hashes = [file_hash(p) for p in svg_files]
+        cached = cache.get_many(hashes)
+        todo = [(p, h) for p, h in zip(svg_files, hashes) if h not in cached]
+        print(f"Cache {cache_path} : {len(svg_files) - len(todo)} SVG en cache, {len(todo)} à parser.")
+        fresh = list(tqdm(iter_converted([p for p, _ in todo], workers, simplify, taxonomy), total=len(todo),
+                          desc="Traitement SVG"))
+        cache.put_many((h, record) for (_, h), record in zip(todo, fresh))
+        for (_, h), record in zip(todo, fresh):
+            cached[h] = record
+        evicted = cache.evict(hashes)
+        if evicted:
+            print(f"{evicted} entrées obsolètes supprimées du cache.")
+    finally:
+        cache.close()
+    return [
+        dict(cached[h], file_name=os.path.basename(p))
+        for p, h in zip(svg_files, hashes)
+    ]
+
+def build_coco(records, taxonomy=None):
+    """Fusionne les résultats par fichier (dans l'ordre) en un dict COCO.
+
+    Les image_id / annotation_id sont attribués séquentiellement et les
+    category_id selon la table de la taxonomie (à défaut, l'ordre
+    alphabétique des classes) : la sortie ne dépend que de l'ordre des
+    fichiers, pas du nombre de workers.
+    """
     image_id = 1
     annotation_id = 1
     images = []
     annotations = []
     class_count = defaultdict(int)
-    class_name_to_id = {}
+    ignored_count = defaultdict(int)
 
-    for svg_path in tqdm(svg_files, desc="Traitement SVG"):
-        filename = os.path.basename(svg_path)
-        classes, polygons = parse_svg(svg_path)
-        all_classes.update(classes)
+    for record in records:
+        filename = record['file_name']
         # Image info (taille non extraite ici, peut être ajoutée si connue)
         images.append({
             'id': image_id,
             'file_name': filename
         })
-        for poly in polygons:
-            if len(poly['points']) < 3:
-                print(f"[WARN] Polygone ignoré (moins de 3 points) dans {filename}")
-                continue
-            class_name = poly['class']
-            class_count[class_name] += 1
-            all_classes.add(class_name)
+        for _ in range(record['skipped']):
+            print(f"[WARN] Polygone ignoré (moins de 3 points) dans {filename}")
+        for label, count in record.get('ignored', {}).items():
+            ignored_count[label] += count
+        for ann in record['annotations']:
+            class_count[ann['class_name']] += 1
             annotations.append({
                 'id': annotation_id,
                 'image_id': image_id,
                 'category_id': None,  # Rempli après
-                'class_name': class_name,  # Stock temporaire
-                'segmentation': polygon_to_coco_segmentation(poly['points']),
-                'bbox': polygon_to_bbox(poly['points']),
+                'class_name': ann['class_name'],  # Stock temporaire
+                'segmentation': ann['segmentation'],
+                'bbox': ann['bbox'],
+                'area': ann['area'],
                 'iscrowd': 0
             })
             annotation_id += 1
         image_id += 1
 
-    # Générer la liste exhaustive des classes
-    all_classes = sorted(list(all_classes))
-    for idx, cname in enumerate(all_classes):
-        class_name_to_id[cname] = idx + 1
-    print(f"{len(all_classes)} classes trouvées : {all_classes}")
+    # Table des catégories : celle de la taxonomie (stable), sinon les classes présentes
+    if taxonomy is not None:
+        categories = taxonomy.category_table(class_count)
+        for cname in class_count:
+            if not taxonomy.is_declared(cname):
+                print(f"[WARN] Étiquette '{cname}' couverte par aucune règle : catégorie ajoutée en fin de table")
+    else:
+        categories = [{'id': idx + 1, 'name': cname} for idx, cname in enumerate(sorted(class_count))]
+    class_name_to_id = {cat['name']: cat['id'] for cat in categories}
+    print(f"{len(categories)} catégories : {[cat['name'] for cat in categories]}")
     print("Nombre d'instances par classe :")
     for cname, count in class_count.items():
         print(f"  {cname}: {count}")
+    if ignored_count:
+        print(f"{sum(ignored_count.values())} polygones ignorés par la taxonomie : {dict(ignored_count)}")
 
     # Remplir les category_id correctement selon la vraie classe
     for ann in annotations:
@@ -125,19 +178,51 @@ def main():
         ann['category_id'] = class_name_to_id.get(cname, 0)
         del ann['class_name']  # Nettoyage
 
-    # Générer la liste des catégories COCO
-    categories = [
-        {'id': class_name_to_id[cname], 'name': cname}
-        for cname in all_classes
-    ]
-
-    coco = {
+    return {
         'images': images,
         'annotations': annotations,
         'categories': categories
     }
-    with open(args.output, 'w', encoding='utf-8') as f:
-        json.dump(coco, f, indent=2)
+
+# --- Main conversion ---
+def main():
+    parser = argparse.ArgumentParser(description="Convertit des SVG en annotations COCO (Detectron2, segmentation)")
+    parser.add_argument('svg_dir', type=str, help='Dossier contenant les SVG à convertir')
+    parser.add_argument('--output', type=str, default='annotations.json', help='Fichier de sortie COCO (.json, ou .cocobin pour le format binaire)')
+    parser.add_argument('--workers', type=int, default=1, help='Nombre de processus pour le parsing (1 = séquentiel)')
+    parser.add_argument('--cache', type=str, default=None, help='Cache SQLite des conversions (défaut : à côté de --output)')
+    parser.add_argument('--no-cache', action='store_true', help='Reparse tous les SVG sans utiliser de cache')
+    parser.add_argument('--simplify', type=float, default=None,
+                        help='Simplification Douglas–Peucker (tolérance en pixels ; 0 = retire seulement les sommets alignés)')
+    parser.add_argument('--taxonomy', type=str, default=None,
+                        help='Taxonomie JSON étiquettes -> catégories (défaut : taxonomie intégrée, voir taxonomy.py)')
+    add_report_args(parser)
+    args = parser.parse_args()
+    if args.profile and args.workers > 1:
+        print("[WARN] --profile : le parsing fait dans les processus workers n'est pas profilé (utiliser --workers 1)")
+    report = RunReport('svg_to_coco', args.report, profile=args.profile)
+    taxonomy = load_taxonomy(args.taxonomy)
+
+    with report.stage('find_svg') as stage:
+        svg_files = find_svg_files(args.svg_dir)
+        stage['files'] = len(svg_files)
+    if not svg_files:
+        print(f"Aucun fichier SVG trouvé dans {args.svg_dir}")
+        sys.exit(1)
+    print(f"{len(svg_files)} fichiers SVG trouvés.")
+
+    with report.stage('convert', workers=args.workers, cached=not args.no_cache):
+        if args.no_cache:
+            records = list(tqdm(iter_converted(svg_files, args.workers, args.simplify, taxonomy),
+                                total=len(svg_files), desc="Traitement SVG"))
+        else:
+            records = load_or_convert(svg_files, args.cache or default_cache_path(args.output), args.workers,
+                                      args.simplify, taxonomy)
+    with report.stage('build_coco') as stage:
+        coco = build_coco(records, taxonomy)
+        stage['annotations'] = len(coco['annotations'])
+    with report.stage('save'):
+        save_coco(coco, args.output, indent=2)
     print(f"Annotations COCO sauvegardées dans {args.output}")
 
     # Affichage du dénombrement des catégories dans le COCO généré
@@ -146,6 +231,7 @@ def main():
     print("\nDénombrement des catégories dans le COCO généré :")
     for cat in coco['categories']:
         print(f"  {cat['name']} (id={cat['id']}) : {counts.get(cat['id'], 0)}")
+    report.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,221 @@
+"""Génération de plans synthétiques (SVG + PNG) au format de dataset/*_gt_*.svg.
+
+Chaque plan reprend le schéma des annotations réelles : en-têtes <width>,
+<height>, <class>, puis des <polygon class=... points=...> (pièces
+rectangulaires ou en L, murs droits et en biais, portes, fenêtres,
+séparations, parkings, textes), et une image PNG en niveaux de gris de la
+même taille. Le plan i ne dépend que de (seed, i) : un corpus est
+reproductible quel que soit le nombre de workers. Un manifeste
+(corpus.json) évite de régénérer un corpus identique.
+"""
+import argparse
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+
+GENERATOR_VERSION = 1
+MANIFEST_NAME = 'corpus.json'
+
+# Vocabulaire des en-têtes <class> (les fichiers réels en listent beaucoup plus qu'ils n'en utilisent)
+HEADER_CLASSES = [
+    'Bidet-1', 'Door', 'Door-1', 'Oven-1', 'Parking', 'Roof', 'Room', 'Separation', 'Sink-1',
+    'Sofa-1', 'Stairs-1', 'Table-1', 'Text', 'Tub-1', 'TV-1', 'Wall', 'Wall-1', 'Window',
+]
+
+# Niveaux de gris du rendu PNG par classe
+_FILL = {'Room': 235, 'Parking': 215, 'Separation': 120, 'Wall': 20, 'Window': 160, 'Door': 90, 'Text': 60}
+_DRAW_ORDER = ('Room', 'Parking', 'Separation', 'Wall', 'Window', 'Door', 'Text')
+
+
+def _split_rooms(rng, rect, n_rooms, min_side):
+    """Partition récursive d'un rectangle en pièces rectangulaires."""
+    rooms = [rect]
+    while len(rooms) < n_rooms:
+        rooms.sort(key=lambda r: (r[2] - r[0]) * (r[3] - r[1]))
+        x0, y0, x1, y1 = rooms.pop()
+        vertical = (x1 - x0) >= (y1 - y0)
+        lo, hi = (x0, x1) if vertical else (y0, y1)
+        if hi - lo < 2 * min_side:
+            rooms.append((x0, y0, x1, y1))
+            break
+        cut = rng.randint(lo + min_side, hi - min_side)
+        if vertical:
+            rooms += [(x0, y0, cut, y1), (cut, y0, x1, y1)]
+        else:
+            rooms += [(x0, y0, x1, cut), (x0, cut, x1, y1)]
+    return rooms
+
+
+def _room_polygon(rng, room):
+    """Rectangle, ou pièce en L (un coin retiré) une fois sur cinq."""
+    x0, y0, x1, y1 = room
+    if rng.random() < 0.2 and x1 - x0 > 60 and y1 - y0 > 60:
+        cx = rng.randint(x0 + (x1 - x0) // 3, x1 - (x1 - x0) // 4)
+        cy = rng.randint(y0 + (y1 - y0) // 3, y1 - (y1 - y0) // 4)
+        return [(x0, y0), (x1, y0), (x1, cy), (cx, cy), (cx, y1), (x0, y1)]
+    return [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+
+
+def _segment_quad(ax, ay, bx, by, thickness):
+    """Quadrilatère d'épaisseur donnée autour du segment (a, b)."""
+    dx, dy = bx - ax, by - ay
+    length = max((dx * dx + dy * dy) ** 0.5, 1e-9)
+    nx, ny = -dy / length * thickness / 2, dx / length * thickness / 2
+    return [(ax + nx, ay + ny), (bx + nx, by + ny), (bx - nx, by - ny), (ax - nx, ay - ny)]
+
+
+def _edges(poly):
+    return [(poly[k], poly[(k + 1) % len(poly)]) for k in range(len(poly))]
+
+
+def generate_plan(seed, index, density=80, size_range=(1000, 2000)):
+    """Un plan synthétique : (width, height, [(classe, [(x, y), ...]), ...])."""
+    rng = random.Random(seed * 1_000_003 + index)
+    # Densité variable d'un plan à l'autre autour de la moyenne demandée
+    density = density * rng.uniform(0.6, 1.4)
+    width = rng.randint(*size_range)
+    height = rng.randint(int(size_range[0] * 0.7), size_range[1])
+    margin = max(20, min(width, height) // 20)
+    outer = (margin, margin, width - margin, height - margin)
+    n_rooms = max(1, round(density * 0.12))
+    min_side = max(20, min(width, height) // (2 * n_rooms ** 0.5 + 2))
+    rooms = _split_rooms(rng, outer, n_rooms, int(min_side))
+    thickness = rng.randint(6, 14)
+
+    polygons = []
+    room_polys = [_room_polygon(rng, r) for r in rooms]
+    polygons += [('Room', p) for p in room_polys]
+    walls = []
+    for poly in room_polys:
+        for (ax, ay), (bx, by) in _edges(poly):
+            walls.append(_segment_quad(ax, ay, bx, by, thickness))
+    # Murs supplémentaires, dont des murs en biais
+    while len(walls) < density * 0.6:
+        x, y = rng.randint(outer[0], outer[2]), rng.randint(outer[1], outer[3])
+        length = rng.randint(40, max(41, min(width, height) // 4))
+        if rng.random() < 0.3:
+            dx = dy = length / 2 ** 0.5
+        elif rng.random() < 0.5:
+            dx, dy = length, 0
+        else:
+            dx, dy = 0, length
+        walls.append(_segment_quad(x, y, min(x + dx, outer[2]), min(y + dy, outer[3]), thickness))
+    polygons += [('Wall', w) for w in walls]
+
+    outer_edges = _edges([(outer[0], outer[1]), (outer[2], outer[1]), (outer[2], outer[3]), (outer[0], outer[3])])
+    all_edges = [e for poly in room_polys for e in _edges(poly)]
+    for cls, count, edges, size in (('Window', 0.12, outer_edges, (30, 90)), ('Door', 0.12, all_edges, (25, 45))):
+        for _ in range(max(1, round(density * count))):
+            (ax, ay), (bx, by) = rng.choice(edges)
+            t = rng.random() * 0.8 + 0.1
+            px, py = ax + (bx - ax) * t, ay + (by - ay) * t
+            length = rng.randint(*size)
+            horizontal = abs(bx - ax) >= abs(by - ay)
+            qx, qy = (px + length, py) if horizontal else (px, py + length)
+            polygons.append((cls, _segment_quad(px, py, qx, qy, thickness + 4)))
+    for _ in range(round(density * 0.03)):
+        x0, y0, x1, y1 = rng.choice(rooms)
+        x = rng.randint(x0, x1)
+        polygons.append(('Separation', _segment_quad(x, y0, x, y1, 3)))
+    if rng.random() < 0.05:
+        x0, y0, x1, y1 = rng.choice(rooms)
+        polygons.append(('Parking', [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]))
+    if rng.random() < 0.01:
+        x, y = rng.randint(outer[0], outer[2] - 60), rng.randint(outer[1], outer[3] - 20)
+        polygons.append(('Text', [(x, y), (x + 60, y), (x + 60, y + 20), (x, y + 20)]))
+    # Coordonnées entières, comme dans les fichiers réels
+    polygons = [(cls, [(int(round(x)), int(round(y))) for x, y in pts]) for cls, pts in polygons]
+    return width, height, polygons
+
+
+def plan_to_svg(width, height, polygons):
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<svg xmlns="http://www.w3.org/2000/svg" version="1.1">',
+        f'<width>{width}</width>',
+        f'<height>{height}</height>',
+        f'<nclasslabel>{len(HEADER_CLASSES)}</nclasslabel>',
+        f'<nclassappear>{len({cls for cls, _ in polygons})}</nclassappear>',
+    ]
+    lines += [f'<class>{cls}</class>' for cls in HEADER_CLASSES]
+    for k, (cls, pts) in enumerate(polygons):
+        points = ''.join(f'{x},{y} ' for x, y in pts)
+        lines.append(f'<polygon class="{cls}" fill="#AFD8F8" id="{k}" transcription="" points="{points}" />')
+    lines.append('</svg>')
+    return '\n'.join(lines) + '\n'
+
+
+def plan_to_png(width, height, polygons, path):
+    from PIL import Image, ImageDraw
+
+    image = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    for cls in _DRAW_ORDER:
+        for poly_cls, pts in polygons:
+            if poly_cls == cls:
+                draw.polygon(pts, fill=_FILL[cls])
+    image.save(path, optimize=False, compress_level=1)
+
+
+def _write_plan(job):
+    out_dir, seed, index, density, size_range, with_png = job
+    width, height, polygons = generate_plan(seed, index, density, size_range)
+    # Même convention de noms que dataset/ : <n>.png et <n>_gt_<k>.svg
+    svg_name = f"{index}_gt_{index % 17}.svg"
+    with open(os.path.join(out_dir, svg_name), 'w', encoding='utf-8') as f:
+        f.write(plan_to_svg(width, height, polygons))
+    if with_png:
+        plan_to_png(width, height, polygons, os.path.join(out_dir, f"{index}.png"))
+    return len(polygons)
+
+
+def ensure_corpus(out_dir, count, density=80, seed=0, size_range=(1000, 2000), with_png=True, workers=1):
+    """Génère le corpus dans out_dir s'il n'existe pas déjà avec les mêmes paramètres."""
+    params = {
+        'version': GENERATOR_VERSION, 'count': count, 'density': density, 'seed': seed,
+        'size_range': list(size_range), 'with_png': with_png,
+    }
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('params') == params:
+            print(f"Corpus {out_dir} déjà généré ({count} plans).")
+            return manifest
+        print(f"[WARN] Paramètres différents dans {manifest_path} : corpus régénéré")
+        os.remove(manifest_path)
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(out_dir, seed, i, density, tuple(size_range), with_png) for i in range(1, count + 1)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            counts = list(tqdm(executor.map(_write_plan, jobs, chunksize=max(1, count // (workers * 8))),
+                               total=count, desc="Génération des plans"))
+    else:
+        counts = [_write_plan(job) for job in tqdm(jobs, desc="Génération des plans")]
+    manifest = {'params': params, 'polygons': sum(counts)}
+    # Manifeste écrit en dernier : un corpus interrompu est régénéré
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Corpus {out_dir} : {count} plans, {manifest['polygons']} polygones.")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Génère un corpus de plans synthétiques (SVG + PNG)")
+    parser.add_argument('out_dir', type=str, help='Dossier de sortie')
+    parser.add_argument('--count', type=int, default=1000, help='Nombre de plans')
+    parser.add_argument('--density', type=int, default=80, help='Nombre moyen de polygones par plan')
+    parser.add_argument('--seed', type=int, default=0, help='Graine du générateur')
+    parser.add_argument('--min-size', type=int, default=1000, help='Largeur min des plans (pixels)')
+    parser.add_argument('--max-size', type=int, default=2000, help='Largeur max des plans (pixels)')
+    parser.add_argument('--no-png', action='store_true', help='SVG seulement')
+    parser.add_argument('--workers', type=int, default=1, help='Nombre de processus')
+    args = parser.parse_args()
+    ensure_corpus(args.out_dir, args.count, args.density, args.seed, (args.min_size, args.max_size),
+                  not args.no_png, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Normalisation du vocabulaire de classes des SVG vers les catégories d'entraînement.
+
+Les en-têtes des SVG listent des classes fines (Door-1, Door-23, Sink-11,
+Oven-3...). Une taxonomie (JSON, ou DEFAULT_TAXONOMY) déclare :
+
+- categories : la table stable des catégories, dans l'ordre des IDs COCO (1..N) ;
+- aliases    : {étiquette exacte: catégorie, ou null pour l'ignorer} ;
+- rules      : [[regex, catégorie ou null], ...] essayées dans l'ordre
+               (insensibles à la casse, \\1 renvoie au premier groupe) ;
+- unknown    : 'keep' (l'étiquette devient une catégorie ajoutée en fin de
+               table) ou 'drop' pour les étiquettes qu'aucune règle ne couvre.
+
+Les alias sont compilés une fois en dictionnaire ; les autres étiquettes
+sont résolues à la première rencontre (règles, puis nom de catégorie
+déclaré, puis unknown) et mémorisées dans ce même dictionnaire. Le parseur SVG (svg_parser) écarte
+les polygones ignorés avant de décoder leurs points.
+
+    python taxonomy.py dataset                 # étiquettes rencontrées -> catégorie
+    python taxonomy.py --dump taxonomy.json    # taxonomie par défaut, à éditer
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+from collections import Counter
+
+DEFAULT_TAXONOMY = {
+    'categories': ['Door', 'Parking', 'Room', 'Separation', 'Text', 'Wall', 'Window'],
+    'aliases': {},
+    'rules': [
+        [r'^(Door|Parking|Room|Separation|Text|Wall|Window)[-_ ]?\d*$', r'\1'],
+        # Mobilier et équipements : pas des catégories d'entraînement
+        [r'^(Bidet|Oven|Sink|Sofa|Stairs|Table|Tub|TV)\b', None],
+    ],
+    'unknown': 'keep',
+}
+
+
+class Taxonomy:
+    """Étiquette fine -> catégorie d'entraînement (None = polygone ignoré)."""
+
+    def __init__(self, config=None):
+        self.config = dict(DEFAULT_TAXONOMY, **(config or {}))
+        self.names = list(self.config['categories'])
+        self.unknown = self.config['unknown']
+        if self.unknown not in ('keep', 'drop'):
+            raise ValueError(f"unknown doit valoir 'keep' ou 'drop' (reçu : {self.unknown!r})")
+        self._declared = set(self.names)
+        self._canonical = {name.lower(): name for name in self.names}
+        self._table = {}
+        for label, target in self.config['aliases'].items():
+            self._table[label] = self._target(target, label)
+        self._rules = [(re.compile(pattern, re.IGNORECASE), target) for pattern, target in self.config['rules']]
+
+    def _target(self, target, label):
+        if target is None:
+            return None
+        name = self._canonical.get(target.lower())
+        if name is None:
+            raise ValueError(f"Catégorie '{target}' (pour l'étiquette '{label}') absente de la table des catégories")
+        return name
+
+    def _match(self, label):
+        for pattern, target in self._rules:
+            match = pattern.match(label)
+            if match:
+                return self._target(match.expand(target) if target is not None else None, label)
+        if label in self._declared:
+            return label
+        return label if self.unknown == 'keep' else None
+
+    def category(self, label):
+        """Catégorie de l'étiquette, ou None si ses polygones sont ignorés."""
+        try:
+            return self._table[label]
+        except KeyError:
+            result = self._table[label] = self._match(label)
+            return result
+
+    def is_declared(self, name):
+        return name in self._declared
+
+    def category_table(self, seen=()):
+        """[{'id', 'name'}] : catégories déclarées (IDs stables), puis les inconnues conservées, triées."""
+        names = self.names + sorted(set(seen) - self._declared)
+        return [{'id': k + 1, 'name': name} for k, name in enumerate(names)]
+
+    def fingerprint(self):
+        """Empreinte de la configuration (invalide les caches de conversion si elle change)."""
+        data = json.dumps(self.config, sort_keys=True).encode('utf-8')
+        return hashlib.blake2b(data, digest_size=6).hexdigest()
+
+
+def load_taxonomy(path=None):
+    """Taxonomie d'un fichier JSON, ou DEFAULT_TAXONOMY si path est None."""
+    if path is None:
+        return Taxonomy()
+    with open(path, 'r', encoding='utf-8') as f:
+        return Taxonomy(json.load(f))
+
+
+def main():
+    from svg_parser import iter_svg
+
+    parser = argparse.ArgumentParser(description="Affiche l'association étiquettes SVG -> catégories")
+    parser.add_argument('svg_dir', type=str, nargs='?', default=None, help='Dossier des SVG à inventorier')
+    parser.add_argument('--taxonomy', type=str, default=None, help='Taxonomie JSON (défaut : taxonomie intégrée)')
+    parser.add_argument('--dump', type=str, default=None, help='Écrit la taxonomie utilisée dans ce fichier JSON')
+    args = parser.parse_args()
+
+    taxonomy = load_taxonomy(args.taxonomy)
+    if args.dump:
+        with open(args.dump, 'w', encoding='utf-8') as f:
+            json.dump(taxonomy.config, f, indent=2, ensure_ascii=False)
+        print(f"Taxonomie écrite dans {args.dump}")
+    if not args.svg_dir:
+        return
+    header, polygons = Counter(), Counter()
+    for root, _, files in os.walk(args.svg_dir):
+        for name in files:
+            if name.lower().endswith('.svg'):
+                for kind, value in iter_svg(os.path.join(root, name)):
+                    if kind == 'class':
+                        header[value] += 1
+                    elif kind == 'polygon':
+                        polygons[value['class']] += 1
+    print(f"{len(set(header) | set(polygons))} étiquettes (en-têtes et polygones) :")
+    for label in sorted(set(header) | set(polygons)):
+        category = taxonomy.category(label)
+        if category is None:
+            status = 'ignorée'
+        elif taxonomy.is_declared(category):
+            status = category
+        else:
+            status = f"{category} (inconnue, conservée)"
+        print(f"  {label:20s} -> {status:28s} {polygons.get(label, 0):7d} polygones")
+    table = taxonomy.category_table(c for c in map(taxonomy.category, polygons) if c is not None)
+    print(f"Table des catégories ({len(table)}) : {[c['name'] for c in table]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+"""Découpage des grands plans en tuiles (entraînement) et recollage des prédictions (inférence).
+
+Les images et leurs polygones COCO sont découpés en tuiles de taille fixe
+avec recouvrement ; les polygones sont coupés aux bords des tuiles
+(Sutherland–Hodgman). Les tuiles sont mises en cache sur disque et ne sont
+régénérées que si les annotations ou les paramètres changent. À l'inférence,
+stitch_predictions recolle les prédictions par tuile en fusionnant les
+instances dupliquées ou coupées au niveau des recouvrements.
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from tqdm import tqdm
+import geometry
+from coco_store import content_hash, load_coco, save_coco
+
+TILING_VERSION = 1
+
+
+def tile_grid(width, height, tile_size, overlap):
+    """Rectangles (x0, y0, x1, y1) couvrant l'image, le dernier de chaque ligne/colonne calé sur le bord."""
+    if tile_size <= overlap:
+        raise ValueError(f"overlap ({overlap}) doit être < tile_size ({tile_size})")
+    stride = tile_size - overlap
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, stride))
+        positions.append(length - tile_size)
+        return positions
+
+    return [
+        (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+        for y0 in starts(height)
+        for x0 in starts(width)
+    ]
+
+
+def _clip_edge(pts, axis, value, keep_greater):
+    """Une passe de Sutherland–Hodgman contre la droite coord[axis] = value."""
+    if len(pts) == 0:
+        return pts
+    nxt = np.roll(pts, -1, axis=0)
+    inside = pts[:, axis] >= value if keep_greater else pts[:, axis] <= value
+    crossing = inside != np.roll(inside, -1)
+    delta = nxt[:, axis] - pts[:, axis]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(crossing, (value - pts[:, axis]) / delta, 0.0)
+    inter = pts + t[:, None] * (nxt - pts)
+    inter[crossing, axis] = value
+    # Pour chaque arête i -> i+1 : le sommet i s'il est dedans, puis l'intersection si elle traverse
+    candidates = np.stack([pts, inter], axis=1)
+    keep = np.stack([inside, crossing], axis=1)
+    return candidates[keep]
+
+
+def clip_polygon(points, rect):
+    """Coupe un polygone (N, 2) par un rectangle (x0, y0, x1, y1)."""
+    x0, y0, x1, y1 = rect
+    pts = np.asarray(points, dtype=np.float64)
+    pts = _clip_edge(pts, 0, x0, True)
+    pts = _clip_edge(pts, 0, x1, False)
+    pts = _clip_edge(pts, 1, y0, True)
+    pts = _clip_edge(pts, 1, y1, False)
+    return pts
+
+
+def clip_annotation(ann, rect, min_area=1.0):
+    """Annotation COCO ramenée dans le repère de la tuile, ou None si elle en sort."""
+    clipped = [clip_polygon(np.asarray(ring, dtype=np.float64).reshape(-1, 2), rect) for ring in ann['segmentation']]
+    vertices, offsets = geometry.pack_rings([ring for ring in clipped if len(ring) >= 3])
+    areas = geometry.ring_areas(vertices, offsets)
+    kept = np.flatnonzero(areas >= min_area)
+    if not len(kept):
+        return None
+    vertices = vertices - rect[:2]
+    rings = [vertices[offsets[i]:offsets[i + 1]] for i in kept]
+    bboxes = geometry.ring_bboxes(vertices, offsets)[kept]
+    bbox = geometry.group_bboxes(bboxes, np.array([0, len(kept)], dtype=np.int64))[0]
+    return {
+        'category_id': ann['category_id'],
+        'segmentation': [r.ravel().round(2).tolist() for r in rings],
+        'bbox': bbox.tolist(),
+        'area': float(areas[kept].sum()),
+        'iscrowd': ann.get('iscrowd', 0),
+    }
+
+
+def _tile_image(job):
+    """Découpe une image et ses annotations (exécuté dans un processus séparé).
+
+    Avec tiles_dir = None, seules les annotations sont découpées (aucune image lue ni écrite).
+    """
+    img, anns, img_path, tiles_dir, tile_size, overlap = job
+    from PIL import Image
+
+    stem = os.path.splitext(os.path.basename(img['file_name']))[0]
+    src_mtime = os.path.getmtime(img_path) if tiles_dir is not None else None
+    rects = tile_grid(img['width'], img['height'], tile_size, overlap)
+    # Pré-filtrage des annotations par bbox avant le découpage exact
+    bboxes = np.array([a['bbox'] for a in anns], dtype=np.float64).reshape(-1, 4)
+    tiles = []
+    image = None
+    for rect in rects:
+        x0, y0, x1, y1 = rect
+        tile_name = f"{stem}__{x0}_{y0}.png"
+        if tiles_dir is not None:
+            tile_path = os.path.join(tiles_dir, tile_name)
+            if not (os.path.isfile(tile_path) and os.path.getmtime(tile_path) >= src_mtime):
+                if image is None:
+                    image = Image.open(img_path)
+                    image.load()
+                image.crop(rect).save(tile_path)
+        hits = np.nonzero(
+            (bboxes[:, 0] < x1) & (bboxes[:, 0] + bboxes[:, 2] > x0)
+            & (bboxes[:, 1] < y1) & (bboxes[:, 1] + bboxes[:, 3] > y0)
+        )[0]
+        tile_anns = []
+        for i in hits.tolist():
+            clipped = clip_annotation(anns[i], rect)
+            if clipped is not None:
+                tile_anns.append(clipped)
+        tiles.append(({
+            'file_name': tile_name,
+            'width': x1 - x0,
+            'height': y1 - y0,
+            'source_image_id': img['id'],
+            'offset': [x0, y0],
+        }, tile_anns))
+    if image is not None:
+        image.close()
+    return tiles
+
+
+def build_tiled_dataset(ann_path, img_dir, out_dir, tile_size=1024, overlap=128, workers=1):
+    """Construit (ou réutilise) le dataset tuilé ; retourne (chemin COCO des tuiles, dossier des images)."""
+    tiles_dir = os.path.join(out_dir, 'images')
+    out_ann = os.path.join(out_dir, 'annotations_tiles.json')
+    meta_path = os.path.join(out_dir, 'tiles_meta.json')
+    meta = {
+        'version': TILING_VERSION,
+        'source': os.path.abspath(ann_path),
+        'source_hash': content_hash(ann_path),
+        'tile_size': tile_size,
+        'overlap': overlap,
+    }
+    if os.path.isfile(meta_path) and os.path.isfile(out_ann):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == meta:
+                print(f"Tuiles à jour dans {out_dir} (cache).")
+                return out_ann, tiles_dir
+    os.makedirs(tiles_dir, exist_ok=True)
+
+    tiled = tile_coco(load_coco(ann_path), img_dir, tiles_dir, tile_size, overlap, workers)
+    save_coco(tiled, out_ann)
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    print(f"{len(tiled['images'])} tuiles, {len(tiled['annotations'])} annotations écrites dans {out_dir}")
+    return out_ann, tiles_dir
+
+
+def tile_coco(coco, img_dir, tiles_dir, tile_size=1024, overlap=128, workers=1):
+    """COCO des tuiles (en mémoire) ; les images découpées sont écrites dans tiles_dir, sauf si tiles_dir = None."""
+    by_image = {}
+    for ann in coco['annotations']:
+        by_image.setdefault(ann['image_id'], []).append(ann)
+    jobs = []
+    for img in coco['images']:
+        if not img.get('width') or not img.get('height'):
+            print(f"[WARN] Taille inconnue, image ignorée : {img['file_name']}")
+            continue
+        jobs.append((img, by_image.get(img['id'], []), os.path.join(img_dir, img['file_name']),
+                     tiles_dir, tile_size, overlap))
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(tqdm(executor.map(_tile_image, jobs), total=len(jobs), desc="Découpage en tuiles"))
+    else:
+        results = [_tile_image(job) for job in tqdm(jobs, desc="Découpage en tuiles")]
+
+    images, annotations = [], []
+    for tiles in results:
+        for tile, tile_anns in tiles:
+            tile['id'] = len(images) + 1
+            images.append(tile)
+            for ann in tile_anns:
+                ann['id'] = len(annotations) + 1
+                ann['image_id'] = tile['id']
+                annotations.append(ann)
+    return {
+        'images': images,
+        'annotations': annotations,
+        'categories': coco['categories'],
+        'info': coco.get('info', {}),
+        'licenses': coco.get('licenses', []),
+    }
+
+
+# --- Inférence : recollage des prédictions par tuile ---
+
+def _box_iomin(box, boxes):
+    """Intersection / plus petite aire entre une boîte et des boîtes (x0, y0, x1, y1)."""
+    ix0 = np.maximum(box[0], boxes[:, 0])
+    iy0 = np.maximum(box[1], boxes[:, 1])
+    ix1 = np.minimum(box[2], boxes[:, 2])
+    iy1 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(ix1 - ix0, 0, None) * np.clip(iy1 - iy0, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(np.minimum(area, areas), 1e-9)
+
+
+def _paste_union(inst, other):
+    """Fusionne deux instances (boîte englobante, union des masques)."""
+    box = [min(inst['box'][0], other['box'][0]), min(inst['box'][1], other['box'][1]),
+           max(inst['box'][2], other['box'][2]), max(inst['box'][3], other['box'][3])]
+    merged = dict(inst, box=box, score=max(inst['score'], other['score']))
+    if inst.get('mask') is not None and other.get('mask') is not None:
+        ox, oy = int(np.floor(box[0])), int(np.floor(box[1]))
+        w = int(np.ceil(box[2])) - ox
+        h = int(np.ceil(box[3])) - oy
+        canvas = np.zeros((h, w), dtype=bool)
+        for part in (inst, other):
+            px, py = part['mask_origin']
+            mh, mw = part['mask'].shape
+            canvas[py - oy:py - oy + mh, px - ox:px - ox + mw] |= part['mask']
+        merged['mask'] = canvas
+        merged['mask_origin'] = (ox, oy)
+    return merged
+
+
+def stitch_predictions(tile_predictions, iou_threshold=0.5):
+    """Recolle des prédictions par tuile dans le repère de l'image complète.
+
+    tile_predictions : liste de (rect, boxes (K, 4) xyxy, scores (K,), classes (K,), masks)
+    où masks est None ou un tableau booléen (K, h_tuile, w_tuile).
+    Les doublons d'une même classe (intersection / plus petite aire >
+    iou_threshold, ce qui couvre les objets coupés au bord d'une tuile) sont
+    fusionnés : boîte englobante, union des masques, meilleur score.
+
+    Retourne une liste d'instances {'box', 'score', 'class', 'mask', 'mask_origin'},
+    le masque étant recadré sur la boîte et positionné par mask_origin (x, y).
+    """
+    instances = []
+    for rect, boxes, scores, classes, masks in tile_predictions:
+        x0, y0 = rect[0], rect[1]
+        for k in range(len(scores)):
+            box = np.asarray(boxes[k], dtype=np.float64) + (x0, y0, x0, y0)
+            inst = {'box': box.tolist(), 'score': float(scores[k]), 'class': int(classes[k]),
+                    'mask': None, 'mask_origin': None}
+            if masks is not None:
+                bx0, by0 = int(np.floor(boxes[k][0])), int(np.floor(boxes[k][1]))
+                bx1, by1 = int(np.ceil(boxes[k][2])), int(np.ceil(boxes[k][3]))
+                inst['mask'] = np.asarray(masks[k][by0:by1, bx0:bx1], dtype=bool)
+                inst['mask_origin'] = (bx0 + x0, by0 + y0)
+            instances.append(inst)
+
+    merged = []
+    for cls in sorted(set(inst['class'] for inst in instances)):
+        group = sorted((inst for inst in instances if inst['class'] == cls), key=lambda i: -i['score'])
+        boxes = np.array([inst['box'] for inst in group], dtype=np.float64).reshape(-1, 4)
+        alive = np.ones(len(group), dtype=bool)
+        for i in range(len(group)):
+            if not alive[i]:
+                continue
+            alive[i] = False
+            current = group[i]
+            while True:
+                # Les fusions agrandissent la boîte : on itère jusqu'à stabilité
+                dup = np.nonzero(alive & (_box_iomin(np.array(current['box']), boxes) > iou_threshold))[0]
+                if len(dup) == 0:
+                    break
+                for j in dup.tolist():
+                    current = _paste_union(current, group[j])
+                alive[dup] = False
+            merged.append(current)
+    return merged
+
+
+def instance_to_coco_result(inst, image_id, height, width, category_id=None):
+    """Instance recollée -> résultat COCO (bbox xywh, segmentation RLE sur l'image complète)."""
+    x0, y0, x1, y1 = inst['box']
+    result = {
+        'image_id': image_id,
+        'category_id': inst['class'] if category_id is None else category_id,
+        'bbox': [x0, y0, x1 - x0, y1 - y0],
+        'score': inst['score'],
+    }
+    if inst.get('mask') is not None:
+        from pycocotools import mask as mask_util
+
+        full = np.zeros((height, width), dtype=np.uint8, order='F')
+        ox, oy = inst['mask_origin']
+        mh, mw = inst['mask'].shape
+        sx0, sy0 = max(ox, 0), max(oy, 0)
+        sx1, sy1 = min(ox + mw, width), min(oy + mh, height)
+        if sx1 > sx0 and sy1 > sy0:
+            full[sy0:sy1, sx0:sx1] = inst['mask'][sy0 - oy:sy1 - oy, sx0 - ox:sx1 - ox]
+        rle = mask_util.encode(full)
+        rle['counts'] = rle['counts'].decode('ascii')
+        result['segmentation'] = rle
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Découpe un dataset COCO en tuiles (avec recouvrement) pour l'entraînement")
+    parser.add_argument('annotations', type=str, help='Fichier COCO (.json ou .cocobin) avec width/height')
+    parser.add_argument('--img_dir', type=str, default='dataset', help='Dossier des images')
+    parser.add_argument('--out_dir', type=str, default='tiles', help='Dossier de sortie (cache des tuiles)')
+    parser.add_argument('--tile_size', type=int, default=1024, help='Taille des tuiles (pixels)')
+    parser.add_argument('--overlap', type=int, default=128, help='Recouvrement entre tuiles (pixels)')
+    parser.add_argument('--workers', type=int, default=1, help='Nombre de processus')
+    args = parser.parse_args()
+    build_tiled_dataset(args.annotations, args.img_dir, args.out_dir, args.tile_size, args.overlap, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,210 @@
 import os
 import json
-import torch
-from detectron2.engine import DefaultTrainer
-from detectron2.config import get_cfg
-from detectron2.data.datasets import register_coco_instances
-from detectron2 import model_zoo
-from detectron2.utils.logger import setup_logger
+import argparse
+import shutil
+import numpy as np
+import geometry
+from profiling import RunReport, add_report_args
+from coco_store import CocoStore, content_hash, is_store, load_coco, register_coco_store, update_store
+from image_cache import DEFAULT_BUDGET_MB, DEFAULT_CACHE_DIR
 
-setup_logger()
+# Torch et Detectron2 ne sont importés qu'au moment d'entraîner : --dry-run et --help restent instantanés.
+# Version de la correction des fichiers COCO (les tampons de validation d'une autre version sont ignorés)
+FIX_VERSION = 1
+
+def build_cfg(num_classes, batch_size=2, max_iter=3000, output_dir="output_detectron2"):
+    """Configuration Mask R-CNN commune à l'entraînement et aux outils (benchmark, inférence)."""
+    from detectron2 import model_zoo
+    from detectron2.config import get_cfg
+
+    cfg = get_cfg()
+    cfg.merge_from_file(model_zoo.get_config_file(
+        "COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml"))
+    cfg.DATASETS.TRAIN = ("plan_train",)
+    cfg.DATASETS.TEST = ("plan_val",)
+    cfg.DATALOADER.NUM_WORKERS = 2
+    cfg.MODEL.WEIGHTS = model_zoo.get_checkpoint_url(
+        "COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml")
+    cfg.SOLVER.IMS_PER_BATCH = batch_size
+    cfg.SOLVER.BASE_LR = 0.00025
+    cfg.SOLVER.MAX_ITER = max_iter
+    cfg.MODEL.ROI_HEADS.BATCH_SIZE_PER_IMAGE = 128
+    cfg.MODEL.ROI_HEADS.NUM_CLASSES = num_classes
+    cfg.OUTPUT_DIR = output_dir
+    return cfg
+
+def build_trainer(cfg, sampling=None, image_cache=None):
+    """DefaultTrainer dont le dataloader peut être pondéré par classe / difficulté (voir sampling.py)
+    et lire les images décodées dans un cache partagé (voir image_cache.py)."""
+    from detectron2.engine import DefaultTrainer
+    from image_cache import CachedDatasetMapper
+
+    class PlanTrainer(DefaultTrainer):
+        @classmethod
+        def build_train_loader(cls, cfg):
+            mapper = CachedDatasetMapper(cfg, True, image_cache) if image_cache is not None else None
+            if sampling is not None:
+                return sampling.build_train_loader(cfg, mapper)
+            if mapper is not None:
+                from detectron2.data import build_detection_train_loader
+                return build_detection_train_loader(cfg, mapper=mapper)
+            return super().build_train_loader(cfg)
+
+    return PlanTrainer(cfg)
+
+# --- Correction automatique des fichiers COCO pour éviter KeyError: 'info' ---
+def fix_coco_json(json_path, write=True):
+    """Ajoute info/licenses si absents et remplace 'area' par l'aire réelle des polygones.
+
+    Retourne (modifié, résumé) ; le fichier n'est réécrit que si write est vrai.
+    """
+    with open(json_path, 'r', encoding='utf-8') as f:
+        coco_data = json.load(f)
+    changed = False
+    # Ajout info/licenses si absents
+    if 'info' not in coco_data:
+        coco_data['info'] = {
+            "description": "Auto-added info for COCO file",
+            "version": "1.0",
+            "year": 2025
+        }
+        changed = True
+    if 'licenses' not in coco_data:
+        coco_data['licenses'] = []
+        changed = True
+    # Correction automatique de la clé 'area' : aire réelle des polygones (et non w*h du bbox,
+    # très faux pour les pièces en L et les murs en biais, ce qui fausse les tranches small/medium/large)
+    annotations = coco_data.get('annotations', [])
+    true_areas = geometry.segmentation_areas(annotations)
+    for ann, true_area in zip(annotations, true_areas.tolist()):
+        if true_area == true_area and true_area > 0:  # NaN = pas de polygone
+            if ann.get('area') != true_area:
+                ann['area'] = true_area
+                changed = True
+        elif 'area' not in ann or ann['area'] in [None, 0]:
+            # Calcul à partir du bbox si disponible
+            if 'bbox' in ann and len(ann['bbox']) == 4:
+                _, _, w, h = ann['bbox']
+                area = float(w) * float(h)
+                ann['area'] = area
+                changed = True
+            # Sinon, on laisse à 1 (valeur minimale pour éviter l'erreur, mais à corriger manuellement si segmentation complexe)
+            else:
+                ann['area'] = 1.0
+                changed = True
+    if changed and write:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(coco_data, f, indent=2, ensure_ascii=False)
+    return changed, _summary(coco_data['images'], coco_data['categories'])
+
+# Même correction pour un store .cocobin (aire absente = NaN), sans passer par des dicts
+def fix_coco_store(store_path, write=True):
+    store = CocoStore(store_path)
+    info = None
+    licenses = None
+    area = None
+    if store.info is None:
+        info = {
+            "description": "Auto-added info for COCO file",
+            "version": "1.0",
+            "year": 2025
+        }
+    if store.licenses is None:
+        licenses = []
+    true_area = geometry.segment_sums(geometry.ring_areas(store.vertices, store.poly_offsets),
+                                      store.ann_poly_offsets)
+    bbox_area = store.ann_bbox[:, 2] * store.ann_bbox[:, 3]
+    fallback = np.where(bbox_area > 0, bbox_area, 1.0)
+    expected = np.where(true_area > 0, true_area, np.where(np.isnan(store.ann_area) | (store.ann_area == 0),
+                                                           fallback, store.ann_area))
+    if not np.array_equal(expected, store.ann_area):
+        area = expected
+    changed = info is not None or licenses is not None or area is not None
+    summary = _summary(store.images, store.categories)
+    if changed and write:
+        update_store(store_path, info=info, licenses=licenses, area=area)
+    return changed, summary
+
+def _summary(images, categories):
+    """Ce que le plan d'entraînement lit d'un fichier COCO : tailles des images et catégories."""
+    return {
+        'sizes': [[img.get('width'), img.get('height')] for img in images],
+        'categories': sorted(categories, key=lambda c: c['id']),
+    }
+
+def default_stamp_path(ann_path):
+    """annotations_train.json -> annotations_train.validated.json (idem pour un .cocobin)."""
+    return os.path.splitext(ann_path.rstrip('/\\'))[0] + '.validated.json'
+
+def validate_coco(ann_path, write=True):
+    """(résumé, état) du fichier COCO, corrigé si besoin.
+
+    Le résultat de la vérification est retenu dans un tampon
+    <annotations>.validated.json (hash du contenu, résumé, correction en
+    attente ou non) : tant que le fichier ne change pas, il n'est plus relu.
+    État : 'tampon', 'valide', 'corrigé', ou 'à corriger' (write=False, fichier laissé tel quel).
+    """
+    stamp_path = default_stamp_path(ann_path)
+    digest = content_hash(ann_path)
+    if os.path.isfile(stamp_path):
+        try:
+            with open(stamp_path, 'r', encoding='utf-8') as f:
+                stamp = json.load(f)
+            if stamp.get('version') == FIX_VERSION and stamp.get('hash') == digest:
+                if not stamp.get('needs_fix'):
+                    return stamp['summary'], 'tampon'
+                if not write:
+                    return stamp['summary'], 'à corriger'
+        except (OSError, ValueError):
+            print(f"[WARN] Tampon de validation illisible, fichier revérifié : {stamp_path}")
+    fix = fix_coco_store if is_store(ann_path) else fix_coco_json
+    changed, summary = fix(ann_path, write)
+    needs_fix = changed and not write
+    tmp = stamp_path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'version': FIX_VERSION, 'hash': content_hash(ann_path) if changed and write else digest,
+                   'needs_fix': needs_fix, 'summary': summary}, f)
+    os.replace(tmp, stamp_path)
+    if needs_fix:
+        return summary, 'à corriger'
+    return summary, 'corrigé' if changed else 'valide'
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Entraînement Mask R-CNN (Detectron2) sur les plans 2D")
+    parser.add_argument('--rle-cache', action='store_true',
+                        help='Masques d\'entraînement lus depuis le cache RLE précalculé (voir rle_cache.py)')
+    parser.add_argument('--tile-size', type=int, default=0,
+                        help='Entraîne sur des tuiles de cette taille (0 = images entières, voir tiling.py)')
+    parser.add_argument('--tile-overlap', type=int, default=128, help='Recouvrement entre tuiles (pixels)')
+    parser.add_argument('--batch-size', type=int, default=2, help='Images (ou tuiles) par batch')
+    parser.add_argument('--eval-period', type=int, default=0,
+                        help='Évaluation val asynchrone toutes les N itérations (0 = désactivée, voir fast_eval.py)')
+    parser.add_argument('--eval-metric', type=str, default='AP', help='Métrique suivie (AP, AP50, AP75, AP-Wall, ...)')
+    parser.add_argument('--patience', type=int, default=0,
+                        help='Arrêt anticipé après N évaluations sans amélioration (0 = jamais)')
+    parser.add_argument('--eval-device', type=str, default='cpu', help='Device du processus d\'évaluation')
+    parser.add_argument('--sampling', type=str, default='uniform', choices=['uniform', 'repeat', 'hard'],
+                        help='Tirage des images : uniforme, repeat factor par catégorie, ou + exemples difficiles')
+    parser.add_argument('--repeat-threshold', type=float, default=1.0,
+                        help='Fraction d\'images sous laquelle une catégorie est suréchantillonnée')
+    parser.add_argument('--hard-power', type=float, default=1.0,
+                        help='Exposant du poids (perte récente / perte moyenne) en mode hard')
+    parser.add_argument('--image-cache', action='store_true',
+                        help='Images décodées une fois et partagées par les workers (voir image_cache.py)')
+    parser.add_argument('--image-cache-dir', type=str, default=DEFAULT_CACHE_DIR,
+                        help='Dossier du cache d\'images (ex. /dev/shm/cvcsp pour la mémoire partagée)')
+    parser.add_argument('--image-cache-max-side', type=int, default=None,
+                        help='Plus grand côté des images en cache (défaut : INPUT.MAX_SIZE_TRAIN, 0 = taille réelle)')
+    parser.add_argument('--image-cache-budget-mb', type=float, default=DEFAULT_BUDGET_MB,
+                        help='Taille maximale du cache d\'images (Mo, les moins récemment lues sont évincées)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Affiche le plan d\'entraînement (catégories, epochs, échantillonnage) sans entraîner')
+    add_report_args(parser)
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+    report = RunReport('train_detectron2_maskrcnn', args.report, profile=args.profile)
     # Configurations
     data_dir = "dataset"
     train_json = "annotations_train_with_hw.json"
@@ -17,50 +212,50 @@ def main():
     train_imgs = data_dir
     val_imgs = data_dir
     output_dir = "output_detectron2"
-    num_classes = 7  # 7 catégories dans le COCO
-    batch_size = 2
+    batch_size = args.batch_size
     max_iter = 3000  # adjust for your dataset
 
-    # --- Correction automatique des fichiers COCO pour éviter KeyError: 'info' ---
-    def ensure_coco_info_licenses_area(json_path):
-        with open(json_path, 'r', encoding='utf-8') as f:
-            coco_data = json.load(f)
-        changed = False
-        # Ajout info/licenses si absents
-        if 'info' not in coco_data:
-            coco_data['info'] = {
-                "description": "Auto-added info for COCO file",
-                "version": "1.0",
-                "year": 2025
-            }
-            changed = True
-        if 'licenses' not in coco_data:
-            coco_data['licenses'] = []
-            changed = True
-        # Correction automatique de la clé 'area' dans chaque annotation
-        for ann in coco_data.get('annotations', []):
-            if 'area' not in ann or ann['area'] in [None, 0]:
-                # Calcul à partir du bbox si disponible
-                if 'bbox' in ann and len(ann['bbox']) == 4:
-                    _, _, w, h = ann['bbox']
-                    area = float(w) * float(h)
-                    ann['area'] = area
-                    changed = True
-                # Sinon, on laisse à 1 (valeur minimale pour éviter l'erreur, mais à corriger manuellement si segmentation complexe)
-                else:
-                    ann['area'] = 1.0
-                    changed = True
-        if changed:
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(coco_data, f, indent=2, ensure_ascii=False)
-
-    ensure_coco_info_licenses_area(train_json)
-    ensure_coco_info_licenses_area(val_json)
+    # Fichiers COCO corrigés au besoin ; un fichier inchangé depuis sa dernière validation n'est pas relu
+    with report.stage('fix_coco'):
+        train_summary, train_state = validate_coco(train_json, write=not args.dry_run)
+        val_summary, val_state = validate_coco(val_json, write=not args.dry_run)
+    print(f"Fichiers COCO : {train_json} ({train_state}), {val_json} ({val_state})")
+
+    # NUM_CLASSES suit la table des catégories du COCO (taxonomy.py) au lieu d'une constante
+    categories = train_summary['categories']
+    if val_summary['categories'] != categories:
+        raise SystemExit(f"[ERREUR] Tables de catégories différentes entre {train_json} et {val_json}")
+    num_classes = len(categories)
+    print(f"{num_classes} catégories : {[c['name'] for c in categories]}")
+
+    # Entraînement par tuiles : mémoire par échantillon bornée, résolution native conservée
+    train_source = train_json
+    if args.tile_size and args.dry_run:
+        from tiling import tile_coco
+
+        # Annotations des tuiles calculées en mémoire (aucune image découpée) : mêmes effectifs et mêmes
+        # statistiques d'échantillonnage que le dataset tuilé de l'entraînement
+        train_source = tile_coco(load_coco(train_json), train_imgs, None, args.tile_size, args.tile_overlap)
+        nb_images_train = len(train_source['images'])
+        print(f"Tuiles {args.tile_size} px (recouvrement {args.tile_overlap}) : découpage non effectué (--dry-run)")
+    elif args.tile_size:
+        from tiling import build_tiled_dataset
+
+        with report.stage('tiling', tile_size=args.tile_size, overlap=args.tile_overlap):
+            train_json, train_imgs = build_tiled_dataset(
+                train_json, train_imgs, os.path.join("tiles", f"train_{args.tile_size}_{args.tile_overlap}"),
+                tile_size=args.tile_size, overlap=args.tile_overlap)
+        train_source = train_json
+        if is_store(train_json):
+            nb_images_train = len(CocoStore(train_json).images)
+        else:
+            with open(train_json, 'r') as f:
+                coco = json.load(f)
+            nb_images_train = len(coco['images'])
+    else:
+        nb_images_train = len(train_summary['sizes'])
 
     # Calcul et affichage du nombre d'epochs
-    with open(train_json, 'r') as f:
-        coco = json.load(f)
-    nb_images_train = len(coco['images'])
     iters_per_epoch = nb_images_train // batch_size
     nb_epochs = max_iter / iters_per_epoch if iters_per_epoch else 0
     print(f"Nombre d'images d'entraînement : {nb_images_train}")
@@ -69,43 +264,114 @@ def main():
     print(f"Itérations par epoch : {iters_per_epoch}")
     print(f"Nombre d'epochs estimé : {nb_epochs:.2f}")
 
+    sampling = None
+    if args.sampling != 'uniform':
+        from sampling import ClassAwareSampling
+
+        # Statistiques par catégorie mises en cache à côté du COCO d'entraînement (hash du contenu),
+        # sauf en --dry-run qui n'écrit rien
+        with report.stage('sampling_stats', mode=args.sampling):
+            sampling = ClassAwareSampling(train_source, args.sampling, args.repeat_threshold, args.hard_power,
+                                          write_cache=not args.dry_run)
+        print(sampling.summary(categories))
+
+    if args.dry_run:
+        options = []
+        if args.rle_cache:
+            options.append("masques RLE")
+        if args.image_cache:
+            options.append(f"cache d'images {args.image_cache_dir}")
+        if args.eval_period:
+            options.append(f"évaluation toutes les {args.eval_period} itérations")
+        print(f"Options : {', '.join(options) or 'aucune'}")
+        print(f"--dry-run : entraînement non lancé (sorties prévues dans {output_dir})")
+        report.close()
+        return
+
+    from detectron2.data.datasets import register_coco_instances
+    from detectron2.utils.logger import setup_logger
+    from fast_eval import AsyncEvalHook, EarlyStop
+    from image_cache import ImageCache
+    from profiling import TrainProfileHook
+    from rle_cache import register_rle_instances
+    from sampling import HardExampleHook
+
+    setup_logger()
+
     # Register datasets
-    register_coco_instances("plan_train", {}, train_json, train_imgs)
-    register_coco_instances("plan_val", {}, val_json, val_imgs)
+    with report.stage('register'):
+        for name, ann_file, img_root in [("plan_train", train_json, train_imgs), ("plan_val", val_json, val_imgs)]:
+            if args.rle_cache and name == "plan_train":
+                # Masques rastérisés une fois pour toutes (cache invalidé par hash de contenu)
+                register_rle_instances(name, ann_file, img_root)
+            elif is_store(ann_file):
+                register_coco_store(name, ann_file, img_root)
+            else:
+                register_coco_instances(name, {}, ann_file, img_root)
 
-    cfg = get_cfg()
-    cfg.merge_from_file(model_zoo.get_config_file(
-        "COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml"))
-    cfg.DATASETS.TRAIN = ("plan_train",)
-    cfg.DATASETS.TEST = ("plan_val",)
-    cfg.DATALOADER.NUM_WORKERS = 2
-    cfg.MODEL.WEIGHTS = model_zoo.get_checkpoint_url(
-        "COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml")
-    cfg.SOLVER.IMS_PER_BATCH = batch_size
-    cfg.SOLVER.BASE_LR = 0.00025
-    cfg.SOLVER.MAX_ITER = max_iter
-    cfg.MODEL.ROI_HEADS.BATCH_SIZE_PER_IMAGE = 128
-    cfg.MODEL.ROI_HEADS.NUM_CLASSES = num_classes
-    cfg.OUTPUT_DIR = output_dir
+    cfg = build_cfg(num_classes, batch_size, max_iter, output_dir)
+    if args.rle_cache:
+        cfg.INPUT.MASK_FORMAT = "bitmask"
+    if args.tile_size:
+        # Tuiles utilisées à leur taille native (pas de redimensionnement)
+        cfg.INPUT.MIN_SIZE_TRAIN = (args.tile_size,)
+        cfg.INPUT.MAX_SIZE_TRAIN = args.tile_size
     os.makedirs(cfg.OUTPUT_DIR, exist_ok=True)
 
-    trainer = DefaultTrainer(cfg)
-    trainer.resume_or_load(resume=False)
-    trainer.train()
+    image_cache = None
+    if args.image_cache:
+        # Réduire à MAX_SIZE_TRAIN ne perd rien : ResizeShortestEdge ne produit jamais d'image plus grande
+        max_side = cfg.INPUT.MAX_SIZE_TRAIN if args.image_cache_max_side is None else args.image_cache_max_side
+        image_cache = ImageCache(args.image_cache_dir, max_side, args.image_cache_budget_mb, cfg.INPUT.FORMAT)
+        print(f"Cache d'images : {args.image_cache_dir} (plus grand côté {max_side or 'natif'}, "
+              f"budget {args.image_cache_budget_mb:.0f} Mo)")
+
+    trainer = build_trainer(cfg, sampling, image_cache)
+    # Attente du dataloader vs calcul, itération par itération (rapport d'exécution)
+    trainer.register_hooks([TrainProfileHook(report)])
+    if args.sampling == 'hard':
+        trainer.register_hooks([HardExampleHook(sampling)])
+    eval_hook = None
+    if args.eval_period:
+        # Évaluation dans un processus séparé : la boucle d'entraînement n'attend pas
+        eval_hook = AsyncEvalHook(cfg, args.eval_period, val_json, val_imgs, metric=args.eval_metric,
+                                  patience=args.patience, device=args.eval_device)
+        trainer.register_hooks([eval_hook])
+    with report.stage('train', max_iter=max_iter, batch_size=batch_size):
+        trainer.resume_or_load(resume=False)
+        try:
+            trainer.train()
+        except EarlyStop as e:
+            print(f"Arrêt anticipé à l'itération {trainer.iter} : {e}")
+
+    # Évaluation finale et model_final.pth sur le meilleur instantané de l'évaluation asynchrone
+    # (après un arrêt anticipé, les derniers poids sont justement ceux qui ne progressaient plus)
+    best_path = os.path.join(cfg.OUTPUT_DIR, 'model_best.pth')
+    if eval_hook is not None and eval_hook.best_iter is not None and os.path.isfile(best_path):
+        from detectron2.checkpoint import DetectionCheckpointer
+
+        DetectionCheckpointer(trainer.model).load(best_path)
+        shutil.copyfile(best_path, os.path.join(cfg.OUTPUT_DIR, 'model_final.pth'))
+        print(f"Poids évalués : itération {eval_hook.best_iter} ({args.eval_metric} {eval_hook.best:.2f}, "
+              f"model_best.pth copié dans model_final.pth)")
+    else:
+        print(f"Poids évalués : dernière itération ({trainer.iter})")
 
     # --- Évaluation automatique détaillée ---
     print("\nÉvaluation du modèle sur le jeu de validation...")
     from detectron2.evaluation import COCOEvaluator, inference_on_dataset
     from detectron2.data import build_detection_test_loader
 
-    evaluator = COCOEvaluator("plan_val", output_dir=cfg.OUTPUT_DIR)
-    val_loader = build_detection_test_loader(cfg, "plan_val")
-    eval_results = inference_on_dataset(trainer.model, val_loader, evaluator)
+    with report.stage('eval'):
+        evaluator = COCOEvaluator("plan_val", output_dir=cfg.OUTPUT_DIR)
+        val_loader = build_detection_test_loader(cfg, "plan_val")
+        eval_results = inference_on_dataset(trainer.model, val_loader, evaluator)
     print("\n===== Résultats de l'évaluation COCO =====")
     print(eval_results)
     # Sauvegarde dans un fichier pour consultation ultérieure
     with open(os.path.join(cfg.OUTPUT_DIR, "eval_results.json"), "w") as f:
         json.dump(eval_results, f, indent=2, ensure_ascii=False)
+    report.close()
 
 if __name__ == "__main__":
     main()